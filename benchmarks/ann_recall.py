@@ -0,0 +1,166 @@
+# ann_recall.py
+"""Measure recall@k and search latency of ANN index types against the exact flat index
+
+Vectors come from an existing flat index (the same corpus the app serves) or
+are generated synthetically. A held-out sample of them is used as queries.
+
+    python -m benchmarks.ann_recall --index ./vectorstore/faiss_index \\
+        --config ivf_flat:nlist=256:nprobe=4,16,64 \\
+        --config ivf_pq:nlist=256:pq_m=32:nprobe=16 \\
+        --config hnsw:hnsw_m=32:ef_search=32,64,128
+
+Compression is measured the same way: `--config flat:encoding=sq8` stores
+one byte per component, `--dims 512 256` truncates the vectors to their
+leading dimensions (Matryoshka embeddings; synthetic vectors lose far more
+than real ones), and `--rescore 40` also reports recall after re-sorting 40
+candidates by exact float32 distance. Truth is always the exact search over
+the full vectors, so each row's recall loss includes every approximation.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+import numpy as np
+import faiss
+
+from src.index_factory import IndexConfig, build_index, search_parameters
+
+# Knobs applied at search time; every other key configures the build
+_SEARCH_KNOBS = ("nprobe", "ef_search")
+
+
+def parse_config(spec: str) -> Tuple[Dict, List[Dict]]:
+    """Parse `type:key=value:knob=v1,v2` into build kwargs and a list of search settings"""
+    index_type, *options = spec.split(":")
+    build, knobs = {"index_type": index_type}, {}
+    for option in options:
+        key, value = option.split("=", 1)
+        if key in _SEARCH_KNOBS:
+            knobs[key] = [int(v) for v in value.split(",")]
+        else:
+            build[key] = int(value) if value.isdigit() else value
+    settings = [{}]
+    for key, values in knobs.items():
+        settings = [{**setting, key: value} for setting in settings for value in values]
+    return build, settings
+
+
+def load_vectors(args) -> np.ndarray:
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        # Clustered data is closer to real embeddings than uniform noise
+        centers = rng.standard_normal((max(1, args.synthetic // 100), args.dim)).astype(np.float32)
+        vectors = centers[rng.integers(0, len(centers), args.synthetic)]
+        vectors += 0.3 * rng.standard_normal(vectors.shape).astype(np.float32)
+        return vectors
+    index = faiss.read_index(str(Path(args.index) / "index.faiss"))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def truncate(vectors: np.ndarray, dims: int) -> np.ndarray:
+    """Leading `dims` components of each vector, renormalized"""
+    vectors = vectors[:, :dims]
+    return np.ascontiguousarray(vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12))
+
+
+def percentile_ms(latencies: List[float], q: float) -> float:
+    return round(float(np.percentile(latencies, q)) * 1000, 3)
+
+
+def measure(index, queries: np.ndarray, truth: np.ndarray, k: int, params, rescore: int = 0,
+            vectors: np.ndarray = None) -> Dict:
+    """Recall and latency; with `rescore`, that many hits are re-sorted by exact distance to `vectors`"""
+    latencies = []
+    hits = 0
+    for i in range(len(queries)):
+        started = time.perf_counter()
+        _, positions = index.search(queries[i:i + 1], max(k, rescore), params=params)
+        found = positions[0]
+        if rescore:
+            found = found[found >= 0]
+            distances = ((vectors[found] - queries[i]) ** 2).sum(axis=1)
+            found = found[np.argsort(distances)]
+        latencies.append(time.perf_counter() - started)
+        hits += len(set(found[:k].tolist()) & set(truth[i, :k].tolist()))
+    started = time.perf_counter()
+    index.search(queries, k, params=params)
+    batch_seconds = time.perf_counter() - started
+    return {
+        f"recall@{k}": round(hits / (len(queries) * k), 4),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+        "batch_qps": round(len(queries) / batch_seconds, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default="./vectorstore/faiss_index", help="Directory of a flat index to read vectors from")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate this many vectors instead of reading an index")
+    parser.add_argument("--dim", type=int, default=1536, help="Dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, nargs="+", default=[4, 10])
+    parser.add_argument("--config", action="append", default=[], help="Index spec, repeatable")
+    parser.add_argument("--dims", type=int, nargs="+", default=[], help="Also test vectors truncated to these dimensions")
+    parser.add_argument("--rescore", type=int, default=0, help="Also report recall after rescoring this many candidates")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    vectors = np.ascontiguousarray(load_vectors(args), dtype=np.float32)
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(vectors))
+    n_queries = min(args.queries, len(vectors) // 10 or 1)
+    queries, base = vectors[order[:n_queries]], vectors[order[n_queries:]]
+    max_k = max(args.k)
+
+    full_dim = base.shape[1]
+    exact = faiss.IndexFlatL2(full_dim)
+    exact.add(base)
+    _, truth = exact.search(queries, max_k)
+
+    results = []
+    for dims in [full_dim] + [d for d in args.dims if d < full_dim]:
+        dim_base = base if dims == full_dim else truncate(base, dims)
+        dim_queries = queries if dims == full_dim else truncate(queries, dims)
+        for spec in ["flat"] + args.config:
+            build, settings = parse_config(spec)
+            config = IndexConfig(**build)
+            started = time.perf_counter()
+            sample = dim_base[rng.choice(len(dim_base), min(len(dim_base), config.train_size), replace=False)]
+            index = build_index(config, dims, sample)
+            index.add(dim_base)
+            build_seconds = time.perf_counter() - started
+            index_bytes = int(faiss.serialize_index(index).nbytes)
+            for setting in settings:
+                params = search_parameters(index, **setting)
+                row = {
+                    "index": config.describe(),
+                    "dim": dims,
+                    **setting,
+                    "vectors": len(base),
+                    "build_seconds": round(build_seconds, 2),
+                    "index_bytes": index_bytes,
+                    "bytes_per_vector": round(index_bytes / len(base), 1),
+                    # Against float32 vectors of the full dimension
+                    "compression": round(4 * full_dim * len(base) / index_bytes, 2),
+                }
+                for k in args.k:
+                    row[f"k={k}"] = measure(index, dim_queries, truth, k, params)
+                    if args.rescore:
+                        row[f"k={k},rescore={args.rescore}"] = measure(index, dim_queries, truth, k, params,
+                                                                      args.rescore, dim_base)
+                results.append(row)
+                print(json.dumps(row), file=sys.stderr)
+
+    report = {"queries": n_queries, "dim": int(full_dim), "results": results}
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# chunking.py
+"""Check the offset chunker against RecursiveCharacterTextSplitter and measure both in MB/s
+
+Texts are the pages of the files in a data directory, or generated: paragraphs
+of random words with occasional single newlines and overlong tokens, so every
+level of the separator hierarchy is exercised. Every text is split by both
+implementations and the chunks must be identical; the exit status is 1 if any
+text differs.
+
+    python -m benchmarks.chunking --synthetic-mb 20 --workers 1 4
+    python -m benchmarks.chunking --data ./data --unit tokens
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from src.chunker import chunk_texts, get_chunker
+
+
+def synthetic_texts(megabytes: float, seed: int) -> List[str]:
+    rng = np.random.default_rng(seed)
+    words = ["".join(rng.choice(list("abcdefghijklmnopqrstuvwxyz"), size=n)) for n in rng.integers(1, 12, 2000)]
+    texts, size = [], 0
+    while size < megabytes * 1e6:
+        paragraphs = []
+        for _ in range(rng.integers(1, 12)):
+            tokens = list(rng.choice(words, size=rng.integers(5, 400)))
+            if rng.random() < 0.05:
+                tokens.append("x" * int(rng.integers(500, 2500)))
+            if rng.random() < 0.3:
+                tokens[int(rng.integers(len(tokens)))] += "\n"
+            paragraphs.append(" ".join(tokens))
+        texts.append("\n\n".join(paragraphs))
+        size += len(texts[-1])
+    return texts
+
+
+def load_texts(data_dir: str) -> List[str]:
+    from src.document_processor import load_file
+    texts = []
+    for path in sorted(Path(data_dir).iterdir()):
+        if path.suffix.lower() in (".pdf", ".txt"):
+            texts.extend(doc.page_content for doc in load_file(path))
+    return texts
+
+
+def check_parity(texts: List[str], reference: RecursiveCharacterTextSplitter, chunker) -> Dict:
+    mismatched, chunks = [], 0
+    for i, text in enumerate(texts):
+        expected = reference.split_text(text)
+        chunks += len(expected)
+        if chunker.split_text(text) != expected:
+            mismatched.append(i)
+    return {"texts": len(texts), "chunks": chunks, "mismatched": len(mismatched), "first_mismatches": mismatched[:10]}
+
+
+def timed(fn, megabytes: float, repeat: int) -> Dict:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return {"seconds": round(best, 3), "mb_per_s": round(megabytes / best, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", help="Split the pages of the PDF and TXT files in this directory")
+    parser.add_argument("--synthetic-mb", type=float, default=10, help="Generate this many MB of text instead")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--unit", choices=["chars", "tokens"], default="chars")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1], help="Process pool sizes for the offset chunker")
+    parser.add_argument("--repeat", type=int, default=3, help="Report the best of this many runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    texts = load_texts(args.data) if args.data else synthetic_texts(args.synthetic_mb, args.seed)
+    megabytes = sum(len(text.encode("utf-8")) for text in texts) / 1e6
+    if args.unit == "tokens":
+        reference = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    else:
+        reference = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    chunker = get_chunker(args.chunk_size, args.chunk_overlap, args.unit)
+
+    parity = check_parity(texts, reference, chunker)
+    print(json.dumps({"parity": parity}), file=sys.stderr)
+
+    results = [{"splitter": "RecursiveCharacterTextSplitter", "workers": 1,
+                **timed(lambda: [reference.split_text(text) for text in texts], megabytes, args.repeat)}]
+    for workers in args.workers:
+        results.append({"splitter": "Chunker", "workers": workers, **timed(
+            lambda: chunk_texts(texts, args.chunk_size, args.chunk_overlap, args.unit, workers=workers),
+            megabytes, args.repeat)})
+        print(json.dumps(results[-1]), file=sys.stderr)
+
+    report = {"megabytes": round(megabytes, 2), "texts": len(texts), "chunk_size": args.chunk_size,
+              "chunk_overlap": args.chunk_overlap, "unit": args.unit, "parity": parity, "results": results}
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+    if parity["mismatched"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
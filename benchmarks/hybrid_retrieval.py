@@ -0,0 +1,176 @@
+# hybrid_retrieval.py
+"""Compare dense-only and hybrid (BM25 + dense, reciprocal rank fusion) retrieval
+
+Quality mode runs labelled queries against a saved index with the app's own
+RAGPipeline (and so its embedding model) and reports recall@k, MRR and
+latency for each retrieval mode. Each line of the queries file is
+`{"question": ..., "chunk_ids": [...]}` or `{"question": ..., "source_file": ...}`.
+Without a queries file, known-item queries are sampled from the index: the
+rarest terms of a chunk, which is what identifier and part-number searches
+look like.
+
+    python -m benchmarks.hybrid_retrieval --index ./vectorstore/faiss_index --queries queries.jsonl
+
+Scale mode builds a BM25 index over a synthetic Zipfian corpus and reports
+build time, size on disk and keyword query latency:
+
+    python -m benchmarks.hybrid_retrieval --synthetic 1000000
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+from langchain_core.documents import Document
+
+from src.bm25_index import BM25_DIR, BM25Index, tokenize
+from src.rag_pipeline import RAGPipeline
+
+
+def percentile_ms(latencies: List[float], q: float) -> float:
+    return round(float(np.percentile(latencies, q)) * 1000, 3)
+
+
+def load_queries(path: str) -> List[Dict]:
+    return [json.loads(line) for line in Path(path).read_text().splitlines() if line.strip()]
+
+
+def sample_known_item_queries(pipeline: RAGPipeline, bm25: BM25Index, n: int, seed: int) -> List[Dict]:
+    """Queries made of the three rarest terms of randomly chosen chunks"""
+    rng = np.random.default_rng(seed)
+    df = np.diff(np.asarray(bm25.indptr))
+    queries = []
+    for i in rng.choice(len(bm25), min(n, len(bm25)), replace=False):
+        chunk_id = bm25.chunk_ids[i].decode("utf-8")
+        doc = pipeline.vectorstore.docstore.search(chunk_id)
+        if not isinstance(doc, Document):
+            continue
+        terms = list(dict.fromkeys(tokenize(doc.page_content)))
+        positions = np.searchsorted(bm25.terms, np.array([t.encode("utf-8")[:32] for t in terms], dtype="S32"))
+        positions = np.minimum(positions, len(bm25.terms) - 1)
+        rarest = [terms[j] for j in np.argsort(df[positions])[:3]]
+        queries.append({"question": " ".join(rarest), "chunk_ids": [chunk_id]})
+    return queries
+
+
+def is_relevant(doc: Document, query: Dict) -> bool:
+    if "chunk_ids" in query:
+        return (doc.id or doc.metadata.get("chunk_id")) in query["chunk_ids"]
+    return doc.metadata.get("source_file") == query.get("source_file")
+
+
+def evaluate(pipeline: RAGPipeline, queries: List[Dict], embeddings: List[List[float]], k: int) -> Dict:
+    latencies, hits, reciprocal_ranks = [], 0, []
+    for query, embedding in zip(queries, embeddings):
+        started = time.perf_counter()
+        docs = pipeline._search(query["question"], embedding, k)
+        latencies.append(time.perf_counter() - started)
+        ranks = [rank for rank, doc in enumerate(docs, start=1) if is_relevant(doc, query)]
+        hits += bool(ranks)
+        reciprocal_ranks.append(1.0 / ranks[0] if ranks else 0.0)
+    return {
+        f"recall@{k}": round(hits / len(queries), 4),
+        f"mrr@{k}": round(float(np.mean(reciprocal_ranks)), 4),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+    }
+
+
+def run_quality(args) -> Dict:
+    pipeline = RAGPipeline(args.index)
+    if not pipeline.load_vectorstore():
+        sys.exit(f"No vectorstore at {args.index}")
+    bm25 = pipeline._index.bm25
+    if bm25 is None:
+        sys.exit("The index has no BM25 keyword index yet; save it once with this version of DocumentProcessor")
+
+    queries = load_queries(args.queries) if args.queries else sample_known_item_queries(
+        pipeline, bm25, args.sample, args.seed)
+    # Embed once so both modes are timed on retrieval alone
+    embeddings = [pipeline.embeddings.embed_query(query["question"]) for query in queries]
+    results = []
+    for mode in ("dense", "hybrid"):
+        pipeline.retrieval_mode = mode
+        row = {"mode": mode}
+        for k in args.k:
+            row[f"k={k}"] = evaluate(pipeline, queries, embeddings, k)
+        results.append(row)
+        print(json.dumps(row), file=sys.stderr)
+    return {"queries": len(queries), "chunks": len(bm25), "rrf_k": pipeline.rrf_k,
+            "hybrid_candidates": pipeline.hybrid_candidates, "results": results}
+
+
+class _SyntheticDocstore:
+    """Just enough of a docstore for BM25Index.updated()"""
+
+    def __init__(self, n: int, vocab: int, seed: int):
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        self.vocab = vocab
+
+    def all_ids(self) -> List[str]:
+        return [f"c{i}" for i in range(self.n)]
+
+    def get_documents(self, ids) -> List[Document]:
+        # Zipfian term frequencies, plus one unique identifier per chunk
+        words = self.rng.zipf(1.2, size=(len(ids), 150)) % self.vocab
+        return [Document(id=id_, page_content=" ".join(f"w{w}" for w in row) + f" PN-{id_}")
+                for id_, row in zip(ids, words)]
+
+
+def run_scale(args) -> Dict:
+    docstore = _SyntheticDocstore(args.synthetic, args.vocab, args.seed)
+    started = time.perf_counter()
+    index = BM25Index.empty().updated(docstore)
+    build_seconds = time.perf_counter() - started
+    with tempfile.TemporaryDirectory() as directory:
+        index.save(directory)
+        index_bytes = sum(f.stat().st_size for f in (Path(directory) / BM25_DIR).iterdir())
+        started = time.perf_counter()
+        index = BM25Index.load(directory)
+        load_ms = (time.perf_counter() - started) * 1000
+
+        rng = np.random.default_rng(args.seed + 1)
+        workloads = {
+            "identifier": [f"PN-c{i}" for i in rng.integers(0, args.synthetic, args.sample)],
+            "rare_terms": [f"w{a} w{b}" for a, b in rng.integers(args.vocab // 2, args.vocab, (args.sample, 2))],
+            "common_terms": [f"w{a} w{b}" for a, b in rng.integers(1, 20, (args.sample, 2))],
+        }
+        results = {}
+        for name, queries in workloads.items():
+            latencies = []
+            for query in queries:
+                started = time.perf_counter()
+                index.search(query, max(args.k))
+                latencies.append(time.perf_counter() - started)
+            results[name] = {"p50_ms": percentile_ms(latencies, 50), "p99_ms": percentile_ms(latencies, 99)}
+            print(json.dumps({name: results[name]}), file=sys.stderr)
+    return {"chunks": args.synthetic, "terms": len(index.terms), "postings": len(index.docs),
+            "build_seconds": round(build_seconds, 2), "index_bytes": index_bytes,
+            "load_ms": round(load_ms, 3), "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default="./vectorstore/faiss_index", help="Saved index to evaluate")
+    parser.add_argument("--queries", help="JSONL file of labelled queries")
+    parser.add_argument("--sample", type=int, default=200, help="Number of sampled queries")
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark BM25 alone on this many synthetic chunks")
+    parser.add_argument("--vocab", type=int, default=200000, help="Vocabulary size of the synthetic corpus")
+    parser.add_argument("--k", type=int, nargs="+", default=[4, 10])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    report = run_scale(args) if args.synthetic else run_quality(args)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# rerank.py
+"""Weigh cross-encoder reranking cost against the prompt tokens it saves
+
+For each k, compares the retriever's own top-k with the cross-encoder's
+top-k out of `--candidates` over-fetched hits: recall@k, MRR, prompt tokens
+of the chunks sent to the LLM, and rerank latency. It then reports the
+smallest reranked k that matches the recall of the largest plain k, and how
+many prompt tokens per query that saves. Queries are given or sampled as in
+hybrid_retrieval.py.
+
+    python -m benchmarks.rerank --index ./vectorstore/faiss_index --candidates 30 --k 2 4 8
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.hybrid_retrieval import is_relevant, load_queries, percentile_ms, sample_known_item_queries
+from src.rag_pipeline import RAGPipeline
+from src.reranker import CrossEncoderReranker
+
+
+def score(pipeline: RAGPipeline, queries: List[Dict], rankings: List[List[Document]], k: int) -> Dict:
+    hits, reciprocal_ranks, tokens = 0, [], []
+    for query, docs in zip(queries, rankings):
+        docs = docs[:k]
+        ranks = [rank for rank, doc in enumerate(docs, start=1) if is_relevant(doc, query)]
+        hits += bool(ranks)
+        reciprocal_ranks.append(1.0 / ranks[0] if ranks else 0.0)
+        tokens.append(sum(pipeline.context_builder.count_tokens(doc.page_content) for doc in docs))
+    return {
+        f"recall@{k}": round(hits / len(queries), 4),
+        f"mrr@{k}": round(float(np.mean(reciprocal_ranks)), 4),
+        "prompt_tokens": round(float(np.mean(tokens)), 1),
+    }
+
+
+def run(args) -> Dict:
+    pipeline = RAGPipeline(args.index)
+    if not pipeline.load_vectorstore():
+        sys.exit(f"No vectorstore at {args.index}")
+    if pipeline.reranker is None:
+        pipeline.reranker = CrossEncoderReranker.from_env()
+    pipeline.rerank_candidates = args.candidates
+    if args.queries:
+        queries = load_queries(args.queries)
+    elif pipeline._index.bm25 is not None:
+        queries = sample_known_item_queries(pipeline, pipeline._index.bm25, args.sample, args.seed)
+    else:
+        sys.exit("Pass --queries; sampling queries needs the BM25 index")
+
+    embeddings = [pipeline.embeddings.embed_query(query["question"]) for query in queries]
+    candidates = [pipeline._search(query["question"], embedding, args.candidates)
+                  for query, embedding in zip(queries, embeddings)]
+    max_k = max(args.k)
+    latencies, reranked = [], []
+    for query, docs in zip(queries, candidates):
+        started = time.perf_counter()
+        reranked.append(pipeline.reranker.rerank(query["question"], docs, max_k)[0])
+        latencies.append(time.perf_counter() - started)
+
+    results = []
+    for k in sorted(args.k):
+        row = {"k": k, "retriever": score(pipeline, queries, candidates, k),
+               "reranked": score(pipeline, queries, reranked, k)}
+        results.append(row)
+        print(json.dumps(row), file=sys.stderr)
+
+    # Fewest reranked chunks that do as well as the most plain chunks
+    target = results[-1]["retriever"][f"recall@{max_k}"]
+    matching = next((row for row in results if row["reranked"][f"recall@{row['k']}"] >= target), None)
+    return {
+        "queries": len(queries),
+        "candidates": args.candidates,
+        "model": pipeline.reranker.model_name,
+        # Scores computed cold: no query repeats, so the score cache never hits
+        "rerank_p50_ms": percentile_ms(latencies, 50),
+        "rerank_p99_ms": percentile_ms(latencies, 99),
+        "results": results,
+        "equal_recall": matching and {
+            "k": matching["k"],
+            "prompt_tokens_saved": round(results[-1]["retriever"]["prompt_tokens"]
+                                         - matching["reranked"]["prompt_tokens"], 1),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default="./vectorstore/faiss_index", help="Saved index to evaluate")
+    parser.add_argument("--queries", help="JSONL file of labelled queries")
+    parser.add_argument("--sample", type=int, default=200, help="Number of sampled queries")
+    parser.add_argument("--candidates", type=int, default=30, help="Hits over-fetched for reranking")
+    parser.add_argument("--k", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+# throughput.py
+"""Offline benchmark of ingestion and query throughput with deterministic fakes
+
+Generates synthetic corpora (text and PDF files), swaps OpenAIEmbeddings and
+ChatOpenAI for local fakes with configurable latency, and for each corpus
+size measures:
+
+- process_documents(): wall time, chunks/s, input MB/s, per-stage timings,
+  peak RSS and size of the saved index
+- retrieve_context(): p50/p99 latency for each k, on precomputed query
+  embeddings so only search and lookup are timed
+- query(): end-to-end QPS and latency at each concurrency level
+
+Each corpus size runs in a fresh subprocess so peak RSS and the process-wide
+caches are per size. Results are JSON, so runs on two commits can be diffed:
+
+    python -m benchmarks.throughput --files 10 100 1000 --output bench.json
+
+No network access is needed, except that tiktoken must already have its BPE
+file cached (see TIKTOKEN_CACHE_DIR).
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+_SYLLABLES = ["ka", "ri", "to", "men", "sa", "lo", "vi", "dar", "qu", "el", "po", "nix", "tra", "bel", "on", "us"]
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic hash-seeded unit vectors, with simulated API latency per call and per text"""
+
+    model = "fake-embedding"
+
+    def __init__(self, dimensions: int = 1536, latency_ms: float = 0.0, per_text_ms: float = 0.0):
+        self.dimensions = dimensions
+        self.latency_ms = latency_ms
+        self.per_text_ms = per_text_ms
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _delay(self, count: int) -> float:
+        return (self.latency_ms + self.per_text_ms * count) / 1000
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self._delay(len(texts)))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self._delay(1))
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self._delay(len(texts)))
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self._delay(1))
+        return self._vector(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Answers with a fixed-length echo of the question after `latency_ms`"""
+
+    latency_ms: float = 0.0
+    answer_words: int = 50
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer(self, messages: List[BaseMessage]) -> ChatResult:
+        words = str(messages[-1].content).split()[-8:] or ["answer"]
+        text = " ".join(words[i % len(words)] for i in range(self.answer_words))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency_ms / 1000)
+        return self._answer(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency_ms / 1000)
+        return self._answer(messages)
+
+
+def make_vocabulary(size: int, rng: np.random.Generator) -> List[str]:
+    """`size` distinct pronounceable words: the numbers 1..size spelled in base-16 syllables"""
+    words = []
+    for number in range(1, size + 1):
+        syllables = []
+        while number:
+            number, digit = divmod(number, len(_SYLLABLES))
+            syllables.append(_SYLLABLES[digit])
+        words.append("".join(syllables))
+    rng.shuffle(words)
+    return words
+
+
+def make_paragraphs(words: int, vocabulary: List[str], rng: np.random.Generator) -> List[str]:
+    """Zipfian word frequencies, sentences of 8-20 words, paragraphs of 3-6 sentences"""
+    ranks = np.minimum(rng.zipf(1.3, words), len(vocabulary)) - 1
+    paragraphs, sentences, position = [], [], 0
+    while position < words:
+        length = int(rng.integers(8, 21))
+        sentence = " ".join(vocabulary[r] for r in ranks[position:position + length])
+        sentences.append(sentence[:1].upper() + sentence[1:] + ".")
+        position += length
+        if len(sentences) >= rng.integers(3, 7):
+            paragraphs.append(" ".join(sentences))
+            sentences = []
+    if sentences:
+        paragraphs.append(" ".join(sentences))
+    return paragraphs
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: Path, paragraphs: List[str], line_chars: int = 90, page_lines: int = 50):
+    """Write a minimal text-only PDF, one Helvetica line per wrapped line of text"""
+    lines = []
+    for paragraph in paragraphs:
+        current = ""
+        for word in paragraph.split():
+            if current and len(current) + len(word) + 1 > line_chars:
+                lines.append(current)
+                current = word
+            else:
+                current = f"{current} {word}" if current else word
+        lines.extend([current, ""])
+    pages = [lines[i:i + page_lines] for i in range(0, len(lines), page_lines)] or [[]]
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in pages:
+        stream = "BT /F1 10 Tf 12 TL 50 800 Td " + " ".join(f"({_pdf_escape(line)}) '" for line in page) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+
+    output, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    path.write_bytes(bytes(output))
+
+
+def write_corpus(directory: Path, files: int, words_per_file: int, pdf_fraction: float,
+                 vocabulary: List[str], seed: int) -> Dict:
+    """Write `files` documents, roughly `pdf_fraction` of them as PDF"""
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    pdfs = 0
+    for i in range(files):
+        paragraphs = make_paragraphs(words_per_file, vocabulary, rng)
+        if rng.random() < pdf_fraction:
+            write_pdf(directory / f"doc{i:06d}.pdf", paragraphs)
+            pdfs += 1
+        else:
+            (directory / f"doc{i:06d}.txt").write_text("\n\n".join(paragraphs), encoding="utf-8")
+    total_bytes = sum(f.stat().st_size for f in directory.iterdir())
+    return {"files": files, "pdf_files": pdfs, "words_per_file": words_per_file, "bytes": total_bytes}
+
+
+def percentile_ms(latencies: List[float], q: float) -> float:
+    return round(float(np.percentile(latencies, q)) * 1000, 3)
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(who).ru_maxrss * scale / 2 ** 20, 1)
+
+
+def directory_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in Path(path).resolve().rglob("*") if f.is_file())
+
+
+def sample_questions(vocabulary: List[str], n: int, seed: int) -> List[str]:
+    rng = np.random.default_rng(seed)
+    ranks = np.minimum(rng.zipf(1.3, (n, 6)), len(vocabulary)) - 1
+    return [" ".join(vocabulary[r] for r in row) + "?" for row in ranks]
+
+
+def bench_retrieval(pipeline, questions: List[str], ks: List[int]) -> Dict:
+    embeddings = [pipeline.embeddings.embed_query(question) for question in questions]
+    pipeline.retrieve_context(questions[0], k=max(ks), embedding=embeddings[0])
+    results = {}
+    for k in ks:
+        latencies = []
+        for question, embedding in zip(questions, embeddings):
+            started = time.perf_counter()
+            pipeline.retrieve_context(question, k=k, embedding=embedding)
+            latencies.append(time.perf_counter() - started)
+        results[f"k={k}"] = {"p50_ms": percentile_ms(latencies, 50), "p99_ms": percentile_ms(latencies, 99)}
+    return results
+
+
+def bench_queries(pipeline, questions: List[str], concurrency: List[int], k: int) -> Dict:
+    results = {}
+    for workers in concurrency:
+        latencies = []
+
+        def run(question: str):
+            started = time.perf_counter()
+            result = pipeline.query(question, k=k)
+            latencies.append(time.perf_counter() - started)
+            if "error" in result:
+                raise RuntimeError(result["error"])
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run, questions))
+        elapsed = time.perf_counter() - started
+        results[f"concurrency={workers}"] = {
+            "qps": round(len(questions) / elapsed, 2),
+            "p50_ms": percentile_ms(latencies, 50),
+            "p99_ms": percentile_ms(latencies, 99),
+        }
+        print(json.dumps({f"concurrency={workers}": results[f"concurrency={workers}"]}), file=sys.stderr)
+    return results
+
+
+def run_size(args, files: int) -> Dict:
+    """Benchmark one corpus size; runs inside its own subprocess"""
+    workdir = Path(tempfile.mkdtemp(prefix="rag-bench-"))
+    try:
+        return _run_size(args, files, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run_size(args, files: int, workdir: Path) -> Dict:
+    # A fresh embedding cache, so every chunk is really embedded
+    os.environ["EMBEDDING_CACHE_PATH"] = str(workdir / "embedding_cache.sqlite")
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    from src.document_processor import DocumentProcessor
+    from src.embedding_cache import CachedEmbeddings, get_embedding_cache
+    from src.embedding_executor import EmbeddingExecutor
+    from src.rag_pipeline import RAGPipeline
+
+    vocabulary = make_vocabulary(args.vocab, np.random.default_rng(args.seed))
+    corpus = write_corpus(workdir / "data", files, args.words_per_file, args.pdf_fraction,
+                          vocabulary, args.seed + files)
+    fake = FakeEmbeddings(args.dimensions, args.embed_latency_ms, args.embed_per_text_ms)
+    vectorstore_path = workdir / "vectorstore" / "faiss_index"
+
+    processor = DocumentProcessor(str(workdir / "data"), str(vectorstore_path))
+    processor.embeddings = CachedEmbeddings(EmbeddingExecutor.from_env(fake), get_embedding_cache())
+    started = time.perf_counter()
+    _, chunks = processor.process_documents()
+    seconds = time.perf_counter() - started
+    ingestion = {
+        "seconds": round(seconds, 3),
+        "chunks": chunks,
+        "chunks_per_second": round(chunks / seconds, 1),
+        "mb_per_second": round(corpus["bytes"] / 2 ** 20 / seconds, 3),
+        "timings": processor.last_timings,
+        "peak_rss_mb": peak_rss_mb(),
+        "parse_workers_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "index_bytes": directory_bytes(vectorstore_path),
+    }
+    print(json.dumps({"files": files, "ingestion": ingestion}), file=sys.stderr)
+
+    pipeline = RAGPipeline(str(vectorstore_path))
+    pipeline.embeddings = CachedEmbeddings(fake, get_embedding_cache())
+    pipeline.llm = FakeChatModel(latency_ms=args.llm_latency_ms)
+    # Measure the full path every time rather than cached answers
+    pipeline.answer_cache.max_size = 0
+    if not pipeline.load_vectorstore():
+        raise RuntimeError("The benchmark index could not be loaded")
+    questions = sample_questions(vocabulary, args.queries, args.seed + 1)
+    return {
+        "corpus": corpus,
+        "ingestion": ingestion,
+        "retrieval": bench_retrieval(pipeline, questions, args.k),
+        "query": bench_queries(pipeline, questions, args.concurrency, k=min(args.k)),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[10, 100], help="Corpus sizes, in files")
+    parser.add_argument("--words-per-file", type=int, default=2000)
+    parser.add_argument("--pdf-fraction", type=float, default=0.3, help="Share of files written as PDF")
+    parser.add_argument("--vocab", type=int, default=20000, help="Vocabulary size of the synthetic text")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Fake embedding dimensions")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Simulated latency per embedding call")
+    parser.add_argument("--embed-per-text-ms", type=float, default=0.0, help="Added latency per embedded text")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated latency per completion")
+    parser.add_argument("--k", type=int, nargs="+", default=[4, 10, 50])
+    parser.add_argument("--queries", type=int, default=200, help="Queries per measurement")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_size is not None:
+        print(json.dumps(run_size(args, args.run_size)))
+        return
+
+    results = []
+    passthrough = list(argv if argv is not None else sys.argv[1:])
+    for files in args.files:
+        child = subprocess.run(
+            [sys.executable, "-m", "benchmarks.throughput", *passthrough, "--run-size", str(files)],
+            stdout=subprocess.PIPE, text=True,
+        )
+        if child.returncode != 0:
+            sys.exit(f"Benchmark of {files} files failed")
+        results.append(json.loads(child.stdout.strip().splitlines()[-1]))
+
+    report: Dict[str, Any] = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {name: value for name, value in vars(args).items() if name not in ("output", "run_size")},
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
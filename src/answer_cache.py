@@ -0,0 +1,171 @@
+# answer_cache.py
+import copy
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, int, object]
+
+
+def normalize_question(question: str) -> str:
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?!. ")
+
+
+class _Entry:
+    __slots__ = ("result", "embedding", "created_at", "latency")
+
+    def __init__(self, result: dict, embedding: Optional[np.ndarray], latency: float):
+        self.result = result
+        self.embedding = embedding
+        self.created_at = time.monotonic()
+        self.latency = latency
+
+
+class AnswerCache:
+    """Two-level cache of query results
+
+    The exact tier is an LRU keyed by (normalized question, k, index version).
+    The semantic tier returns a cached result when a new question's embedding
+    is within `similarity_threshold` cosine similarity of a cached one for the
+    same k and index version. Entries expire after `ttl_seconds`, the least
+    recently used are evicted beyond `max_size`, and everything is dropped
+    when the index version changes.
+    """
+
+    def __init__(self, max_size: int = 512, ttl_seconds: float = 3600,
+                 similarity_threshold: float = 0.95):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        # Stacked unit vectors of the semantic tier, rebuilt lazily after changes
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[CacheKey] = []
+        self.counters = {
+            "hits_exact": 0, "hits_semantic": 0, "misses": 0,
+            "evictions": 0, "expirations": 0, "invalidations": 0,
+            "latency_saved_seconds": 0.0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _key(self, question: str, k: int, version) -> CacheKey:
+        return (normalize_question(question), k, version)
+
+    def _expired(self, entry: _Entry) -> bool:
+        return self.ttl_seconds > 0 and time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def _remove(self, key: CacheKey):
+        del self._entries[key]
+        self._matrix = None
+
+    def _hit(self, key: CacheKey, entry: _Entry, tier: str) -> dict:
+        self._entries.move_to_end(key)
+        self.counters[f"hits_{tier}"] += 1
+        self.counters["latency_saved_seconds"] += entry.latency
+        result = copy.deepcopy(entry.result)
+        result["cache_hit"] = tier
+        return result
+
+    def set_version(self, version):
+        """Invalidate every entry when the vectorstore changes"""
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self.counters["invalidations"] += 1
+                    logger.info(f"Vectorstore changed, dropping {len(self._entries)} cached answers")
+                self._entries.clear()
+                self._matrix = None
+                self._version = version
+
+    def get_exact(self, question: str, k: int, version) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        key = self._key(question, k, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                self._remove(key)
+                self.counters["expirations"] += 1
+                return None
+            return self._hit(key, entry, "exact")
+
+    def _semantic_matrix(self) -> Tuple[Optional[np.ndarray], List[CacheKey]]:
+        if self._matrix is None:
+            keys = [key for key, entry in self._entries.items() if entry.embedding is not None]
+            self._matrix_keys = keys
+            self._matrix = np.stack([self._entries[key].embedding for key in keys]) if keys else None
+        return self._matrix, self._matrix_keys
+
+    def get_semantic(self, embedding: Sequence[float], k: int, version) -> Optional[dict]:
+        """Look up a cached answer by question embedding; counts a miss if none is close enough"""
+        if not self.enabled:
+            return None
+        query = _unit(embedding)
+        with self._lock:
+            matrix, keys = self._semantic_matrix()
+            if matrix is not None and matrix.shape[1] == query.shape[0]:
+                scores = matrix @ query
+                for i in np.argsort(-scores):
+                    if scores[i] < self.similarity_threshold:
+                        break
+                    key = keys[i]
+                    if key[1] != k or key[2] != version:
+                        continue
+                    entry = self._entries[key]
+                    if self._expired(entry):
+                        continue
+                    return self._hit(key, entry, "semantic")
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, question: str, k: int, version, result: dict,
+            embedding: Optional[Sequence[float]] = None, latency: float = 0.0):
+        if not self.enabled:
+            return
+        key = self._key(question, k, version)
+        entry = _Entry(copy.deepcopy(result), _unit(embedding) if embedding is not None else None, latency)
+        with self._lock:
+            if version != self._version:
+                # Computed against an index that has since been replaced
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._matrix = None
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self.counters)
+            counters["size"] = len(self._entries)
+        hits = counters["hits_exact"] + counters["hits_semantic"]
+        lookups = hits + counters["misses"]
+        counters["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        counters["latency_saved_seconds"] = round(counters["latency_saved_seconds"], 3)
+        return counters
+
+
+def _unit(vector: Sequence[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
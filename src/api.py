@@ -0,0 +1,208 @@
+# api.py
+import json
+import os
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from .document_processor import DocumentProcessor
+from .ingest_queue import get_ingest_queue, start_ingest_worker
+from .manifest import IndexManifest
+from .metadata_index import save_file_tags
+from .metrics import get_metrics
+from .query_batcher import QueryBatcher
+from .rag_pipeline import RAGPipeline
+from .session_store import get_session_store
+from .shards import ShardManifest, is_sharded
+import logging
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "./data")
+VECTORSTORE_PATH = os.getenv("VECTORSTORE_PATH", "./vectorstore/faiss_index")
+# Earlier messages of a session loaded for rewriting follow-up questions
+CONDENSE_HISTORY_MESSAGES = int(os.getenv("CONDENSE_HISTORY_MESSAGES", "6"))
+
+class QueryFilters(BaseModel):
+    source_files: Optional[List[str]] = None
+    pages: Optional[List[int]] = None
+    tags: Optional[List[str]] = None
+    uploaded_after: Optional[float] = None
+    uploaded_before: Optional[float] = None
+
+
+class QueryRequest(BaseModel):
+    question: str = Field(..., min_length=1)
+    k: int = Field(4, ge=1, le=50)
+    # Search only the matching documents
+    filters: Optional[QueryFilters] = None
+    # Answer as a follow-up in this chat session, recording the exchange in it
+    session_id: Optional[str] = None
+
+    def filter_dict(self) -> Optional[dict]:
+        return self.filters.model_dump(exclude_none=True) or None if self.filters else None
+
+
+@lru_cache(maxsize=None)
+def get_rag_pipeline() -> RAGPipeline:
+    pipeline = RAGPipeline(VECTORSTORE_PATH)
+    pipeline.query_batcher = QueryBatcher.from_env(pipeline)
+    return pipeline
+
+
+@lru_cache(maxsize=None)
+def get_processor() -> DocumentProcessor:
+    return DocumentProcessor(DATA_DIR, VECTORSTORE_PATH)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Ingestion runs in the background; requests only enqueue jobs
+    worker = start_ingest_worker(DocumentProcessor(DATA_DIR, VECTORSTORE_PATH))
+    yield
+    worker.stop()
+
+
+app = FastAPI(title="RAG Chatbot API", lifespan=lifespan)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+async def _session_history(session_id: Optional[str]) -> Optional[List[dict]]:
+    if session_id is None or CONDENSE_HISTORY_MESSAGES <= 0:
+        return None
+    return await run_in_threadpool(get_session_store().get_messages, session_id, CONDENSE_HISTORY_MESSAGES)
+
+
+async def _record_exchange(session_id: Optional[str], question: str, result: dict):
+    if session_id is None or "error" in result:
+        return
+    store = get_session_store()
+    await run_in_threadpool(store.add_message, session_id, "user", question)
+    await run_in_threadpool(store.add_message, session_id, "bot", result["answer"], result.get("sources"))
+
+
+@app.post("/query")
+async def query(request: QueryRequest):
+    history = await _session_history(request.session_id)
+    result = await get_rag_pipeline().aquery(request.question, k=request.k, filters=request.filter_dict(),
+                                             session_id=request.session_id, history=history)
+    await _record_exchange(request.session_id, request.question, result)
+    return result
+
+
+@app.post("/query/stream")
+async def query_stream(request: QueryRequest):
+    """Stream query events as newline-delimited JSON: sources, tokens, then done (or error)"""
+    async def events():
+        history = await _session_history(request.session_id)
+        async for event in get_rag_pipeline().aquery_stream(request.question, k=request.k,
+                                                            filters=request.filter_dict(),
+                                                            session_id=request.session_id, history=history):
+            if event["type"] == "done":
+                await _record_exchange(request.session_id, request.question, event)
+            yield json.dumps(event) + "\n"
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.post("/documents", status_code=202)
+async def upload_documents(files: List[UploadFile] = File(...), tags: str = Form("")):
+    """Save uploaded files to the data directory and queue a job to index them
+
+    `tags` is a comma-separated list attached to every uploaded file, for
+    filtering queries by tag.
+    """
+    processor = get_processor()
+    processor.data_dir.mkdir(parents=True, exist_ok=True)
+    saved = []
+    for upload in files:
+        # Never let a client-supplied name escape the data directory
+        file_path = processor.data_dir / Path(upload.filename or "").name
+        if file_path.suffix.lower() not in processor.supported_extensions:
+            raise HTTPException(status_code=400, detail=f"Unsupported file type: {upload.filename}")
+        with open(file_path, "wb") as f:
+            while chunk := await upload.read(1 << 20):
+                f.write(chunk)
+        saved.append(file_path.name)
+        if tags.strip():
+            save_file_tags(processor.data_dir, file_path.name, tags.split(","))
+
+    job_id = get_ingest_queue().enqueue("upload", saved)
+    return {"job_id": job_id, "files": saved}
+
+
+@app.get("/documents")
+async def list_documents():
+    """Indexed documents with chunk counts, tags and upload time, for document pickers"""
+    return await run_in_threadpool(get_rag_pipeline().list_documents)
+
+
+@app.post("/sync", status_code=202)
+async def sync_documents():
+    """Queue a job that brings the index in line with the data directory"""
+    return {"job_id": get_ingest_queue().enqueue("sync")}
+
+
+@app.get("/jobs")
+async def list_jobs(limit: int = 20):
+    return get_ingest_queue().list_jobs(limit)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int):
+    job = get_ingest_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.get("/index")
+async def index_status():
+    """Published index version and size (per shard when sharded), plus serving-side cache and batching stats"""
+    pipeline = get_rag_pipeline()
+    exists = get_processor().vectorstore_exists()
+    status = {"exists": exists, "pending_jobs": get_ingest_queue().pending_count()}
+    if exists and is_sharded(VECTORSTORE_PATH):
+        shards = await run_in_threadpool(ShardManifest.load, VECTORSTORE_PATH)
+        described = shards.describe()
+        status.update({
+            "version": shards.version,
+            "files": sum(shard["files"] for shard in described.values()),
+            "chunks": sum(shard["chunks"] for shard in described.values()),
+            "index_type": get_processor().index_config.describe(),
+            "loaded_version": pipeline.index_version,
+            "shards": described,
+        })
+    elif exists:
+        manifest = await run_in_threadpool(IndexManifest.load, VECTORSTORE_PATH)
+        status.update({
+            "version": manifest.version,
+            "files": len(manifest.files),
+            "chunks": len(manifest.all_chunk_ids()),
+            "index_type": get_processor().index_config.describe(),
+            "loaded_version": pipeline.index_version,
+        })
+    status["answer_cache"] = pipeline.answer_cache.stats()
+    status["query_batching"] = pipeline.query_batcher.stats()
+    status["conversation"] = pipeline.conversation.stats()
+    if pipeline.reranker is not None:
+        status["reranker"] = pipeline.reranker.stats()
+    return status
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Stage latency and token histograms in the Prometheus text format"""
+    return PlainTextResponse(get_metrics().render(), media_type="text/plain; version=0.0.4")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("API_HOST", "0.0.0.0"), port=int(os.getenv("API_PORT", "8000")))
@@ -0,0 +1,212 @@
+# bm25_index.py
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+BM25_DIR = "bm25"
+
+# Terms longer than this are truncated; identifiers and words are far shorter
+MAX_TERM_BYTES = 32
+
+_ARRAYS = ("terms", "indptr", "docs", "tfs", "doc_len", "chunk_ids")
+
+# Words, plus identifiers such as "XJ-9000", "v2.1.3" or "config.yaml" kept whole
+_TOKEN_RE = re.compile(r"\w+(?:[-./:]\w+)*")
+_COMPOUND_RE = re.compile(r"\w+(?:[-./:]\w+)+")
+_PART_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; compound identifiers also yield their parts"""
+    text = text.lower()
+    tokens = _TOKEN_RE.findall(text)
+    compounds = _COMPOUND_RE.findall(text)
+    if compounds:
+        tokens.extend(_PART_RE.findall(" ".join(compounds)))
+    return tokens
+
+
+def _encode_terms(terms: Iterable[str]) -> np.ndarray:
+    return np.array([term.encode("utf-8")[:MAX_TERM_BYTES] for term in terms], dtype=f"S{MAX_TERM_BYTES}")
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Merge ranked id lists by summing 1 / (k + rank) over the lists each id appears in"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking, start=1):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """Okapi BM25 over chunk text, stored as a CSR inverted index
+
+    `terms` is a sorted fixed-width byte array, so a term is found with a
+    binary search; its postings are `docs[indptr[t]:indptr[t + 1]]` with term
+    frequencies in `tfs`. On disk every array is a plain .npy file that is
+    memory-mapped on load, so opening even a very large index is instant and
+    a query only touches the postings of its own terms.
+    """
+
+    def __init__(self, terms: np.ndarray, indptr: np.ndarray, docs: np.ndarray, tfs: np.ndarray,
+                 doc_len: np.ndarray, chunk_ids: np.ndarray, k1: float = 1.5, b: float = 0.75):
+        self.terms = terms
+        self.indptr = indptr
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.chunk_ids = chunk_ids
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_len = max(float(doc_len.mean()), 1.0) if len(doc_len) else 1.0
+
+    @classmethod
+    def empty(cls) -> "BM25Index":
+        return cls(
+            terms=np.empty(0, dtype=f"S{MAX_TERM_BYTES}"),
+            indptr=np.zeros(1, dtype=np.int64),
+            docs=np.empty(0, dtype=np.int32),
+            tfs=np.empty(0, dtype=np.uint16),
+            doc_len=np.empty(0, dtype=np.uint32),
+            chunk_ids=np.empty(0, dtype="S1"),
+        )
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @staticmethod
+    def exists(index_dir: Path) -> bool:
+        return (Path(index_dir) / BM25_DIR / "indptr.npy").exists()
+
+    @classmethod
+    def load(cls, index_dir: Path) -> "BM25Index":
+        """Memory-map the index saved in `index_dir`, or return an empty index"""
+        directory = Path(index_dir) / BM25_DIR
+        if not cls.exists(index_dir) or not (directory / "chunk_ids.npy").exists():
+            return cls.empty()
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in _ARRAYS}
+        return cls(**arrays)
+
+    def save(self, index_dir: Path):
+        directory = Path(index_dir) / BM25_DIR
+        directory.mkdir(parents=True, exist_ok=True)
+        if len(self) == 0:
+            # Empty files cannot be memory-mapped; a missing index loads as empty
+            return
+        for name in _ARRAYS:
+            np.save(directory / f"{name}.npy", np.ascontiguousarray(getattr(self, name)))
+
+    def updated(self, docstore) -> "BM25Index":
+        """Return an index matching the docstore's chunks, tokenizing only chunks this one lacks"""
+        started = time.perf_counter()
+        current = set(docstore.all_ids())
+        known = {chunk_id.decode("utf-8") for chunk_id in self.chunk_ids}
+        removed = known - current
+        added = sorted(current - known)
+        if not removed and not added:
+            return self
+
+        # Existing postings as (term, doc, tf), minus the removed chunks
+        keep = np.ones(len(self), dtype=bool)
+        if removed:
+            keep = ~np.isin(self.chunk_ids, np.array([chunk_id.encode("utf-8") for chunk_id in removed]))
+        new_doc = np.cumsum(keep) - 1
+        term_of = np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(self.indptr))
+        kept = keep[self.docs]
+        old_terms = term_of[kept]
+        old_docs = new_doc[self.docs[kept]]
+        old_tfs = np.asarray(self.tfs)[kept]
+
+        # Postings of the added chunks, numbered after the kept ones
+        local_terms: Dict[str, int] = {}
+        new_terms, new_docs, new_tfs, new_lens, added_order = [], [], [], [], []
+        doc = int(keep.sum())
+        for start in range(0, len(added), 1000):
+            for document in docstore.get_documents(added[start:start + 1000]):
+                counts = Counter(tokenize(document.page_content))
+                new_terms.extend(local_terms.setdefault(term, len(local_terms)) for term in counts)
+                new_tfs.extend(counts.values())
+                new_docs.extend([doc] * len(counts))
+                new_lens.append(sum(counts.values()))
+                added_order.append(document.id)
+                doc += 1
+
+        encoded_new = _encode_terms(local_terms)
+        vocab = np.union1d(np.asarray(self.terms), encoded_new)
+        term_ids = np.concatenate([
+            np.searchsorted(vocab, np.asarray(self.terms))[old_terms] if len(old_terms) else np.empty(0, np.int64),
+            np.searchsorted(vocab, encoded_new)[np.array(new_terms, dtype=np.int64)],
+        ])
+        docs = np.concatenate([old_docs, np.array(new_docs, dtype=np.int64)])
+        tfs = np.concatenate([old_tfs, np.minimum(np.array(new_tfs, dtype=np.int64), 65535).astype(np.uint16)])
+
+        order = np.lexsort((docs, term_ids))
+        term_ids, docs, tfs = term_ids[order], docs[order], tfs[order]
+        # Drop terms whose every posting was removed
+        counts = np.bincount(term_ids, minlength=len(vocab))
+        used = counts > 0
+        indptr = np.concatenate([[0], np.cumsum(counts[used])]).astype(np.int64)
+
+        chunk_ids = np.concatenate([
+            np.asarray(self.chunk_ids)[keep].astype(object),
+            np.array([chunk_id.encode("utf-8") for chunk_id in added_order], dtype=object),
+        ]).astype(bytes)
+        index = BM25Index(
+            terms=vocab[used],
+            indptr=indptr,
+            docs=docs.astype(np.int32),
+            tfs=tfs,
+            doc_len=np.concatenate([np.asarray(self.doc_len)[keep],
+                                    np.array(new_lens, dtype=np.uint32)]).astype(np.uint32),
+            chunk_ids=chunk_ids,
+            k1=self.k1,
+            b=self.b,
+        )
+        logger.info(f"Updated BM25 index: +{len(added)} -{len(removed)} chunks, {len(index.terms)} terms, "
+                    f"{time.perf_counter() - started:.2f}s")
+        return index
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Top-k (chunk id, score) for a keyword query"""
+        if len(self.terms) == 0 or k <= 0:
+            return []
+        query_terms = np.unique(_encode_terms(tokenize(query)))
+        if len(query_terms) == 0:
+            return []
+        positions = np.minimum(np.searchsorted(self.terms, query_terms), len(self.terms) - 1)
+        matched = positions[self.terms[positions] == query_terms]
+        if len(matched) == 0:
+            return []
+
+        n_docs = len(self)
+        df = np.asarray(self.indptr)[matched + 1] - np.asarray(self.indptr)[matched]
+        # Terms in over half the chunks (idf < ln 2) barely move the ranking but
+        # their postings dominate the cost, so skip them when the query has rarer terms
+        if (df <= n_docs // 2).any():
+            matched = matched[df <= n_docs // 2]
+        hit_docs, hit_scores = [], []
+        for term in matched:
+            start, end = self.indptr[term], self.indptr[term + 1]
+            docs = np.asarray(self.docs[start:end])
+            tf = np.asarray(self.tfs[start:end], dtype=np.float32)
+            df = end - start
+            idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * np.asarray(self.doc_len)[docs] / self.avg_doc_len)
+            hit_docs.append(docs)
+            hit_scores.append(idf * tf * (self.k1 + 1.0) / (tf + norm))
+
+        docs, inverse = np.unique(np.concatenate(hit_docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(hit_scores))
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunk_ids[docs[i]].decode("utf-8"), float(scores[i])) for i in top]
@@ -0,0 +1,270 @@
+# chunker.py
+import multiprocessing
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from operator import sub
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+from langchain_core.documents import Document
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+CHUNK_UNITS = ("chars", "tokens")
+
+
+class ChunkSpans:
+    """Chunks of one text as arrays of [start, end) character offsets"""
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self):
+        self.starts = array("q")
+        self.ends = array("q")
+
+    def append(self, start: int, end: int):
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return zip(self.starts, self.ends)
+
+    def texts(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self]
+
+
+class Chunker:
+    """RecursiveCharacterTextSplitter's chunking, computed on offsets into the text
+
+    Produces exactly the chunks of the LangChain splitter with the same
+    separators (kept at the start of each piece), overlap and whitespace
+    stripping, but never copies substrings while merging: every piece is a
+    [start, end) range of the original text and only the final chunks are
+    sliced out. With a token length function sizes count tiktoken tokens,
+    as RecursiveCharacterTextSplitter.from_tiktoken_encoder does.
+    """
+
+    __slots__ = ("chunk_size", "chunk_overlap", "separators", "_token_length", "_join_length")
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 separators: Sequence[str] = DEFAULT_SEPARATORS,
+                 token_length: Optional[Callable[[str], int]] = None):
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be > 0, got {chunk_size}")
+        if not 0 <= chunk_overlap <= chunk_size:
+            raise ValueError(f"chunk_overlap must be between 0 and chunk_size ({chunk_size}), got {chunk_overlap}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = tuple(separators)
+        # None measures characters, which needs no substring at all
+        self._token_length = token_length
+        # Pieces keep their separators, so they are joined with "" (zero tokens for tiktoken)
+        self._join_length = token_length("") if token_length is not None else 0
+
+    @classmethod
+    def from_tiktoken_encoder(cls, encoding_name: str = "cl100k_base", **kwargs) -> "Chunker":
+        try:
+            import tiktoken
+        except ImportError as e:
+            raise ImportError("Token-based chunking needs `pip install tiktoken`") from e
+        encoding = tiktoken.get_encoding(encoding_name)
+        return cls(token_length=lambda s: len(encoding.encode(s, disallowed_special=())), **kwargs)
+
+    def spans(self, text: str) -> ChunkSpans:
+        spans = ChunkSpans()
+        self._split(text, 0, len(text), self.separators, spans)
+        return spans
+
+    def split_text(self, text: str) -> List[str]:
+        return self.spans(text).texts(text)
+
+    def split_documents(self, documents: Sequence[Document]) -> List[Document]:
+        """One Document per chunk, with a copy of its page's metadata"""
+        chunks = []
+        for doc in documents:
+            text = doc.page_content
+            for start, end in self.spans(text):
+                chunks.append(Document(page_content=text[start:end], metadata=dict(doc.metadata)))
+        return chunks
+
+    def _length(self, text: str, start: int, end: int) -> int:
+        if self._token_length is None:
+            return end - start
+        return self._token_length(text[start:end])
+
+    @staticmethod
+    def _pieces(text: str, start: int, end: int, separator: str) -> Iterator[Tuple[int, int]]:
+        """Ranges between occurrences of the separator, each starting with its separator"""
+        if not separator:
+            for i in range(start, end):
+                yield i, i + 1
+            return
+        previous = start
+        position = text.find(separator, start, end)
+        while position != -1:
+            if position > previous:
+                yield previous, position
+            previous = position
+            position = text.find(separator, position + len(separator), end)
+        if end > previous:
+            yield previous, end
+
+    def _split(self, text: str, start: int, end: int, separators: Sequence[str], spans: ChunkSpans):
+        # The first separator present in this range, and the finer ones to recurse with
+        separator, finer = separators[-1], ()
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator, finer = candidate, separators[i + 1:]
+                break
+
+        if self._token_length is None:
+            self._split_chars(text, start, end, separator, finer, spans)
+            return
+        good: List[Tuple[int, int, int]] = []
+        for piece_start, piece_end in self._pieces(text, start, end, separator):
+            length = self._length(text, piece_start, piece_end)
+            if length < self.chunk_size:
+                good.append((piece_start, piece_end, length))
+                continue
+            if good:
+                self._merge(text, good, spans)
+                good = []
+            if finer:
+                self._split(text, piece_start, piece_end, finer, spans)
+            else:
+                # Nothing left to split on; kept whole and unstripped, as LangChain does
+                spans.append(piece_start, piece_end)
+        if good:
+            self._merge(text, good, spans)
+
+    @staticmethod
+    def _boundaries(text: str, start: int, end: int, separator: str) -> List[int]:
+        """Offsets where the pieces of _pieces start, followed by `end`"""
+        if not separator:
+            return list(range(start, end + 1))
+        find, step = text.find, len(separator)
+        boundaries = [start]
+        position = find(separator, start, end)
+        while position != -1:
+            if position > boundaries[-1]:
+                boundaries.append(position)
+            position = find(separator, position + step, end)
+        if end > boundaries[-1]:
+            boundaries.append(end)
+        return boundaries
+
+    def _split_chars(self, text: str, start: int, end: int, separator: str, finer: Sequence[str],
+                     spans: ChunkSpans):
+        """_split for character lengths, where a run of small pieces is just its boundaries"""
+        boundaries = self._boundaries(text, start, end, separator)
+        if len(boundaries) < 2:
+            return
+        if max(map(sub, boundaries[1:], boundaries)) < self.chunk_size:
+            # The usual case: every piece fits and they merge as one run
+            self._merge_boundaries(text, boundaries, spans)
+            return
+        run: List[int] = []
+        for piece_start, piece_end in zip(boundaries, boundaries[1:]):
+            if piece_end - piece_start < self.chunk_size:
+                if not run:
+                    run.append(piece_start)
+                run.append(piece_end)
+                continue
+            if run:
+                self._merge_boundaries(text, run, spans)
+                run = []
+            if finer:
+                self._split(text, piece_start, piece_end, finer, spans)
+            else:
+                spans.append(piece_start, piece_end)
+        if run:
+            self._merge_boundaries(text, run, spans)
+
+    def _merge_boundaries(self, text: str, boundaries: List[int], spans: ChunkSpans):
+        """_merge for adjacent pieces measured in characters, by binary search over their boundaries
+
+        Pieces [i, e) form a chunk when piece e would push it past chunk_size;
+        the next chunk then starts at the first piece whose suffix of the chunk
+        fits in chunk_overlap and still leaves room for piece e.
+        """
+        size, overlap = self.chunk_size, self.chunk_overlap
+        last = len(boundaries) - 1
+        i = 0
+        while True:
+            e = bisect_right(boundaries, boundaries[i] + size, i) - 1
+            if e >= last:
+                self._emit(text, boundaries[i], boundaries[last], spans)
+                return
+            self._emit(text, boundaries[i], boundaries[e], spans)
+            floor = max(boundaries[e] - overlap, boundaries[e + 1] - size)
+            i = bisect_left(boundaries, floor, i, e)
+
+    def _merge(self, text: str, pieces: List[Tuple[int, int, int]], spans: ChunkSpans):
+        """Greedily join adjacent pieces into chunks, carrying up to chunk_overlap into the next"""
+        join = self._join_length
+        current: deque = deque()
+        total = 0
+        for piece in pieces:
+            length = piece[2]
+            if total + length + (join if current else 0) > self.chunk_size and current:
+                self._emit(text, current[0][0], current[-1][1], spans)
+                while total > self.chunk_overlap or (
+                        total + length + (join if current else 0) > self.chunk_size and total > 0):
+                    total -= current[0][2] + (join if len(current) > 1 else 0)
+                    current.popleft()
+            current.append(piece)
+            total += length + (join if len(current) > 1 else 0)
+        if current:
+            self._emit(text, current[0][0], current[-1][1], spans)
+
+    @staticmethod
+    def _emit(text: str, start: int, end: int, spans: ChunkSpans):
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            spans.append(start, end)
+
+
+@lru_cache(maxsize=None)
+def get_chunker(chunk_size: int = 1000, chunk_overlap: int = 200, unit: str = "chars") -> Chunker:
+    """A chunker per configuration, built once per process (loading a tiktoken encoding is slow)"""
+    if unit not in CHUNK_UNITS:
+        raise ValueError(f"Unsupported CHUNK_UNIT: {unit} (expected {' or '.join(CHUNK_UNITS)})")
+    if unit == "tokens":
+        return Chunker.from_tiktoken_encoder(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return Chunker(chunk_size, chunk_overlap)
+
+
+def _spans_worker(args: Tuple[int, int, str, List[str]]) -> List[ChunkSpans]:
+    chunk_size, chunk_overlap, unit, texts = args
+    chunker = get_chunker(chunk_size, chunk_overlap, unit)
+    return [chunker.spans(text) for text in texts]
+
+
+def chunk_texts(texts: Sequence[str], chunk_size: int = 1000, chunk_overlap: int = 200, unit: str = "chars",
+                workers: Optional[int] = None, batch_size: int = 64) -> List[ChunkSpans]:
+    """Spans for many texts, split across a process pool in batches
+
+    Only the offsets come back from the workers, not the chunk text.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(texts) <= batch_size:
+        return _spans_worker((chunk_size, chunk_overlap, unit, list(texts)))
+    batches = [(chunk_size, chunk_overlap, unit, list(texts[i:i + batch_size]))
+               for i in range(0, len(texts), batch_size)]
+    # Spawned, like the ingestion pool: forking would copy the caller's locks and threads mid-use
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return [spans for batch in pool.map(_spans_worker, batches) for spans in batch]
@@ -0,0 +1,179 @@
+# context_builder.py
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from .embedding_executor import load_encoding
+import logging
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+")
+_CHUNK_ID_RE = re.compile(r"^(.+)-(\d+)$")
+
+# Below this many tokens a truncated block is more noise than help
+_MIN_TRUNCATED_TOKENS = 64
+
+
+def document_header(number: int, source: str, page) -> str:
+    return f"[Document {number} - {source} (Page {page})]:\n"
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _chunk_position(doc: Document) -> Optional[Tuple[str, int]]:
+    """(file prefix, chunk number) from ids assigned by index_file, or None"""
+    match = _CHUNK_ID_RE.match(doc.metadata.get("chunk_id") or doc.id or "")
+    return (match.group(1), int(match.group(2))) if match else None
+
+
+def text_overlap(left: str, right: str, min_overlap: int = 20, window: int = 1000) -> int:
+    """Length of the longest suffix of `left` that is a prefix of `right`, or 0"""
+    if len(left) < min_overlap or len(right) < min_overlap:
+        return 0
+    probe = right[:min_overlap]
+    start = max(0, len(left) - window)
+    position = left.find(probe, start)
+    while position != -1:
+        length = len(left) - position
+        if right.startswith(left[position:]):
+            return length
+        position = left.find(probe, position + 1)
+    return 0
+
+
+class ContextBlock:
+    """Contiguous text from one source and page, built from one or more chunks"""
+
+    __slots__ = ("source", "page", "text", "rank", "position", "chunks")
+
+    def __init__(self, doc: Document, rank: int):
+        self.source = doc.metadata.get("source_file", "Unknown")
+        self.page = doc.metadata.get("page", "N/A")
+        self.text = doc.page_content
+        self.rank = rank
+        self.position = _chunk_position(doc)
+        self.chunks = 1
+
+
+class ContextBuilder:
+    """Assembles retrieved chunks into a prompt context within a token budget
+
+    Chunks from the same source and page that overlap (the splitter repeats
+    `chunk_overlap` characters) or are consecutive are merged into one block,
+    near-duplicate chunks are dropped, and blocks are packed best-ranked first
+    until the budget is spent.
+    """
+
+    def __init__(self, token_budget: int = 3000, dedup_threshold: float = 0.9,
+                 min_overlap: int = 20, encoding_name: str = "cl100k_base"):
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.min_overlap = min_overlap
+        self.encoding_name = encoding_name
+        self._encoding = None
+
+    @classmethod
+    def from_env(cls) -> "ContextBuilder":
+        return cls(
+            token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000")),
+            dedup_threshold=float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.9")),
+        )
+
+    @property
+    def encoding(self):
+        # Loaded on first use: tiktoken fetches the BPE file the first time, and offline
+        # installs fall back to an estimate rather than failing every prompt
+        if self._encoding is None:
+            self._encoding = load_encoding(self.encoding_name)
+        return self._encoding
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode_ordinary(text))
+
+    def _deduplicate(self, documents: List[Document]) -> Tuple[List[Tuple[int, Document]], int]:
+        kept, kept_shingles, dropped = [], [], 0
+        for rank, doc in enumerate(documents):
+            shingles = _shingles(doc.page_content)
+            if any(len(shingles & other) / len(shingles | other) >= self.dedup_threshold
+                   for other in kept_shingles):
+                dropped += 1
+                continue
+            kept.append((rank, doc))
+            kept_shingles.append(shingles)
+        return kept, dropped
+
+    def _merge(self, ranked: List[Tuple[int, Document]]) -> List[ContextBlock]:
+        groups: Dict[Tuple[str, str], List[ContextBlock]] = {}
+        for rank, doc in ranked:
+            block = ContextBlock(doc, rank)
+            groups.setdefault((block.source, str(block.page)), []).append(block)
+
+        merged = []
+        for blocks in groups.values():
+            # Document order when chunk numbers are known, so neighbours meet
+            if all(block.position for block in blocks):
+                blocks.sort(key=lambda block: block.position)
+            current = blocks[0]
+            for block in blocks[1:]:
+                if block.text in current.text:
+                    current.rank = min(current.rank, block.rank)
+                    current.chunks += 1
+                    continue
+                overlap = text_overlap(current.text, block.text, self.min_overlap)
+                consecutive = (current.position and block.position
+                               and current.position[0] == block.position[0]
+                               and block.position[1] == current.position[1] + 1)
+                if overlap or consecutive:
+                    current.text = current.text + (block.text[overlap:] if overlap else "\n" + block.text)
+                    current.rank = min(current.rank, block.rank)
+                    current.position = block.position
+                    current.chunks += 1
+                    continue
+                merged.append(current)
+                current = block
+            merged.append(current)
+        return sorted(merged, key=lambda block: block.rank)
+
+    def build(self, documents: List[Document]) -> Tuple[str, Dict]:
+        """Return the context text and stats on what merging and packing saved"""
+        naive = "\n\n".join(
+            document_header(i + 1, doc.metadata.get("source_file", "Unknown"), doc.metadata.get("page", "N/A"))
+            + doc.page_content
+            for i, doc in enumerate(documents)
+        )
+        naive_tokens = self.count_tokens(naive)
+
+        ranked, duplicates = self._deduplicate(documents)
+        blocks = self._merge(ranked)
+        parts, used, truncated, dropped = [], 0, 0, 0
+        for block in blocks:
+            separator = 2 if parts else 0
+            header = document_header(len(parts) + 1, block.source, block.page)
+            tokens = self.encoding.encode_ordinary(header + block.text)
+            remaining = self.token_budget - used - separator if self.token_budget > 0 else len(tokens)
+            if len(tokens) > remaining:
+                if remaining < _MIN_TRUNCATED_TOKENS:
+                    dropped += 1
+                    continue
+                tokens = tokens[:remaining]
+                truncated += 1
+            parts.append(self.encoding.decode(tokens))
+            used += len(tokens) + separator
+
+        context = "\n\n".join(parts)
+        context_tokens = self.count_tokens(context)
+        stats = {
+            "context_tokens": context_tokens,
+            "tokens_saved": max(0, naive_tokens - context_tokens),
+            "chunks_merged": len(ranked) - len(blocks),
+            "duplicates_dropped": duplicates,
+            "blocks_truncated": truncated,
+            "blocks_over_budget": dropped,
+        }
+        return context, stats
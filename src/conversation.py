@@ -0,0 +1,170 @@
+# conversation.py
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from langchain_core.documents import Document
+from .answer_cache import _unit
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONDENSE_PROMPT = """Given the conversation below and a follow-up question, rephrase the follow-up question \
+as a standalone question that can be understood without the conversation. Keep names, documents, pages and \
+other specifics it refers to. If it is already standalone, return it unchanged. Return only the question.
+
+Conversation:
+{history}
+
+Follow-up question: {question}
+
+Standalone question:"""
+
+ROLE_NAMES = {"user": "User", "bot": "Assistant"}
+
+# Characters of each earlier message kept for condensing
+_MESSAGE_CHARS = 1000
+
+
+def format_history(messages: Sequence[dict]) -> str:
+    """Chat messages ({"type", "content"}, oldest first) as a transcript for the condense prompt"""
+    lines = []
+    for message in messages:
+        content = " ".join(message["content"].split())
+        if len(content) > _MESSAGE_CHARS:
+            content = content[:_MESSAGE_CHARS] + "..."
+        lines.append(f"{ROLE_NAMES.get(message['type'], message['type'])}: {content}")
+    return "\n".join(lines)
+
+
+def _filters_key(filters: Optional[dict]) -> str:
+    return json.dumps(filters or {}, sort_keys=True, default=str)
+
+
+class _Session:
+    __slots__ = ("condensed", "embedding", "pool", "pool_k", "filters", "version", "last_used")
+
+    def __init__(self):
+        # (history hash, question) -> standalone question, oldest first
+        self.condensed: "OrderedDict[tuple, str]" = OrderedDict()
+        # Unit query embedding the pool was searched with
+        self.embedding: Optional[np.ndarray] = None
+        self.pool: List[Document] = []
+        self.pool_k = 0
+        self.filters = ""
+        self.version = None
+        self.last_used = time.monotonic()
+
+
+class ConversationMemory:
+    """Per-session retrieval context for multi-turn chats
+
+    Remembers each session's condensed follow-up questions, so a question is
+    rewritten once per conversation state, and the candidate pool of its last
+    search. A new turn whose query embedding is within `reuse_similarity`
+    cosine similarity of the one the pool was searched with (same filters and
+    index version) takes its candidates from the pool instead of searching.
+    Searches made for a session fetch `pool_factor` times the candidates they
+    need, so later turns have room to pick different chunks. Sessions idle
+    for `ttl_seconds` are dropped, and the least recently used beyond
+    `max_sessions`.
+    """
+
+    def __init__(self, max_sessions: int = 1024, ttl_seconds: float = 3600, reuse_similarity: float = 0.9,
+                 pool_factor: int = 2, max_condensed: int = 32):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.reuse_similarity = reuse_similarity
+        self.pool_factor = max(1, pool_factor)
+        self.max_condensed = max_condensed
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"condense_hits": 0, "condense_misses": 0, "reuse_hits": 0, "reuse_misses": 0}
+
+    @classmethod
+    def from_env(cls) -> "ConversationMemory":
+        return cls(
+            max_sessions=int(os.getenv("CONVERSATION_SESSIONS", "1024")),
+            ttl_seconds=float(os.getenv("CONVERSATION_TTL", "3600")),
+            # 0 always searches
+            reuse_similarity=float(os.getenv("RETRIEVAL_REUSE_SIMILARITY", "0.9")),
+            pool_factor=int(os.getenv("RETRIEVAL_REUSE_POOL", "2")),
+        )
+
+    @property
+    def reuse_enabled(self) -> bool:
+        return self.reuse_similarity > 0
+
+    @staticmethod
+    def history_key(history: str) -> str:
+        return hashlib.sha1(history.encode("utf-8")).hexdigest()
+
+    def _session(self, session_id: str, create: bool = False) -> Optional[_Session]:
+        now = time.monotonic()
+        session = self._sessions.get(session_id)
+        if session is not None and self.ttl_seconds > 0 and now - session.last_used > self.ttl_seconds:
+            del self._sessions[session_id]
+            session = None
+        if session is None and create:
+            session = self._sessions[session_id] = _Session()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        if session is not None:
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def get_condensed(self, session_id: str, history_key: str, question: str) -> Optional[str]:
+        with self._lock:
+            session = self._session(session_id)
+            standalone = session.condensed.get((history_key, question)) if session is not None else None
+            self.counters["condense_hits" if standalone is not None else "condense_misses"] += 1
+            return standalone
+
+    def put_condensed(self, session_id: str, history_key: str, question: str, standalone: str):
+        with self._lock:
+            condensed = self._session(session_id, create=True).condensed
+            condensed[(history_key, question)] = standalone
+            while len(condensed) > self.max_condensed:
+                condensed.popitem(last=False)
+
+    def pool_size(self, k: int) -> int:
+        """Candidates to fetch for a session search that needs k"""
+        return k * self.pool_factor if self.reuse_enabled else k
+
+    def reusable_pool(self, session_id: str, embedding: Sequence[float], k: int, filters: Optional[dict],
+                      version) -> Optional[List[Document]]:
+        """The previous search's candidates if they can serve this query, else None"""
+        if not self.reuse_enabled:
+            return None
+        with self._lock:
+            session = self._session(session_id)
+            reusable = (
+                session is not None and session.embedding is not None and session.version == version
+                and session.filters == _filters_key(filters) and k <= session.pool_k
+                and float(session.embedding @ _unit(embedding)) >= self.reuse_similarity
+            )
+            self.counters["reuse_hits" if reusable else "reuse_misses"] += 1
+            return list(session.pool) if reusable else None
+
+    def put_pool(self, session_id: str, embedding: Sequence[float], pool_k: int, filters: Optional[dict],
+                 version, pool: List[Document]):
+        with self._lock:
+            session = self._session(session_id, create=True)
+            session.embedding = _unit(embedding)
+            session.pool = list(pool)
+            session.pool_k = pool_k
+            session.filters = _filters_key(filters)
+            session.version = version
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"sessions": len(self._sessions), **self.counters}
@@ -1,25 +1,217 @@
 # document_processor.py (improved)
+import copy
+import hashlib
+import multiprocessing
 import os
+import pickle
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import List, Optional, Tuple
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from langchain_community.document_loaders import TextLoader
 from langchain_community.vectorstores import FAISS
 from langchain.schema import Document
 from dotenv import load_dotenv
+from .bm25_index import BM25Index
+from .chunker import get_chunker
+from .embedding_backends import LocalEmbeddings, get_embeddings
+from .embedding_cache import CachedEmbeddings, get_embedding_cache
+from .embedding_executor import EmbeddingExecutor
+from .index_factory import IndexConfig, build_index, supports_removal
+from .manifest import FileRecord, IndexManifest, file_sha256
+from .metadata_index import MetadataIndex, load_file_tags
+from .metrics import Timings, get_metrics, profiled
+from .pdf_extractor import iter_pdf_pages, resolve_backend
+from .shards import ShardConfig, ShardManifest, is_sharded
+from .vectorstore_io import (
+    append_embeddings, delete_chunks, discard_working_copy, has_vectorstore, index_write_lock, load_vectorstore,
+    new_working_docstore, save_vectorstore, staged_index_dir, unpublish
+)
+import numpy as np
 import logging
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+
+def iter_file_documents(file_path: Path, file_hash: Optional[str] = None) -> Iterator[Document]:
+    """Yield a file's pages as they are read; PDF page text comes from the page cache when possible"""
+    if file_path.suffix.lower() == '.pdf':
+        documents = iter_pdf_pages(file_path, file_hash)
+    elif file_path.suffix.lower() == '.txt':
+        documents = TextLoader(str(file_path), encoding='utf-8').lazy_load()
+    else:
+        raise ValueError(f"Unsupported file type: {file_path.suffix}")
+    for doc in documents:
+        doc.metadata["source_file"] = file_path.name
+        yield doc
+
+
+def load_file(file_path: Path) -> List[Document]:
+    return list(iter_file_documents(file_path))
+
+
+def split_into_chunks(documents: List[Document], chunk_size: int = 1000,
+                      chunk_overlap: int = 200, chunk_unit: str = "chars") -> List[Document]:
+    return get_chunker(chunk_size, chunk_overlap, chunk_unit).split_documents(documents)
+
+
+def index_file(file_path: Path, chunk_size: int = 1000, chunk_overlap: int = 200,
+               chunk_unit: str = "chars") -> Tuple[List[Document], FileRecord]:
+    """Load and split one file, assigning stable chunk ids recorded in the manifest"""
+    chunks, record, _ = _index_file_timed(file_path, chunk_size, chunk_overlap, chunk_unit)
+    return chunks, record
+
+
+def chunking_signature(file_path: Path, chunk_size: int = 1000, chunk_overlap: int = 200,
+                       chunk_unit: str = "chars") -> str:
+    """The settings that decide how a file is chunked, e.g. `chars:1000:200:pymupdf`
+
+    Part of every chunk id and recorded in the manifest, so chunks made with
+    other settings never share an id and a sync re-chunks their files.
+    """
+    signature = f"{chunk_unit}:{chunk_size}:{chunk_overlap}"
+    if file_path.suffix.lower() == '.pdf':
+        signature += f":{resolve_backend()}"
+    return signature
+
+
+def _index_file_timed(file_path: Path, chunk_size: int = 1000, chunk_overlap: int = 200,
+                      chunk_unit: str = "chars") -> Tuple[List[Document], FileRecord, Dict[str, float]]:
+    """index_file plus the seconds spent loading and splitting
+
+    Module-level so it can run in a worker process.
+    """
+    record = FileRecord.for_file(file_path)
+    splitter = get_chunker(chunk_size, chunk_overlap, chunk_unit)
+    chunks: List[Document] = []
+    timings = {"load": 0.0, "split": 0.0}
+    pages = iter_file_documents(file_path, record.sha256)
+    # Split each page as it is extracted instead of holding every page's text
+    while True:
+        started = time.perf_counter()
+        page = next(pages, None)
+        loaded = time.perf_counter()
+        timings["load"] += loaded - started
+        if page is None:
+            break
+        chunks.extend(splitter.split_documents([page]))
+        timings["split"] += time.perf_counter() - loaded
+    record.chunking = chunking_signature(file_path, chunk_size, chunk_overlap, chunk_unit)
+    prefix = hashlib.sha1(f"{file_path.name}\0{record.sha256}\0{record.chunking}".encode("utf-8")).hexdigest()[:16]
+    for i, chunk in enumerate(chunks):
+        chunk_id = f"{prefix}-{i}"
+        chunk.metadata["chunk_id"] = chunk_id
+        record.chunk_ids.append(chunk_id)
+        record.chunk_pages.append(chunk.metadata.get("page", -1))
+    return chunks, record, timings
+
+
+class TrainingBuffer:
+    """Embedded batches parked in a temporary file until a new index can be trained
+
+    Memory holds a reservoir sample of at most `sample_size` vectors, drawn
+    uniformly from every batch added; the batches themselves are replayed
+    from disk in order once the index is trained.
+    """
+
+    def __init__(self, sample_size: int, seed: int = 0):
+        self.sample_size = sample_size
+        self.seen = 0
+        self.batches = 0
+        self._sample: Optional[np.ndarray] = None
+        self._rng = np.random.default_rng(seed)
+        self._file = tempfile.TemporaryFile(prefix="faiss-train-")
+
+    def add(self, texts: List[str], vectors: np.ndarray, metadatas: List[dict], ids: Optional[List[str]]):
+        pickle.dump((texts, vectors, metadatas, ids), self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.batches += 1
+        if self._sample is None:
+            self._sample = np.empty((self.sample_size, vectors.shape[1]), dtype=np.float32)
+        fill = max(0, min(len(vectors), self.sample_size - self.seen))
+        self._sample[self.seen:self.seen + fill] = vectors[:fill]
+        # Algorithm R: the i-th vector replaces a random slot with probability sample_size / (i + 1)
+        slots = self._rng.integers(0, np.arange(self.seen + fill, self.seen + len(vectors)) + 1)
+        for offset in np.flatnonzero(slots < self.sample_size):
+            self._sample[slots[offset]] = vectors[fill + offset]
+        self.seen += len(vectors)
+
+    @property
+    def sample(self) -> np.ndarray:
+        return self._sample[:min(self.seen, self.sample_size)]
+
+    def replay(self) -> Iterator[Tuple[List[str], np.ndarray, List[dict], Optional[List[str]]]]:
+        self._file.seek(0)
+        for _ in range(self.batches):
+            yield pickle.load(self._file)
+
+    def close(self):
+        self._file.close()
+
+
 class DocumentProcessor:
     def __init__(self, data_dir: str = "./data", vectorstore_path: str = "./vectorstore/faiss_index"):
         self.data_dir = Path(data_dir)
         self.vectorstore_path = Path(vectorstore_path)
-        self.embeddings = OpenAIEmbeddings(model=os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"))
+        backend = get_embeddings()
+        if not isinstance(backend, LocalEmbeddings):
+            # Remote APIs get token-budgeted, concurrent, rate-limited requests
+            backend = EmbeddingExecutor.from_env(backend)
+        self.embeddings = CachedEmbeddings(backend, get_embedding_cache())
         self.supported_extensions = ['.pdf', '.txt']
+        self.chunk_size = 1000
+        self.chunk_overlap = 200
+        # "tokens" counts chunk_size and chunk_overlap in tiktoken tokens instead of characters
+        self.chunk_unit = os.getenv("CHUNK_UNIT", "chars")
+        # Parsing runs in a process pool; embedding and indexing happen per batch
+        self.workers = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+        self.batch_size = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+        self.index_config = IndexConfig.from_env()
+        # INDEX_SHARDS / SHARD_BY split the corpus into independently rebuilt shards
+        self.shard_config = ShardConfig.from_env()
+        # Set on the processor of one shard: the files it indexes
+        self.shard_files: Optional[set] = None
+        # Held by every operation that publishes a new index version
+        self.write_lock = index_write_lock(self.vectorstore_path)
+        # Called as progress_callback(file_name, status, info) while files are processed
+        self.progress_callback: Optional[Callable[[str, str, dict], None]] = None
+        # Stage durations of the last top-level operation, in seconds
+        self.last_timings: Dict[str, float] = {}
+        self._timings: Optional[Timings] = None
+        metrics = get_metrics()
+        self._stage_seconds = metrics.histogram("rag_ingest_stage_seconds", "Duration of each ingestion stage")
+        self._chunks_indexed = metrics.counter("rag_ingest_chunks_total", "Chunks embedded and indexed")
+    
+    @contextmanager
+    def _timed_operation(self, name: str):
+        """Time the outermost operation; nested ones add to its stages"""
+        if self._timings is not None:
+            yield
+            return
+        self._timings = Timings(self._stage_seconds)
+        try:
+            with profiled(f"ingest-{name}"):
+                yield
+        finally:
+            self.last_timings = self._timings.finish()
+            self._timings = None
+            logger.info(f"{name} timings: {self.last_timings}")
+    
+    def _stage(self, name: str):
+        return self._timings.stage(name) if self._timings is not None else nullcontext()
+    
+    def _add_stage_timings(self, timings: Dict[str, float]):
+        if self._timings is not None:
+            for name, seconds in timings.items():
+                self._timings.add(name, seconds)
+    
+    def _report(self, file_name: str, status: str, **info):
+        if self.progress_callback is not None:
+            self.progress_callback(file_name, status, info)
     
     def get_supported_files(self) -> List[Path]:
         if not self.data_dir.exists():
@@ -28,21 +220,13 @@ class DocumentProcessor:
         files = []
         for ext in self.supported_extensions:
             files.extend(list(self.data_dir.glob(f"*{ext}")))
+        if self.shard_files is not None:
+            files = [file_path for file_path in files if file_path.name in self.shard_files]
         return files
     
     def load_document(self, file_path: Path) -> List[Document]:
         try:
-            if file_path.suffix.lower() == '.pdf':
-                loader = PyPDFLoader(str(file_path))
-            elif file_path.suffix.lower() == '.txt':
-                loader = TextLoader(str(file_path), encoding='utf-8')
-            else:
-                raise ValueError(f"Unsupported file type: {file_path.suffix}")
-            
-            documents = loader.load()
-            for doc in documents:
-                doc.metadata["source_file"] = file_path.name
-            return documents
+            return load_file(file_path)
         except Exception as e:
             logger.error(f"Error loading document {file_path}: {str(e)}")
             raise
@@ -50,70 +234,420 @@ class DocumentProcessor:
     def split_documents(self, documents: List[Document], 
                        chunk_size: int = 1000, 
                        chunk_overlap: int = 200) -> List[Document]:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        return text_splitter.split_documents(documents)
+        return split_into_chunks(documents, chunk_size, chunk_overlap, self.chunk_unit)
+    
+    def _chunking_signature(self, file_path: Path) -> str:
+        return chunking_signature(file_path, self.chunk_size, self.chunk_overlap, self.chunk_unit)
+    
+    def index_file(self, file_path: Path) -> Tuple[List[Document], FileRecord]:
+        chunks, record, timings = _index_file_timed(file_path, self.chunk_size, self.chunk_overlap, self.chunk_unit)
+        self._add_stage_timings(timings)
+        return chunks, record
+    
+    def iter_indexed_files(self, files: List[Path],
+                           skip_errors: bool = False) -> Iterator[Tuple[Path, List[Document], FileRecord]]:
+        """Parse and split files in a process pool, yielding results in file order
+
+        At most two files per worker are in flight, so memory stays bounded
+        however large the corpus is.
+        """
+        if self.workers <= 1 or len(files) <= 1:
+            for file_path in files:
+                try:
+                    chunks, record = self.index_file(file_path)
+                except Exception as e:
+                    logger.error(f"Failed to process {file_path}: {str(e)}")
+                    self._report(file_path.name, "failed", error=str(e))
+                    if not skip_errors:
+                        raise
+                    continue
+                yield file_path, chunks, record
+            return
+        
+        pending = iter(files)
+        # Forked workers would inherit the parent's threads and locks (SQLite, FAISS, HTTP clients) mid-use
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(files)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            in_flight = deque()
+            for file_path in pending:
+                in_flight.append((file_path, executor.submit(_index_file_timed, file_path, self.chunk_size,
+                                                             self.chunk_overlap, self.chunk_unit)))
+                if len(in_flight) >= 2 * self.workers:
+                    break
+            while in_flight:
+                file_path, future = in_flight.popleft()
+                next_path = next(pending, None)
+                if next_path is not None:
+                    in_flight.append((next_path, executor.submit(_index_file_timed, next_path, self.chunk_size,
+                                                                 self.chunk_overlap, self.chunk_unit)))
+                try:
+                    chunks, record, timings = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to process {file_path}: {str(e)}")
+                    self._report(file_path.name, "failed", error=str(e))
+                    if not skip_errors:
+                        raise
+                    continue
+                # Worker time, summed across processes
+                self._add_stage_timings(timings)
+                yield file_path, chunks, record
+    
+    def iter_chunk_batches(self, files: List[Path], records: Dict[str, FileRecord],
+                           skip_errors: bool = False) -> Iterator[List[Document]]:
+        """Yield chunks in batches of `batch_size`, filling `records` as files complete"""
+        batch = []
+        for file_path, chunks, record in self.iter_indexed_files(files, skip_errors):
+            logger.info(f"Created {len(chunks)} chunks from {file_path.name}")
+            self._report(file_path.name, "chunked", chunks=len(chunks))
+            records[file_path.name] = record
+            for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+    
+    def _new_vectorstore(self, sample: np.ndarray) -> FAISS:
+        """Create an empty index of the configured type, trained on `sample` if it needs training"""
+        index = build_index(self.index_config, sample.shape[1], sample)
+        return FAISS(self.embeddings, index, new_working_docstore(self.vectorstore_path), {})
+    
+    def index_batches(self, batches: Iterable[List[Document]],
+                      vectorstore: Optional[FAISS] = None) -> Tuple[Optional[FAISS], int]:
+        """Embed each batch as it arrives and append it to the index
+
+        A new index that needs training is trained once every batch is
+        embedded, on a reservoir sample of `train_size` vectors; until then
+        the batches wait in a temporary file, so memory holds the sample
+        (train_size x dimension float32 values) rather than the corpus.
+        """
+        count = 0
+        buffer = None
+        try:
+            for batch in batches:
+                texts = [chunk.page_content for chunk in batch]
+                with self._stage("embed"):
+                    vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+                metadatas = [chunk.metadata for chunk in batch]
+                count += len(batch)
+                self._chunks_indexed.inc(len(batch))
+                if vectorstore is None and not self.index_config.needs_training:
+                    vectorstore = self._new_vectorstore(vectors)
+                if vectorstore is not None:
+                    with self._stage("index"):
+                        append_embeddings(vectorstore, zip(texts, vectors), metadatas, self._ids_for(batch))
+                    continue
+                if buffer is None:
+                    buffer = TrainingBuffer(self.index_config.train_size)
+                with self._stage("index"):
+                    buffer.add(texts, vectors, metadatas, self._ids_for(batch))
+            if buffer is not None:
+                with self._stage("index"):
+                    vectorstore = self._new_vectorstore(buffer.sample)
+                    logger.info(f"Trained on {len(buffer.sample)} of {buffer.seen} vectors")
+                    for texts, vectors, metadatas, ids in buffer.replay():
+                        append_embeddings(vectorstore, zip(texts, vectors), metadatas, ids)
+        finally:
+            if buffer is not None:
+                buffer.close()
+        return vectorstore, count
     
     def create_vectorstore(self, chunks: List[Document]) -> FAISS:
-        return FAISS.from_documents(chunks, self.embeddings)
+        batches = (chunks[i:i + self.batch_size] for i in range(0, len(chunks), self.batch_size))
+        vectorstore, _ = self.index_batches(batches)
+        if vectorstore is None:
+            raise ValueError("No chunks to index")
+        return vectorstore
+    
+    def _ids_for(self, chunks: List[Document]) -> Optional[List[str]]:
+        ids = [chunk.metadata.get("chunk_id") for chunk in chunks]
+        return ids if all(ids) else None
+    
+    def save_vectorstore(self, vectorstore: FAISS, manifest: Optional[IndexManifest] = None,
+                         rebuilt: bool = False):
+        """Write a complete new index version and publish it atomically
+
+        `rebuilt` marks a vectorstore built from scratch rather than updated
+        from the published one; its keyword index is then built from scratch too.
+        """
+        if manifest is None:
+            manifest = self.load_manifest(vectorstore)
+        manifest.embedding_model = self.embeddings.model_id
+        with self.write_lock, self._stage("save"), staged_index_dir(self.vectorstore_path) as staging:
+            save_vectorstore(vectorstore, staging)
+            # Keyword index for hybrid retrieval, updated from the previous version's
+            bm25 = BM25Index.empty() if rebuilt else BM25Index.load(self.vectorstore_path)
+            bm25.updated(vectorstore.docstore).save(staging)
+            # File, page, upload time and tag lookup for filtered retrieval
+            MetadataIndex.build(manifest, vectorstore, load_file_tags(self.data_dir)).save(staging)
+            manifest.save(staging)
+    
+    def load_manifest(self, vectorstore: Optional[FAISS] = None) -> IndexManifest:
+        if IndexManifest.exists(self.vectorstore_path) or vectorstore is None:
+            return IndexManifest.load(self.vectorstore_path)
+        return IndexManifest.from_vectorstore(vectorstore)
+    
+    @property
+    def sharded(self) -> bool:
+        return self.shard_config.enabled and self.shard_files is None
     
-    def save_vectorstore(self, vectorstore: FAISS):
-        os.makedirs(self.vectorstore_path.parent, exist_ok=True)
-        vectorstore.save_local(str(self.vectorstore_path))
+    def vectorstore_exists(self) -> bool:
+        """Whether an index exists in the configured layout, sharded or not"""
+        if self.sharded:
+            return is_sharded(self.vectorstore_path)
+        return has_vectorstore(self.vectorstore_path)
     
     def load_existing_vectorstore(self) -> Optional[FAISS]:
-        index_file = self.vectorstore_path / "index.faiss"
-        if index_file.exists():
-            # Warning: Only use allow_dangerous_deserialization if you trust the source
-            return FAISS.load_local(
-                str(self.vectorstore_path), 
-                self.embeddings,
-                allow_dangerous_deserialization=True
-            )
+        """Load a private, writable copy of the vectorstore for updating"""
+        if has_vectorstore(self.vectorstore_path):
+            return load_vectorstore(self.vectorstore_path, self.embeddings, read_only=False)
         return None
     
-    def process_documents(self) -> Tuple[FAISS, int]:
-        files = self.get_supported_files()
-        if not files:
+    def process_documents(self) -> Tuple[Optional[FAISS], int]:
+        """Index every file from scratch; a sharded index returns no single vectorstore"""
+        with self.write_lock, self._timed_operation("process_documents"):
+            if self.sharded:
+                return None, self._process_shards()
+            files = self.get_supported_files()
+            if not files:
+                raise ValueError("No supported files found in data directory")
+        
+            manifest = IndexManifest(version=self.load_manifest().version)
+            vectorstore, chunk_count = self.index_batches(self.iter_chunk_batches(files, manifest.files))
+            if vectorstore is None:
+                raise ValueError("No text could be extracted from the documents")
+        
+            self.save_vectorstore(vectorstore, manifest, rebuilt=True)
+            logger.info(f"Created vectorstore with {chunk_count} chunks")
+            return vectorstore, chunk_count
+    
+    def _shard_processor(self, root: Path, name: str, file_names: Iterable[str]) -> "DocumentProcessor":
+        """A processor for one shard, sharing this one's embeddings, settings, lock and timings"""
+        shard = copy.copy(self)
+        shard.vectorstore_path = Path(root) / name
+        shard.shard_files = set(file_names)
+        return shard
+    
+    def _assign_shards(self) -> Dict[str, List[str]]:
+        files = [file_path.name for file_path in self.get_supported_files()]
+        return self.shard_config.assign(files, load_file_tags(self.data_dir))
+    
+    def _root_version(self) -> int:
+        if is_sharded(self.vectorstore_path):
+            return ShardManifest.load(self.vectorstore_path).version
+        return self.load_manifest().version
+    
+    def _process_shards(self) -> int:
+        """Build every shard into a new root directory and publish it in one swap"""
+        assignment = self._assign_shards()
+        if not assignment:
             raise ValueError("No supported files found in data directory")
         
-        all_chunks = []
-        for file_path in files:
-            logger.info(f"Processing {file_path.name}")
-            documents = self.load_document(file_path)
-            chunks = self.split_documents(documents)
-            all_chunks.extend(chunks)
-            logger.info(f"Created {len(chunks)} chunks from {file_path.name}")
+        shards = ShardManifest(version=self._root_version())
+        chunk_count = 0
+        with staged_index_dir(self.vectorstore_path) as staging:
+            for name, file_names in sorted(assignment.items()):
+                shard = self._shard_processor(staging, name, file_names)
+                try:
+                    _, count = shard.process_documents()
+                except ValueError as e:
+                    # e.g. a shard whose files all failed to parse; the others are still served
+                    logger.warning(f"Skipping shard {name}: {str(e)}")
+                    continue
+                chunk_count += count
+                shards.record(name, shard.load_manifest())
+            if not shards.shards:
+                raise ValueError("No text could be extracted from the documents")
+            shards.save(staging)
+        logger.info(f"Created {len(shards.shards)} shards with {chunk_count} chunks")
+        return chunk_count
+    
+    def _sync_shards(self, file_names: Optional[Iterable[str]] = None) -> Dict:
+        """Sync the shards that hold, or should hold, the given files (every shard when None)
+
+        Shards left untouched keep their published version, so readers never
+        reload them.
+        """
+        root = self.vectorstore_path
+        if not is_sharded(root):
+            # No index yet, or an unsharded one to convert
+            return {"mode": "rebuild", "chunks_added": self._process_shards(), "chunks_removed": 0}
+        
+        shards = ShardManifest.load(root)
+        assignment = self._assign_shards()
+        if file_names is None:
+            affected = set(assignment) | set(shards.shards)
+        else:
+            file_names = set(file_names)
+            affected = {name for name, files in assignment.items() if file_names.intersection(files)}
+            # Files that moved to another shard, e.g. after their collection changed
+            affected |= {shards.shard_of(name) for name in file_names} - {None}
+        
+        stats = {"mode": "sharded", "chunks_added": 0, "chunks_removed": 0, "shards": {}}
+        changed, removed = False, []
+        for name in sorted(affected):
+            if not assignment.get(name):
+                removed.append(name)
+                continue
+            shard = self._shard_processor(root, name, assignment[name])
+            shard_stats = shard._sync_documents()
+            stats["shards"][name] = shard_stats
+            stats["chunks_added"] += shard_stats.get("chunks_added", 0)
+            stats["chunks_removed"] += shard_stats.get("chunks_removed", 0)
+            changed |= shards.record(name, shard.load_manifest())
+        for name in removed:
+            entry = shards.shards.pop(name, None)
+            stats["chunks_removed"] += entry["chunks"] if entry else 0
+            stats["shards"][name] = {"mode": "removed"}
+            changed = True
+        if changed:
+            shards.save(root)
+        # Unlisted first, so readers never look for a shard that is gone
+        for name in removed:
+            unpublish(root / name)
+        return stats
+    
+    def rebuild_shard(self, name: str) -> int:
+        """Re-index one shard from scratch, leaving the others untouched"""
+        with self.write_lock, self._timed_operation("rebuild_shard"):
+            if not is_sharded(self.vectorstore_path):
+                raise ValueError(f"{self.vectorstore_path} is not a sharded index")
+            file_names = self._assign_shards().get(name)
+            if not file_names:
+                raise ValueError(f"No files belong to shard {name}")
+            shards = ShardManifest.load(self.vectorstore_path)
+            shard = self._shard_processor(self.vectorstore_path, name, file_names)
+            _, chunk_count = shard.process_documents()
+            shards.record(name, shard.load_manifest())
+            shards.save(self.vectorstore_path)
+            return chunk_count
+    
+    def _replace_files(self, vectorstore: FAISS, manifest: IndexManifest,
+                       removed: List[str], changed: List[Path]) -> Dict[str, int]:
+        """Drop chunks of removed files and of old versions, then stream in the changed files
+
+        A changed file that fails to parse stays out of the manifest, so the
+        next sync retries it.
+        """
+        stale_ids = []
+        for name in removed + [file_path.name for file_path in changed]:
+            record = manifest.files.pop(name, None)
+            if record:
+                stale_ids.extend(record.chunk_ids)
+        if stale_ids:
+            delete_chunks(vectorstore, stale_ids)
         
-        vectorstore = self.create_vectorstore(all_chunks)
-        self.save_vectorstore(vectorstore)
-        logger.info(f"Created vectorstore with {len(all_chunks)} chunks")
-        return vectorstore, len(all_chunks)
+        _, chunk_count = self.index_batches(
+            self.iter_chunk_batches(changed, manifest.files, skip_errors=True), vectorstore
+        )
+        return {"chunks_added": chunk_count, "chunks_removed": len(stale_ids)}
     
-    def add_documents_to_existing_store(self, file_paths: List[Path]) -> int:
+    def _needs_rebuild(self, vectorstore: FAISS, manifest: IndexManifest, names: List[str]) -> bool:
+        """Whether the index must be rebuilt: another embedding model, or too many tombstones
+
+        IVF and HNSW indexes keep deleted vectors as tombstones; once they
+        would exceed `max_tombstones` of the index, a rebuild drops them
+        (and retrains IVF lists on the current corpus).
+        """
+        if not manifest.matches_embedding_model(self.embeddings.model_id):
+            logger.info(f"Index was built with embedding model {manifest.embedding_model}, "
+                        f"re-embedding everything with {self.embeddings.model_id}")
+            return True
+        if supports_removal(vectorstore.index):
+            return False
+        removing = sum(len(manifest.files[name].chunk_ids) for name in names if name in manifest.files)
+        if not removing:
+            return False
+        ntotal = vectorstore.index.ntotal
+        tombstones = ntotal - len(vectorstore.index_to_docstore_id) + removing
+        if tombstones > self.index_config.max_tombstones * ntotal:
+            logger.info(f"{tombstones} of {ntotal} vectors would be tombstones, rebuilding from the data directory")
+            return True
+        return False
+    
+    def sync_documents(self) -> Dict:
+        """Bring the vector store in line with the data directory, re-indexing only what changed"""
+        with self.write_lock:
+            with self._timed_operation("sync_documents"):
+                stats = self._sync_shards() if self.sharded else self._sync_documents()
+            stats["timings"] = self.last_timings
+            return stats
+    
+    def _sync_documents(self) -> Dict:
         vectorstore = self.load_existing_vectorstore()
         if not vectorstore:
-            raise ValueError("No existing vector store found")
-        
-        new_chunks = []
-        for file_path in file_paths:
-            if file_path.suffix.lower() not in self.supported_extensions:
-                logger.warning(f"Skipping unsupported file: {file_path}")
+            _, chunk_count = self.process_documents()
+            return {"mode": "rebuild", "chunks_added": chunk_count, "chunks_removed": 0}
+    
+        manifest = self.load_manifest(vectorstore)
+        files = {file_path.name: file_path for file_path in self.get_supported_files()}
+        removed = [name for name in manifest.files if name not in files]
+        changed, unchanged, refreshed = [], 0, 0
+        for name, file_path in files.items():
+            record = manifest.files.get(name)
+            if record and record.chunking != self._chunking_signature(file_path):
+                # Chunked with other settings: re-chunk, reusing the cached page text and embeddings
+                changed.append(file_path)
+                continue
+            if record and record.matches_stat(file_path):
+                unchanged += 1
+                continue
+            sha256 = file_sha256(file_path)
+            if record and record.sha256 == sha256:
+                # Touched but identical content: refresh the stat fields only
+                stat = file_path.stat()
+                record.size, record.mtime = stat.st_size, stat.st_mtime
+                unchanged += 1
+                refreshed += 1
                 continue
-            try:
-                documents = self.load_document(file_path)
-                chunks = self.split_documents(documents)
-                new_chunks.extend(chunks)
-                logger.info(f"Added {len(chunks)} chunks from {file_path.name}")
-            except Exception as e:
-                logger.error(f"Failed to process {file_path}: {str(e)}")
+            changed.append(file_path)
+    
+        if self._needs_rebuild(vectorstore, manifest, removed + [p.name for p in changed]):
+            discard_working_copy(vectorstore)
+            _, chunk_count = self.process_documents()
+            return {"mode": "rebuild", "chunks_added": chunk_count, "chunks_removed": 0}
+    
+        stats = {"mode": "sync", "removed": removed, "changed": [p.name for p in changed], "unchanged": unchanged}
+        if removed or changed:
+            stats.update(self._replace_files(vectorstore, manifest, removed, changed))
+        if not (removed or changed or refreshed):
+            # Nothing to publish: readers keep the current version and its cached answers
+            discard_working_copy(vectorstore)
+            return stats
+        self.save_vectorstore(vectorstore, manifest)
+        logger.info(f"Synced vectorstore: {len(changed)} changed, {len(removed)} removed, {unchanged} unchanged")
+        return stats
+    
+    def add_documents_to_existing_store(self, file_paths: List[Path]) -> int:
+        with self.write_lock, self._timed_operation("add_documents"):
+            if self.sharded:
+                # Only the shards these files belong to are re-indexed and republished
+                names = [p.name for p in file_paths if p.suffix.lower() in self.supported_extensions]
+                return self._sync_shards(names)["chunks_added"]
+            vectorstore = self.load_existing_vectorstore()
+            if not vectorstore:
+                raise ValueError("No existing vector store found")
         
-        if new_chunks:
-            vectorstore.add_documents(new_chunks)
-            self.save_vectorstore(vectorstore)
-            logger.info(f"Added {len(new_chunks)} new chunks to vectorstore")
+            supported = []
+            for file_path in file_paths:
+                if file_path.suffix.lower() not in self.supported_extensions:
+                    logger.warning(f"Skipping unsupported file: {file_path}")
+                    continue
+                supported.append(file_path)
+        
+            # Uploading a new version of a file replaces its previous chunks
+            manifest = self.load_manifest(vectorstore)
+            if self._needs_rebuild(vectorstore, manifest, [file_path.name for file_path in supported]):
+                discard_working_copy(vectorstore)
+                _, chunk_count = self.process_documents()
+                return chunk_count
+            stats = self._replace_files(vectorstore, manifest, [], supported)
+            if stats["chunks_added"] or stats["chunks_removed"]:
+                self.save_vectorstore(vectorstore, manifest)
+                logger.info(f"Added {stats['chunks_added']} new chunks to vectorstore "
+                            f"(replaced {stats['chunks_removed']})")
+            else:
+                discard_working_copy(vectorstore)
         
-        return len(new_chunks)
\ No newline at end of file
+            return stats["chunks_added"]
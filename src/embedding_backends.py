@@ -0,0 +1,192 @@
+# embedding_backends.py
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+import logging
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKENDS = ("openai", "sentence-transformers", "onnx")
+
+DEFAULT_MODELS = {
+    "openai": "text-embedding-3-small",
+    "sentence-transformers": "sentence-transformers/all-MiniLM-L6-v2",
+    # A directory holding model.onnx (or model_int8.onnx) and tokenizer.json
+    "onnx": "./models/all-MiniLM-L6-v2-onnx",
+}
+
+QUANTIZED_FILE = "model_int8.onnx"
+
+
+def _default_threads() -> int:
+    return int(os.getenv("EMBEDDING_THREADS", str(os.cpu_count() or 1)))
+
+
+class LocalEmbeddings(Embeddings):
+    """Base for models that run in-process on CPU
+
+    Texts are embedded in batches of `batch_size`, sorted by length so each
+    batch pads as little as possible, and vectors are L2-normalized like
+    OpenAI's. No rate limiting or request batching by tokens is needed.
+    With `truncate_dim`, vectors keep only their leading dimensions and are
+    renormalized, which preserves quality only for Matryoshka-trained models.
+    """
+
+    def __init__(self, model: str, batch_size: int = 64, threads: Optional[int] = None,
+                 truncate_dim: Optional[int] = None):
+        self.model = model
+        self.batch_size = batch_size
+        self.threads = threads or _default_threads()
+        self.truncate_dim = truncate_dim
+        self.dimensions: Optional[int] = None
+
+    def _set_dimensions(self, native: int):
+        if self.truncate_dim and self.truncate_dim > native:
+            logger.warning(f"EMBEDDING_DIMENSIONS={self.truncate_dim} exceeds the {native} dimensions of {self.model}")
+        self.dimensions = min(self.truncate_dim or native, native)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self._encode(texts)
+        if vectors.shape[1] > self.dimensions:
+            vectors = vectors[:, :self.dimensions]
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            vectors[indices] = self._embed([texts[i] for i in indices])
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0].tolist()
+
+
+class SentenceTransformerEmbeddings(LocalEmbeddings):
+    """A sentence-transformers model on CPU, using `threads` torch threads"""
+
+    def __init__(self, model: str = DEFAULT_MODELS["sentence-transformers"], batch_size: int = 64,
+                 threads: Optional[int] = None, truncate_dim: Optional[int] = None):
+        super().__init__(model, batch_size, threads, truncate_dim)
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("EMBEDDING_BACKEND=sentence-transformers needs `pip install sentence-transformers`") from e
+        torch.set_num_threads(self.threads)
+        self._model = SentenceTransformer(model, device="cpu")
+        self._set_dimensions(self._model.get_sentence_embedding_dimension())
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self._model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True,
+                                  normalize_embeddings=True, show_progress_bar=False).astype(np.float32)
+
+
+class OnnxEmbeddings(LocalEmbeddings):
+    """A transformer encoder exported to ONNX, run with ONNX Runtime on CPU
+
+    `model` is a directory with tokenizer.json and model.onnx; the int8 model
+    written by quantize_onnx_model() is used when present. Token embeddings
+    are mean-pooled over the attention mask, as sentence-transformers does.
+    """
+
+    def __init__(self, model: str = DEFAULT_MODELS["onnx"], batch_size: int = 64,
+                 threads: Optional[int] = None, max_length: int = 256, truncate_dim: Optional[int] = None):
+        model_dir = Path(model)
+        model_file = model_dir / QUANTIZED_FILE
+        if not model_file.exists():
+            model_file = model_dir / "model.onnx"
+        # The file name is part of the identity: int8 and fp32 vectors differ
+        super().__init__(f"onnx/{model_dir.name}/{model_file.name}", batch_size, threads, truncate_dim)
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("EMBEDDING_BACKEND=onnx needs `pip install onnxruntime tokenizers`") from e
+
+        self._tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length)
+        self._tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = onnxruntime.InferenceSession(str(model_file), options,
+                                                     providers=["CPUExecutionProvider"])
+        self._input_names = {inp.name for inp in self._session.get_inputs()}
+        self._set_dimensions(int(self._encode(["dimension probe"]).shape[1]))
+        logger.info(f"Loaded ONNX embedding model {model_file} ({self.dimensions} dimensions)")
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        output = self._session.run(None, {name: feeds[name] for name in self._input_names})[0]
+        if output.ndim == 3:
+            mask = attention_mask[:, :, None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        return (output / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def quantize_onnx_model(model_dir: str) -> Path:
+    """Write an int8 dynamically quantized copy of model_dir/model.onnx next to it"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    source = Path(model_dir) / "model.onnx"
+    target = Path(model_dir) / QUANTIZED_FILE
+    quantize_dynamic(str(source), str(target), weight_type=QuantType.QInt8)
+    logger.info(f"Quantized {source} to {target}")
+    return target
+
+
+def create_embeddings(backend: Optional[str] = None, model: Optional[str] = None,
+                      dimensions: Optional[int] = None) -> Embeddings:
+    """Embedding model for EMBEDDING_BACKEND, EMBEDDING_MODEL and EMBEDDING_DIMENSIONS"""
+    backend = backend or os.getenv("EMBEDDING_BACKEND", "openai")
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unsupported EMBEDDING_BACKEND: {backend} (expected one of {', '.join(EMBEDDING_BACKENDS)})")
+    model = model or os.getenv("EMBEDDING_MODEL") or DEFAULT_MODELS[backend]
+    # Shorter vectors from Matryoshka-trained models; 0 keeps the full size
+    dimensions = dimensions or int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
+    if backend == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        # text-embedding-3 models shorten vectors server-side; the size is part of the model id
+        return OpenAIEmbeddings(model=model, dimensions=dimensions)
+
+    batch_size = int(os.getenv("EMBEDDING_LOCAL_BATCH_SIZE", "64"))
+    if backend == "sentence-transformers":
+        return SentenceTransformerEmbeddings(model, batch_size, truncate_dim=dimensions)
+    return OnnxEmbeddings(model, batch_size, truncate_dim=dimensions)
+
+
+def embeds_queries_as_documents(embeddings: Embeddings) -> bool:
+    """Whether embed_query(text) is embed_documents([text])[0], so queries can be embedded in batches
+
+    True for OpenAI and the local backends; other models may embed queries
+    differently (instruction prefixes, separate query encoders).
+    """
+    if isinstance(embeddings, LocalEmbeddings):
+        return True
+    try:
+        from langchain_openai import OpenAIEmbeddings
+    except ImportError:
+        return False
+    return isinstance(embeddings, OpenAIEmbeddings)
+
+
+@lru_cache(maxsize=None)
+def get_embeddings() -> Embeddings:
+    """The configured model, loaded once per process and shared by ingestion and queries"""
+    return create_embeddings()
@@ -0,0 +1,213 @@
+# embedding_cache.py
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from .embedding_backends import embeds_queries_as_documents
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = "./vectorstore/embedding_cache.sqlite"
+
+# SQLite caps the number of bound parameters per statement
+_SQL_BATCH = 500
+
+
+def embedding_model_id(embeddings: Embeddings) -> str:
+    """Identify an embedding model for cache keys and index manifests"""
+    if isinstance(getattr(embeddings, "model_id", None), str):
+        return embeddings.model_id
+    model = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None)
+    model = model or type(embeddings).__name__
+    dimensions = getattr(embeddings, "dimensions", None)
+    return f"{model}:{dimensions}" if dimensions else str(model)
+
+
+class EmbeddingCache:
+    """Persistent embedding store keyed by (model, sha256 of chunk text)"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash BLOB NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> bytes:
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Return cached vectors in input order, None where missing"""
+        return [v.tolist() if v is not None else None for v in self.get_arrays(model, texts)]
+
+    def get_arrays(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Like get_many, as read-only float32 arrays"""
+        hashes = [self.text_hash(t) for t in texts]
+        found: Dict[bytes, bytes] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for start in range(0, len(unique), _SQL_BATCH):
+                batch = unique[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                found.update(rows)
+        return [
+            np.frombuffer(found[h], dtype=np.float32) if h in found else None
+            for h in hashes
+        ]
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        rows = [
+            (model, self.text_hash(t), np.asarray(v, dtype=np.float32).tobytes())
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only calls the underlying model on cache misses
+
+    Document vectors persist in the SQLite cache. Query vectors are kept in
+    a bounded in-memory LRU instead: every distinct question would otherwise
+    add a row that is never evicted.
+    """
+
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache, model_id: Optional[str] = None,
+                 query_cache_size: Optional[int] = None):
+        self.underlying = underlying
+        self.cache = cache
+        self.model_id = model_id or embedding_model_id(underlying)
+        if query_cache_size is None:
+            query_cache_size = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+        self.query_cache_size = query_cache_size
+        # (model id, query) -> vector, least recently used first
+        self._queries: "OrderedDict[tuple, List[float]]" = OrderedDict()
+        self._queries_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Expose attributes such as `model` and `dimensions` of the wrapped model
+        if name == "underlying":
+            raise AttributeError(name)
+        return getattr(self.underlying, name)
+
+    def document_vectors(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Full-precision vectors already cached for these document texts, None where missing"""
+        return self.cache.get_arrays(self.model_id, texts)
+
+    def _lookup(self, texts: List[str]):
+        cached = self.cache.get_many(self.model_id, texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+        return cached, missing
+
+    def _fill(self, texts: List[str], cached, missing: List[str], vectors) -> List[List[float]]:
+        self.cache.put_many(self.model_id, missing, vectors)
+        lookup = dict(zip(missing, vectors))
+        logger.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+        return [v if v is not None else lookup[t] for t, v in zip(texts, cached)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        cached, missing = self._lookup(texts)
+        vectors = self.underlying.embed_documents(missing) if missing else []
+        return self._fill(texts, cached, missing, vectors)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        cached, missing = self._lookup(texts)
+        vectors = await self.underlying.aembed_documents(missing) if missing else []
+        return self._fill(texts, cached, missing, vectors)
+
+    def _get_queries(self, texts: List[str]) -> List[Optional[List[float]]]:
+        with self._queries_lock:
+            cached = []
+            for text in texts:
+                vector = self._queries.get((self.model_id, text))
+                if vector is not None:
+                    self._queries.move_to_end((self.model_id, text))
+                cached.append(vector)
+            return cached
+
+    def _put_queries(self, texts: List[str], vectors: List[List[float]]):
+        if self.query_cache_size <= 0:
+            return
+        with self._queries_lock:
+            for text, vector in zip(texts, vectors):
+                self._queries[(self.model_id, text)] = vector
+                self._queries.move_to_end((self.model_id, text))
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        cached = self._get_queries([text])[0]
+        if cached is None:
+            cached = self.underlying.embed_query(text)
+            self._put_queries([text], [cached])
+        return cached
+
+    async def aembed_query(self, text: str) -> List[float]:
+        cached = self._get_queries([text])[0]
+        if cached is None:
+            cached = await self.underlying.aembed_query(text)
+            self._put_queries([text], [cached])
+        return cached
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries, with one request to the model when it allows
+
+        Every vector is what `aembed_query` would return, so the query cache
+        holds the same vectors whichever path filled it.
+        """
+        texts = list(texts)
+        cached = self._get_queries(texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+        if not missing:
+            vectors = []
+        elif embeds_queries_as_documents(self.underlying):
+            vectors = await self.underlying.aembed_documents(missing)
+        else:
+            vectors = await asyncio.gather(*(self.underlying.aembed_query(text) for text in missing))
+        self._put_queries(missing, vectors)
+        lookup = dict(zip(missing, vectors))
+        return [v if v is not None else lookup[t] for t, v in zip(texts, cached)]
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(path: Optional[str] = None) -> EmbeddingCache:
+    """Return the process-wide cache for a path so all components share one connection"""
+    path = path or os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+    key = str(Path(path).resolve())
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(path)
+        return _caches[key]
@@ -0,0 +1,267 @@
+# embedding_executor.py
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rough characters per token for English text, when no tokenizer is available
+_CHARS_PER_TOKEN = 4
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_RETRYABLE_ERRORS = {
+    "RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+    "TimeoutError", "ConnectionError",
+}
+
+
+class EstimatedEncoding:
+    """Stands in for a tiktoken encoding that cannot be loaded
+
+    Every `_CHARS_PER_TOKEN` characters count as one token, so counts are
+    estimates, but cutting a text to a number of tokens and decoding it back
+    still works.
+    """
+
+    def encode_ordinary(self, text: str) -> List[str]:
+        return [text[i:i + _CHARS_PER_TOKEN] for i in range(0, len(text), _CHARS_PER_TOKEN)]
+
+    def encode_ordinary_batch(self, texts: List[str]) -> List[List[str]]:
+        return [self.encode_ordinary(text) for text in texts]
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+_encodings: Dict[str, object] = {}
+_encodings_lock = threading.Lock()
+
+
+def load_encoding(name: str = "cl100k_base"):
+    """The tiktoken encoding `name`, or an EstimatedEncoding when it cannot be loaded
+
+    tiktoken downloads the BPE file on first use, which fails offline. The
+    result is kept for the process, so the failure is logged once.
+    """
+    with _encodings_lock:
+        if name not in _encodings:
+            try:
+                import tiktoken
+                _encodings[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                logger.warning(f"Could not load tiktoken encoding {name} ({type(e).__name__}: {e}); "
+                               f"estimating {_CHARS_PER_TOKEN} characters per token")
+                _encodings[name] = EstimatedEncoding()
+        return _encodings[name]
+
+
+def _is_retryable(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return status in _RETRYABLE_STATUS or type(error).__name__ in _RETRYABLE_ERRORS
+
+
+class RateLimiter:
+    """Token buckets for requests-per-minute and tokens-per-minute limits
+
+    The buckets are guarded by a thread lock rather than an asyncio one, so
+    a single limiter keeps counting across event loops: embed_documents
+    runs each call on a fresh loop via asyncio.run.
+    """
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm or 0)
+        self._tokens = float(tpm or 0)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens: int):
+        # A batch larger than the whole TPM budget can never fit; let it wait for a full bucket
+        if self.tpm:
+            tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                self._refill()
+                wait = 0.0
+                if self.rpm and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+                if self.tpm and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+                if wait <= 0:
+                    if self.rpm:
+                        self._requests -= 1
+                    if self.tpm:
+                        self._tokens -= tokens
+                    return
+            # Sleep outside the lock; another caller may take the budget first and we re-check
+            await asyncio.sleep(wait)
+
+
+class EmbeddingStats:
+    def __init__(self):
+        self.chunks = 0
+        self.tokens = 0
+        self.batches = 0
+        self.retries = 0
+        self.seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "chunks": self.chunks,
+            "tokens": self.tokens,
+            "batches": self.batches,
+            "retries": self.retries,
+            "seconds": round(self.seconds, 3),
+            "chunks_per_second": round(self.chunks / self.seconds, 1) if self.seconds else 0.0,
+            "tokens_per_second": round(self.tokens / self.seconds, 1) if self.seconds else 0.0,
+        }
+
+
+class EmbeddingExecutor(Embeddings):
+    """Embeds documents in token-budgeted batches, several requests at a time
+
+    Batches are dispatched concurrently on an asyncio loop within the
+    configured RPM/TPM limits, retried with exponential backoff on rate-limit
+    and transient errors, and reassembled in input order. Any `Embeddings`
+    implementation can be wrapped, including in-process fakes for testing.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_tokens: int = 8192,
+                 max_batch_size: int = 512, max_concurrency: int = 4,
+                 rpm: Optional[int] = None, tpm: Optional[int] = None,
+                 max_retries: int = 6, encoding_name: str = "cl100k_base"):
+        self.embeddings = embeddings
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.encoding_name = encoding_name
+        self._encoding = None
+        # Shared by every call, so the limits hold across ingest batches
+        self.limiter = RateLimiter(rpm, tpm)
+        self.last_stats = EmbeddingStats()
+        self.total_stats = EmbeddingStats()
+
+    @classmethod
+    def from_env(cls, embeddings: Embeddings) -> "EmbeddingExecutor":
+        rpm = os.getenv("EMBEDDING_RPM")
+        tpm = os.getenv("EMBEDDING_TPM")
+        return cls(
+            embeddings,
+            max_batch_tokens=int(os.getenv("EMBEDDING_BATCH_TOKENS", "8192")),
+            max_concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", "4")),
+            rpm=int(rpm) if rpm else None,
+            tpm=int(tpm) if tpm else None,
+        )
+
+    def __getattr__(self, name):
+        # Expose attributes such as `model` of the wrapped embeddings
+        if name in ("embeddings", "_encoding", "limiter"):
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    @property
+    def encoding(self):
+        """The tiktoken encoding, or an estimate when it cannot be loaded (see load_encoding)"""
+        if self._encoding is None:
+            self._encoding = load_encoding(self.encoding_name)
+        return self._encoding
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(texts)]
+
+    def pack_batches(self, texts: List[str]) -> List[Tuple[List[int], int]]:
+        """Group text indices into (indices, token count) batches within the budgets"""
+        token_counts = self.count_tokens(texts)
+        batches, current, current_tokens = [], [], 0
+        for i, count in enumerate(token_counts):
+            if current and (current_tokens + count > self.max_batch_tokens
+                            or len(current) >= self.max_batch_size):
+                batches.append((current, current_tokens))
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += count
+        if current:
+            batches.append((current, current_tokens))
+        return batches
+
+    async def _embed_batch(self, texts: List[str], tokens: int, limiter: RateLimiter,
+                           semaphore: asyncio.Semaphore, stats: EmbeddingStats) -> List[List[float]]:
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                await limiter.acquire(tokens)
+                try:
+                    return await self.embeddings.aembed_documents(texts)
+                except Exception as e:
+                    if attempt == self.max_retries or not _is_retryable(e):
+                        raise
+                    stats.retries += 1
+                    delay = min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+                    logger.warning(f"Embedding batch failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        if not texts:
+            return []
+        stats = EmbeddingStats()
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = self.pack_batches(texts)
+        results = await asyncio.gather(*(
+            self._embed_batch([texts[i] for i in indices], tokens, self.limiter, semaphore, stats)
+            for indices, tokens in batches
+        ))
+
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for (indices, _), batch_vectors in zip(batches, results):
+            for i, vector in zip(indices, batch_vectors):
+                vectors[i] = vector
+
+        stats.chunks = len(texts)
+        stats.tokens = sum(tokens for _, tokens in batches)
+        stats.batches = len(batches)
+        stats.seconds = time.perf_counter() - started
+        self._record(stats)
+        return vectors
+
+    def _record(self, stats: EmbeddingStats):
+        self.last_stats = stats
+        for name in ("chunks", "tokens", "batches", "retries", "seconds"):
+            setattr(self.total_stats, name, getattr(self.total_stats, name) + getattr(stats, name))
+        summary = stats.as_dict()
+        logger.info(f"Embedded {summary['chunks']} chunks in {summary['batches']} batches "
+                    f"({summary['chunks_per_second']} chunks/s, {summary['tokens_per_second']} tokens/s)")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aembed_documents(texts))
+        # Already inside an event loop: run ours on a separate thread
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.aembed_documents(texts)).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
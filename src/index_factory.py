@@ -0,0 +1,133 @@
+# index_factory.py
+import os
+from typing import Optional
+import numpy as np
+import faiss
+import logging
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# How flat, ivf_flat and hnsw indexes store each vector component: 4, 2 or 1 bytes
+INDEX_ENCODINGS = ("float32", "fp16", "sq8")
+
+_SCALAR_QUANTIZERS = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# FAISS wants roughly this many training points per IVF list
+_POINTS_PER_LIST = 39
+
+
+class IndexConfig:
+    """Which FAISS index DocumentProcessor builds, and how it is trained"""
+
+    def __init__(self, index_type: str = "flat", nlist: int = 1024, pq_m: int = 16,
+                 pq_bits: int = 8, hnsw_m: int = 32, hnsw_ef_construction: int = 200,
+                 train_size: int = 50000, encoding: str = "float32", max_tombstones: float = 0.2):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type: {index_type} (expected one of {', '.join(INDEX_TYPES)})")
+        if encoding not in INDEX_ENCODINGS:
+            raise ValueError(f"Unsupported index encoding: {encoding} (expected one of {', '.join(INDEX_ENCODINGS)})")
+        if encoding != "float32" and index_type == "ivf_pq":
+            raise ValueError("ivf_pq already compresses vectors; INDEX_ENCODING applies to flat, ivf_flat and hnsw")
+        self.index_type = index_type
+        self.encoding = encoding
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_bits = pq_bits
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.train_size = train_size
+        # Fraction of IVF/HNSW vectors left behind by deletes before a sync rebuilds the index
+        self.max_tombstones = max_tombstones
+
+    @classmethod
+    def from_env(cls) -> "IndexConfig":
+        return cls(
+            index_type=os.getenv("INDEX_TYPE", "flat"),
+            nlist=int(os.getenv("INDEX_NLIST", "1024")),
+            pq_m=int(os.getenv("INDEX_PQ_M", "16")),
+            pq_bits=int(os.getenv("INDEX_PQ_BITS", "8")),
+            hnsw_m=int(os.getenv("INDEX_HNSW_M", "32")),
+            hnsw_ef_construction=int(os.getenv("INDEX_HNSW_EF_CONSTRUCTION", "200")),
+            train_size=int(os.getenv("INDEX_TRAIN_SIZE", "50000")),
+            encoding=os.getenv("INDEX_ENCODING", "float32"),
+            max_tombstones=float(os.getenv("INDEX_MAX_TOMBSTONES", "0.2")),
+        )
+
+    @property
+    def needs_training(self) -> bool:
+        # sq8 learns each dimension's value range
+        return self.index_type.startswith("ivf") or self.encoding == "sq8"
+
+    def describe(self) -> str:
+        encoding = "" if self.encoding == "float32" else self.encoding
+        if self.index_type == "ivf_flat":
+            return f"ivf_flat(nlist={self.nlist}{', ' + encoding if encoding else ''})"
+        if self.index_type == "ivf_pq":
+            return f"ivf_pq(nlist={self.nlist}, m={self.pq_m}, bits={self.pq_bits})"
+        if self.index_type == "hnsw":
+            return f"hnsw(M={self.hnsw_m}{', ' + encoding if encoding else ''})"
+        return f"flat({encoding})" if encoding else "flat"
+
+
+def build_index(config: IndexConfig, dim: int, sample: Optional[np.ndarray] = None):
+    """Create an empty index of the configured type, trained on `sample` if it needs training"""
+    if config.needs_training and (sample is None or len(sample) == 0):
+        raise ValueError(f"{config.describe()} index needs training vectors")
+    qtype = _SCALAR_QUANTIZERS.get(config.encoding)
+    if config.index_type == "flat":
+        if qtype is None:
+            return faiss.IndexFlatL2(dim)
+        index = faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_L2)
+    elif config.index_type == "hnsw":
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(dim, config.hnsw_m)
+        else:
+            index = faiss.IndexHNSWSQ(dim, qtype, config.hnsw_m)
+        index.hnsw.efConstruction = config.hnsw_ef_construction
+    else:
+        # Small corpora cannot support many lists; shrink nlist rather than fail
+        nlist = max(1, min(config.nlist, len(sample) // _POINTS_PER_LIST))
+        quantizer = faiss.IndexFlatL2(dim)
+        if config.index_type == "ivf_flat" and qtype is None:
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        elif config.index_type == "ivf_flat":
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, qtype, faiss.METRIC_L2)
+        else:
+            if dim % config.pq_m:
+                raise ValueError(f"INDEX_PQ_M={config.pq_m} must divide the embedding dimension {dim}")
+            # Each PQ codebook has 2**bits centroids to train
+            bits = min(config.pq_bits, max(1, int(np.log2(len(sample) / _POINTS_PER_LIST))))
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, config.pq_m, bits)
+        logger.info(f"Using nlist={nlist} for {len(sample)} training vectors")
+    if not index.is_trained:
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+        logger.info(f"Trained {config.describe()} on {len(sample)} vectors")
+    return index
+
+
+def supports_removal(index) -> bool:
+    """Whether FAISS.delete leaves every remaining vector mapped to its own chunk
+
+    LangChain renumbers the docstore ids by position after `remove_ids`.
+    Flat indexes compact their storage the same way, but IVF indexes keep
+    the original ids in their inverted lists, and HNSW cannot remove at all;
+    their deleted chunks are tombstoned instead (see vectorstore_io.delete_chunks).
+    """
+    return not isinstance(index, (faiss.IndexHNSW, faiss.IndexIVF))
+
+
+def search_parameters(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                      selector=None) -> Optional[faiss.SearchParameters]:
+    """Per-query search knobs, so a shared index is never reconfigured in place"""
+    # Passing the selector as a keyword keeps it referenced for the lifetime of params
+    kwargs = {"sel": selector} if selector is not None else {}
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe or index.nprobe, **kwargs)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search or index.hnsw.efSearch, **kwargs)
+    return faiss.SearchParameters(**kwargs) if kwargs else None
@@ -0,0 +1,284 @@
+# index_registry.py
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import FAISS
+import faiss
+from .bm25_index import BM25Index
+from .embedding_cache import embedding_model_id
+from .index_factory import search_parameters
+from .manifest import IndexManifest
+from .metadata_index import MetadataIndex
+from .shards import ShardManifest, is_sharded
+from .vectorstore_io import (
+    has_vectorstore, load_vectorstore, merge_hits, search_documents, search_subset, tombstoned_positions
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+Hits = List[Tuple[Document, float]]
+
+
+class LoadedIndex:
+    """A vectorstore as loaded from disk, shared read-only by every pipeline"""
+
+    __slots__ = ("vectorstore", "version", "manifest_mtime", "bm25", "metadata", "_tombstones", "_live")
+
+    def __init__(self, vectorstore: FAISS, version: int, manifest_mtime: Optional[int],
+                 bm25: Optional[BM25Index] = None, metadata: Optional[MetadataIndex] = None):
+        self.vectorstore = vectorstore
+        self.version = version
+        self.manifest_mtime = manifest_mtime
+        # None for stores saved before keyword or metadata indexing existed
+        self.bm25 = bm25
+        self.metadata = metadata
+        # Deleted IVF/HNSW vectors stay in the index; unfiltered searches exclude them
+        # (filtered ones only ever select live positions). Both selectors are kept referenced.
+        tombstones = tombstoned_positions(vectorstore)
+        self._tombstones = faiss.IDSelectorBatch(tombstones) if len(tombstones) else None
+        self._live = faiss.IDSelectorNot(self._tombstones) if len(tombstones) else None
+
+    @property
+    def higher_is_better(self) -> bool:
+        return self.vectorstore.index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+    @property
+    def has_keyword_index(self) -> bool:
+        return self.bm25 is not None
+
+    def search(self, vectors: Sequence[Sequence[float]], k: int, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> List[Hits]:
+        """(document, distance) hits for each of a matrix of query vectors"""
+        params = search_parameters(self.vectorstore.index, nprobe=nprobe, ef_search=ef_search, selector=self._live)
+        return search_documents(self.vectorstore, vectors, k, params=params)
+
+    def search_filtered(self, vector: Sequence[float], k: int, filters: dict, nprobe: Optional[int] = None,
+                        ef_search: Optional[int] = None, exact_max: int = 50000) -> Hits:
+        """Search only the chunks the metadata filters select"""
+        if self.metadata is None:
+            raise ValueError("This index has no metadata index yet; sync the documents to build it")
+        index = self.vectorstore.index
+        return search_subset(
+            self.vectorstore, vector, k, self.metadata.select(filters),
+            params_for=lambda selector: search_parameters(index, nprobe=nprobe, ef_search=ef_search,
+                                                          selector=selector),
+            exact_max=exact_max,
+        )
+
+    def keyword_search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        return self.bm25.search(query, k)
+
+    def document(self, chunk_id: str) -> Optional[Document]:
+        doc = self.vectorstore.docstore.search(chunk_id)
+        return doc if isinstance(doc, Document) else None
+
+    def matches(self, metadata: dict, filters: dict) -> bool:
+        return self.metadata is not None and self.metadata.matches(metadata, filters)
+
+    def describe_documents(self) -> List[dict]:
+        return self.metadata.describe() if self.metadata is not None else []
+
+
+_shard_executor: Optional[ThreadPoolExecutor] = None
+_shard_executor_lock = threading.Lock()
+
+
+def _get_shard_executor() -> ThreadPoolExecutor:
+    global _shard_executor
+    with _shard_executor_lock:
+        if _shard_executor is None:
+            _shard_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("SHARD_SEARCH_THREADS", str(os.cpu_count() or 4))),
+                thread_name_prefix="shard-search",
+            )
+        return _shard_executor
+
+
+class ShardedIndex:
+    """A vectorstore split into shards, each an independent LoadedIndex
+
+    Shards are loaded through the registry the first time a search needs
+    them and reloaded one at a time when ingestion republishes them.
+    Searches fan out to the shards on a thread pool (FAISS releases the GIL)
+    and merge the per-shard top-k by score. BM25 scores are merged the same
+    way, although each shard computes them with its own term statistics.
+    """
+
+    def __init__(self, root: Path, manifest: ShardManifest, manifest_mtime: Optional[int],
+                 load_shard: Callable[[Path], Optional[LoadedIndex]]):
+        # The version directory, so every shard comes from the same published root
+        self.root = root
+        self.manifest = manifest
+        self.version = manifest.version
+        self.manifest_mtime = manifest_mtime
+        self._load_shard = load_shard
+
+    vectorstore = None
+    has_keyword_index = True
+
+    @property
+    def higher_is_better(self) -> bool:
+        shards = self._map(lambda shard: shard.higher_is_better, self._shards_for()[:1])
+        return bool(shards and shards[0])
+
+    def shard(self, name: str) -> Optional[LoadedIndex]:
+        return self._load_shard(self.root / name)
+
+    def _shards_for(self, filters: Optional[dict] = None) -> List[str]:
+        names = sorted(self.manifest.shards)
+        source_files = filters.get("source_files") if filters else None
+        if source_files:
+            # Other shards hold none of the selected files; skip loading them
+            wanted = set(source_files)
+            names = [name for name in names if wanted.intersection(self.manifest.shards[name]["files"])]
+        return names
+
+    def _map(self, fn: Callable[[LoadedIndex], object], names: List[str]) -> list:
+        """fn(shard) for each named shard, in parallel, skipping shards removed since"""
+        def run(name):
+            shard = self.shard(name)
+            return fn(shard) if shard is not None else None
+        if len(names) == 1:
+            results = [run(names[0])]
+        else:
+            results = list(_get_shard_executor().map(run, names))
+        return [result for result in results if result is not None]
+
+    def search(self, vectors: Sequence[Sequence[float]], k: int, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None) -> List[Hits]:
+        per_shard = self._map(lambda shard: (shard.higher_is_better, shard.search(vectors, k, nprobe, ef_search)),
+                              self._shards_for())
+        if not per_shard:
+            return [[] for _ in vectors]
+        higher_is_better = per_shard[0][0]
+        return [merge_hits([hits[i] for _, hits in per_shard], k, higher_is_better) for i in range(len(vectors))]
+
+    def search_filtered(self, vector: Sequence[float], k: int, filters: dict, nprobe: Optional[int] = None,
+                        ef_search: Optional[int] = None, exact_max: int = 50000) -> Hits:
+        per_shard = self._map(
+            lambda shard: (shard.higher_is_better,
+                           shard.search_filtered(vector, k, filters, nprobe, ef_search, exact_max)),
+            self._shards_for(filters),
+        )
+        if not per_shard:
+            return []
+        return merge_hits([hits for _, hits in per_shard], k, per_shard[0][0])
+
+    def keyword_search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        per_shard = self._map(lambda shard: shard.keyword_search(query, k) if shard.has_keyword_index else [],
+                              self._shards_for())
+        return merge_hits(per_shard, k, higher_is_better=True)
+
+    def document(self, chunk_id: str) -> Optional[Document]:
+        for name in self._shards_for():
+            shard = self.shard(name)
+            doc = shard.document(chunk_id) if shard is not None else None
+            if doc is not None:
+                return doc
+        return None
+
+    def matches(self, metadata: dict, filters: dict) -> bool:
+        name = self.manifest.shard_of(metadata.get("source_file"))
+        shard = self.shard(name) if name is not None else None
+        return shard is not None and shard.matches(metadata, filters)
+
+    def describe_documents(self) -> List[dict]:
+        per_shard = self._map(lambda shard: shard.describe_documents(), self._shards_for())
+        return sorted((doc for docs in per_shard for doc in docs), key=lambda doc: doc["source_file"])
+
+
+def _manifest_mtime(index_dir: Path) -> Optional[int]:
+    for path in (ShardManifest.path_for(index_dir), IndexManifest.path_for(index_dir)):
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            continue
+    return None
+
+
+class IndexRegistry:
+    """Process-wide registry that loads each vectorstore once
+
+    `get()` is cheap when nothing changed (one stat of manifest.json). When
+    ingestion saves a new version, the next `get()` loads it and swaps it in
+    atomically; callers still holding the previous `LoadedIndex` finish their
+    search against it undisturbed. Sharded indexes are returned as a
+    ShardedIndex whose shards are registered here one by one.
+    """
+
+    def __init__(self):
+        self._indexes: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    def _load_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def get(self, index_dir: str, embeddings: Embeddings):
+        index_dir = Path(index_dir)
+        key = str(index_dir.absolute())
+        current = self._indexes.get(key)
+        mtime = _manifest_mtime(index_dir)
+        if current is not None and current.manifest_mtime == mtime:
+            return current
+
+        # Only one thread loads a given index; the others wait and reuse its result
+        with self._load_lock(key):
+            current = self._indexes.get(key)
+            mtime = _manifest_mtime(index_dir)
+            if current is not None and current.manifest_mtime == mtime:
+                return current
+            if is_sharded(index_dir):
+                loaded = self._open_sharded(index_dir, embeddings, mtime)
+            elif has_vectorstore(index_dir):
+                loaded = self._load(index_dir, embeddings, mtime)
+            else:
+                return current
+            with self._lock:
+                self._indexes[key] = loaded
+            if isinstance(current, ShardedIndex):
+                self._forget_shards(current, loaded)
+            logger.info(f"Loaded vectorstore {index_dir} (version {loaded.version})")
+            return loaded
+
+    def _load(self, index_dir: Path, embeddings: Embeddings, mtime: Optional[int]) -> LoadedIndex:
+        # Read the index and its manifest from the same published version
+        version_dir = index_dir.resolve()
+        manifest = IndexManifest.load(version_dir)
+        # Vectors from another model would load fine and return garbage
+        manifest.check_embedding_model(embedding_model_id(embeddings))
+        vectorstore = load_vectorstore(version_dir, embeddings, read_only=True)
+        bm25 = BM25Index.load(version_dir) if BM25Index.exists(version_dir) else None
+        metadata = MetadataIndex.load(version_dir) if MetadataIndex.exists(version_dir) else None
+        return LoadedIndex(vectorstore, manifest.version, mtime, bm25, metadata)
+
+    def _open_sharded(self, index_dir: Path, embeddings: Embeddings, mtime: Optional[int]) -> ShardedIndex:
+        # Only the shard list is read here; shards load on first search
+        version_dir = index_dir.resolve()
+        return ShardedIndex(version_dir, ShardManifest.load(version_dir), mtime,
+                            lambda shard_dir: self.get(shard_dir, embeddings))
+
+    def _forget_shards(self, previous: ShardedIndex, loaded):
+        """Drop shards that are no longer part of the index, so their files can be released"""
+        with self._lock:
+            for name in previous.manifest.shards:
+                if (not isinstance(loaded, ShardedIndex) or loaded.root != previous.root
+                        or name not in loaded.manifest.shards):
+                    self._indexes.pop(str((previous.root / name).absolute()), None)
+
+    def invalidate(self, index_dir: str):
+        with self._lock:
+            self._indexes.pop(str(Path(index_dir).absolute()), None)
+
+
+_registry = IndexRegistry()
+
+
+def get_index_registry() -> IndexRegistry:
+    return _registry
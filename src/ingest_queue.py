@@ -0,0 +1,337 @@
+# ingest_queue.py
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = "./vectorstore/ingest_jobs.sqlite"
+
+JOB_KINDS = ("upload", "sync")
+# Job states: queued -> running -> done | failed
+# File states: queued -> processing -> chunked -> indexed | failed | skipped
+
+
+# Tells apart workers whose host name and PID repeat, e.g. PID 1 in every container
+_INSTANCE = uuid.uuid4().hex[:8]
+
+
+def _worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{_INSTANCE}"
+
+
+class IngestQueue:
+    """Persistent queue of ingestion jobs with per-file progress, shared by every process
+
+    A claimed job is leased to its worker, which renews the lease by
+    heartbeat while the job runs. A running job whose lease has expired
+    belonged to a worker that died, and is requeued.
+    """
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, lease_seconds: float = 60.0):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, status TEXT NOT NULL, "
+            "worker TEXT, created REAL NOT NULL, started REAL, finished REAL, "
+            "result TEXT, error TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_files ("
+            "job_id INTEGER NOT NULL, name TEXT NOT NULL, status TEXT NOT NULL, "
+            "chunks INTEGER, error TEXT, PRIMARY KEY (job_id, name))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "heartbeat" not in columns:
+            # Queues created before leases; their running jobs are judged by start time
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+        # Wakes the local worker as soon as a job is enqueued
+        self.wakeup = threading.Event()
+
+    @classmethod
+    def from_env(cls, path: Optional[str] = None) -> "IngestQueue":
+        return cls(
+            path=path or os.getenv("INGEST_QUEUE_PATH", DEFAULT_QUEUE_PATH),
+            lease_seconds=float(os.getenv("INGEST_LEASE_SECONDS", "60")),
+        )
+
+    def enqueue(self, kind: str, file_names: Optional[List[str]] = None) -> int:
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                job_id = self._conn.execute(
+                    "INSERT INTO jobs (kind, status, created) VALUES (?, 'queued', ?)", (kind, time.time())
+                ).lastrowid
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO job_files (job_id, name, status) VALUES (?, ?, 'queued')",
+                    [(job_id, name) for name in file_names or []],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.wakeup.set()
+        logger.info(f"Queued {kind} job {job_id} ({len(file_names or [])} files)")
+        return job_id
+
+    def claim(self) -> Optional[dict]:
+        """Atomically take the oldest queued job, or return None"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    now = time.time()
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, started = ?, heartbeat = ? WHERE id = ?",
+                        (_worker_id(), now, now, row["id"]),
+                    )
+                    self._conn.execute(
+                        "UPDATE job_files SET status = 'processing' WHERE job_id = ?", (row["id"],)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"]) if row is not None else None
+
+    def heartbeat(self, job_id: int) -> bool:
+        """Renew this worker's lease on a running job; False if the job is no longer ours"""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time(), job_id, _worker_id()),
+            ).rowcount > 0
+
+    def update_file(self, job_id: int, name: str, status: str,
+                    chunks: Optional[int] = None, error: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO job_files (job_id, name, status, chunks, error) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (job_id, name) DO UPDATE SET status = excluded.status, "
+                "chunks = COALESCE(excluded.chunks, chunks), error = excluded.error",
+                (job_id, name, status, chunks, error),
+            )
+
+    def _complete(self, job_id: int, status: str, **fields) -> bool:
+        """Close a running job this worker still holds, then update its files
+
+        Returns False, changing nothing, if the lease expired and the job was
+        requeued (and perhaps claimed by another worker) in the meantime.
+        """
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        updated = self._conn.execute(
+            f"UPDATE jobs SET status = ?, finished = ?, {assignments} "
+            "WHERE id = ? AND status = 'running' AND worker = ?",
+            (status, time.time(), *fields.values(), job_id, _worker_id()),
+        ).rowcount
+        if not updated:
+            logger.warning(f"Not marking ingestion job {job_id} {status}: it is no longer held by this worker")
+        return updated > 0
+
+    def finish(self, job_id: int, result: Dict) -> bool:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                finished = self._complete(job_id, "done", result=json.dumps(result))
+                if finished:
+                    # Files parsed during the job are in the published index now
+                    self._conn.execute(
+                        "UPDATE job_files SET status = 'indexed' WHERE job_id = ? AND status = 'chunked'", (job_id,)
+                    )
+                    # e.g. unsupported file types
+                    self._conn.execute(
+                        "UPDATE job_files SET status = 'skipped' WHERE job_id = ? AND status = 'processing'",
+                        (job_id,)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return finished
+
+    def fail(self, job_id: int, error: str) -> bool:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                failed = self._complete(job_id, "failed", error=error)
+                if failed:
+                    self._conn.execute(
+                        "UPDATE job_files SET status = 'failed' WHERE job_id = ? AND status != 'failed'", (job_id,)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return failed
+
+    def requeue_orphans(self) -> int:
+        """Put back running jobs whose worker stopped renewing its lease"""
+        expired = time.time() - self.lease_seconds
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                orphans = [row["id"] for row in self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'running' AND COALESCE(heartbeat, started, 0) < ?",
+                    (expired,),
+                )]
+                for job_id in orphans:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'queued', worker = NULL, heartbeat = NULL WHERE id = ?", (job_id,)
+                    )
+                    self._conn.execute(
+                        "UPDATE job_files SET status = 'queued', error = NULL WHERE job_id = ?", (job_id,)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if orphans:
+            logger.warning(f"Requeued interrupted ingestion jobs: {orphans}")
+        return len(orphans)
+
+    def _job(self, row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["files"] = [
+            dict(file_row) for file_row in self._conn.execute(
+                "SELECT name, status, chunks, error FROM job_files WHERE job_id = ? ORDER BY name", (job["id"],)
+            )
+        ]
+        return job
+
+    def get(self, job_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._job(row) if row is not None else None
+
+    def list_jobs(self, limit: int = 20) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+            return [self._job(row) for row in rows]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+
+
+class IngestWorker(threading.Thread):
+    """Background thread that runs queued ingestion jobs one at a time
+
+    Index writes are serialized by the processor's write lock, so workers in
+    several processes can share one queue safely.
+    """
+
+    def __init__(self, queue: IngestQueue, processor, poll_interval: float = 2.0):
+        super().__init__(name="ingest-worker", daemon=True)
+        self.queue = queue
+        self.processor = processor
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.queue.wakeup.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            # Any worker can take over the jobs of one that died
+            self.queue.requeue_orphans()
+            job = self.queue.claim()
+            if job is None:
+                self.queue.wakeup.wait(self.poll_interval)
+                self.queue.wakeup.clear()
+                continue
+            self.run_job(job)
+
+    def run_job(self, job: dict):
+        job_id = job["id"]
+        logger.info(f"Running {job['kind']} job {job_id}")
+        self.processor.progress_callback = lambda name, status, info: self.queue.update_file(
+            job_id, name, status, chunks=info.get("chunks"), error=info.get("error")
+        )
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._renew_lease, args=(job_id, done),
+                                     name=f"ingest-heartbeat-{job_id}", daemon=True)
+        heartbeat.start()
+        try:
+            if job["kind"] == "sync":
+                result = self.processor.sync_documents()
+            else:
+                result = self._ingest_files([self.processor.data_dir / f["name"] for f in job["files"]])
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+            self.queue.fail(job_id, str(e))
+        else:
+            self.queue.finish(job_id, result)
+            logger.info(f"Finished ingestion job {job_id}: {result}")
+        finally:
+            done.set()
+            heartbeat.join()
+            self.processor.progress_callback = None
+
+    def _renew_lease(self, job_id: int, done: threading.Event):
+        while not done.wait(self.queue.lease_seconds / 3):
+            if not self.queue.heartbeat(job_id):
+                logger.warning(f"Lost the lease on ingestion job {job_id}")
+                return
+
+    def _ingest_files(self, file_paths: List[Path]) -> dict:
+        processor = self.processor
+        with processor.write_lock:
+            if processor.vectorstore_exists():
+                chunks_added = processor.add_documents_to_existing_store(file_paths)
+                return {"message": "Documents added to existing vectorstore", "chunks_added": chunks_added,
+                        "timings": processor.last_timings}
+            _, chunk_count = processor.process_documents()
+            return {"message": "New vectorstore created", "chunks_processed": chunk_count,
+                    "timings": processor.last_timings}
+
+
+_queues: Dict[str, IngestQueue] = {}
+_workers: Dict[str, IngestWorker] = {}
+_queues_lock = threading.Lock()
+
+
+def get_ingest_queue(path: Optional[str] = None) -> IngestQueue:
+    """Return the process-wide queue for a path"""
+    path = path or os.getenv("INGEST_QUEUE_PATH", DEFAULT_QUEUE_PATH)
+    key = str(Path(path).resolve())
+    with _queues_lock:
+        if key not in _queues:
+            _queues[key] = IngestQueue.from_env(path)
+        return _queues[key]
+
+
+def start_ingest_worker(processor, queue: Optional[IngestQueue] = None) -> IngestWorker:
+    """Start the process's worker for a queue, or return the one already running"""
+    queue = queue or get_ingest_queue()
+    key = str(queue.path.resolve())
+    with _queues_lock:
+        worker = _workers.get(key)
+        if worker is None or not worker.is_alive():
+            worker = IngestWorker(queue, processor)
+            worker.start()
+            _workers[key] = worker
+        return worker
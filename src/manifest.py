@@ -0,0 +1,128 @@
+# manifest.py
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(file_path: Path, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass
+class FileRecord:
+    path: str
+    size: int
+    mtime: float
+    sha256: str
+    chunk_ids: List[str] = field(default_factory=list)
+    # Page of each chunk, -1 for formats without pages
+    chunk_pages: List[int] = field(default_factory=list)
+    # Chunking settings the chunk ids were made with (see chunking_signature); None before they were recorded
+    chunking: Optional[str] = None
+
+    @classmethod
+    def for_file(cls, file_path: Path, sha256: Optional[str] = None) -> "FileRecord":
+        stat = file_path.stat()
+        return cls(
+            path=str(file_path),
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            sha256=sha256 or file_sha256(file_path),
+        )
+
+    def matches_stat(self, file_path: Path) -> bool:
+        """Cheap change check on size and mtime, before hashing the content"""
+        stat = file_path.stat()
+        return stat.st_size == self.size and stat.st_mtime == self.mtime
+
+
+class EmbeddingModelMismatch(ValueError):
+    """The index was built with a different embedding model than the configured one"""
+
+
+class IndexManifest:
+    """Tracks which files (and which chunk ids) make up a vector store
+
+    Stored as manifest.json next to index.faiss. `version` is bumped on every
+    save so readers can tell when the index has changed. `embedding_model`
+    identifies the model the vectors came from; None for older indexes.
+    """
+
+    FILENAME = "manifest.json"
+
+    def __init__(self, files: Optional[Dict[str, FileRecord]] = None, version: int = 0,
+                 embedding_model: Optional[str] = None):
+        self.files: Dict[str, FileRecord] = files or {}
+        self.version = version
+        self.embedding_model = embedding_model
+
+    @classmethod
+    def path_for(cls, index_dir: Path) -> Path:
+        return Path(index_dir) / cls.FILENAME
+
+    @classmethod
+    def exists(cls, index_dir: Path) -> bool:
+        return cls.path_for(index_dir).exists()
+
+    @classmethod
+    def load(cls, index_dir: Path) -> "IndexManifest":
+        path = cls.path_for(index_dir)
+        if not path.exists():
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        files = {name: FileRecord(**record) for name, record in data.get("files", {}).items()}
+        return cls(files=files, version=data.get("version", 0), embedding_model=data.get("embedding_model"))
+
+    def save(self, index_dir: Path):
+        self.version += 1
+        path = self.path_for(index_dir)
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": self.version, "embedding_model": self.embedding_model,
+                 "files": {n: asdict(r) for n, r in self.files.items()}},
+                f,
+                indent=1,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore) -> "IndexManifest":
+        """Rebuild chunk ownership for an index written before manifests existed
+
+        File size and hash are unknown, so every file is treated as changed on
+        the next sync and re-indexed (cheaply, through the embedding cache).
+        """
+        files: Dict[str, FileRecord] = {}
+        for chunk_id in vectorstore.index_to_docstore_id.values():
+            doc = vectorstore.docstore.search(chunk_id)
+            name = doc.metadata.get("source_file", "Unknown") if hasattr(doc, "metadata") else "Unknown"
+            record = files.setdefault(name, FileRecord(path=name, size=-1, mtime=-1.0, sha256=""))
+            record.chunk_ids.append(chunk_id)
+        logger.info(f"Rebuilt manifest for {len(files)} files from existing vectorstore")
+        return cls(files=files)
+
+    def matches_embedding_model(self, model_id: str) -> bool:
+        return self.embedding_model is None or self.embedding_model == model_id
+
+    def check_embedding_model(self, model_id: str):
+        """Raise EmbeddingModelMismatch if the index was built with another model"""
+        if not self.matches_embedding_model(model_id):
+            raise EmbeddingModelMismatch(
+                f"Index was built with embedding model {self.embedding_model!r} but {model_id!r} is configured; "
+                f"re-index the documents or switch EMBEDDING_BACKEND/EMBEDDING_MODEL back"
+            )
+
+    def all_chunk_ids(self) -> List[str]:
+        return [chunk_id for record in self.files.values() for chunk_id in record.chunk_ids]
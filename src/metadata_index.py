@@ -0,0 +1,159 @@
+# metadata_index.py
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+METADATA_DIR = "metadata"
+
+# Per-file tags, kept in the data directory next to the documents they describe
+TAGS_FILE = ".tags.json"
+
+FILTER_KEYS = ("source_files", "pages", "tags", "uploaded_after", "uploaded_before")
+
+
+def load_file_tags(data_dir: Path) -> Dict[str, List[str]]:
+    path = Path(data_dir) / TAGS_FILE
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_file_tags(data_dir: Path, file_name: str, tags: Iterable[str]):
+    """Set the tags of one file; they are indexed on the next save of the vectorstore"""
+    tags = sorted({tag.strip() for tag in tags if tag.strip()})
+    all_tags = load_file_tags(data_dir)
+    if tags:
+        all_tags[file_name] = tags
+    else:
+        all_tags.pop(file_name, None)
+    path = Path(data_dir) / TAGS_FILE
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(all_tags, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+class MetadataIndex:
+    """Maps source file, page, upload time and tags to FAISS positions
+
+    `positions` holds every chunk's FAISS position grouped by file, and
+    `pages` the page of each (-1 when the format has none). `files` gives
+    each file's slice of those arrays plus its tags and upload time (file
+    mtime), so selecting a subset costs time proportional to the subset.
+    """
+
+    def __init__(self, files: Dict[str, dict], positions: np.ndarray, pages: np.ndarray):
+        self.files = files
+        self.positions = positions
+        self.pages = pages
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @classmethod
+    def build(cls, manifest, vectorstore, tags: Optional[Mapping[str, List[str]]] = None) -> "MetadataIndex":
+        tags = tags or {}
+        position_of = {chunk_id: position for position, chunk_id in vectorstore.index_to_docstore_id.items()}
+        files, positions, pages = {}, [], []
+        start = 0
+        for name in sorted(manifest.files):
+            record = manifest.files[name]
+            chunk_pages = record.chunk_pages
+            if len(chunk_pages) != len(record.chunk_ids):
+                chunk_pages = _lookup_pages(vectorstore.docstore, record.chunk_ids)
+            found = [(position_of[chunk_id], page) for chunk_id, page in zip(record.chunk_ids, chunk_pages)
+                     if chunk_id in position_of]
+            found.sort()
+            positions.extend(position for position, _ in found)
+            pages.extend(page for _, page in found)
+            files[name] = {"start": start, "end": start + len(found), "tags": tags.get(name, []),
+                           "uploaded_at": record.mtime}
+            start += len(found)
+        return cls(files, np.array(positions, dtype=np.int64), np.array(pages, dtype=np.int32))
+
+    @staticmethod
+    def exists(index_dir: Path) -> bool:
+        return (Path(index_dir) / METADATA_DIR / "files.json").exists()
+
+    @classmethod
+    def load(cls, index_dir: Path) -> "MetadataIndex":
+        directory = Path(index_dir) / METADATA_DIR
+        with open(directory / "files.json", "r", encoding="utf-8") as f:
+            files = json.load(f)
+        if not any(info["end"] > info["start"] for info in files.values()):
+            return cls(files, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32))
+        return cls(files, np.load(directory / "positions.npy", mmap_mode="r"),
+                   np.load(directory / "pages.npy", mmap_mode="r"))
+
+    def save(self, index_dir: Path):
+        directory = Path(index_dir) / METADATA_DIR
+        directory.mkdir(parents=True, exist_ok=True)
+        if len(self):
+            # Empty files cannot be memory-mapped
+            np.save(directory / "positions.npy", np.ascontiguousarray(self.positions))
+            np.save(directory / "pages.npy", np.ascontiguousarray(self.pages))
+        with open(directory / "files.json", "w", encoding="utf-8") as f:
+            json.dump(self.files, f, indent=1)
+
+    def _selected_files(self, filters: Mapping) -> List[str]:
+        unknown = set(filters) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"Unsupported filter keys: {', '.join(sorted(unknown))} "
+                             f"(expected {', '.join(FILTER_KEYS)})")
+        names = filters.get("source_files")
+        names = [name for name in names if name in self.files] if names else list(self.files)
+        wanted_tags = set(filters.get("tags") or ())
+        after, before = filters.get("uploaded_after"), filters.get("uploaded_before")
+        return [
+            name for name in names
+            if (not wanted_tags or wanted_tags & set(self.files[name]["tags"]))
+            and (after is None or self.files[name]["uploaded_at"] >= after)
+            and (before is None or self.files[name]["uploaded_at"] < before)
+        ]
+
+    def select(self, filters: Mapping) -> np.ndarray:
+        """Sorted FAISS positions of the chunks matching every filter"""
+        pages = filters.get("pages")
+        selected = []
+        for name in self._selected_files(filters):
+            info = self.files[name]
+            positions = np.asarray(self.positions[info["start"]:info["end"]])
+            if pages:
+                positions = positions[np.isin(self.pages[info["start"]:info["end"]], pages)]
+            selected.append(positions)
+        if not selected:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(selected))
+
+    def matches(self, metadata: Mapping, filters: Mapping) -> bool:
+        """Whether one chunk's metadata passes the filters"""
+        if metadata.get("source_file") not in self._selected_files(filters):
+            return False
+        pages = filters.get("pages")
+        return not pages or metadata.get("page", -1) in pages
+
+    def describe(self) -> List[dict]:
+        """One entry per file, for document pickers"""
+        return [
+            {"source_file": name, "chunks": info["end"] - info["start"], "tags": info["tags"],
+             "uploaded_at": info["uploaded_at"]}
+            for name, info in self.files.items()
+        ]
+
+
+def _lookup_pages(docstore, chunk_ids: List[str]) -> List[int]:
+    """Pages of chunks indexed before FileRecord kept them"""
+    if hasattr(docstore, "get_documents"):
+        pages = {doc.id: doc.metadata.get("page", -1) for doc in docstore.get_documents(chunk_ids)}
+    else:
+        pages = {}
+        for chunk_id in chunk_ids:
+            doc = docstore.search(chunk_id)
+            pages[chunk_id] = doc.metadata.get("page", -1) if hasattr(doc, "metadata") else -1
+    return [pages.get(chunk_id, -1) for chunk_id in chunk_ids]
@@ -0,0 +1,200 @@
+# metrics.py
+import cProfile
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers a cached lookup (sub-millisecond) up to a slow completion
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label set"""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label key -> (bucket counts, sum, count)
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, ('le', repr(float(bound))))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Counter:
+    """Prometheus-style monotonic counter, one series per label set"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    """All metrics of the process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        with self._lock:
+            return self._metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        with self._lock:
+            return self._metrics.setdefault(name, Counter(name, help_text))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    return _registry
+
+
+class Timings:
+    """Durations of the stages of one request or ingestion run
+
+    Each stage is also observed in `histogram` under a `stage` label, so the
+    same spans feed both the per-request `timings` field and the exported
+    latency distributions.
+    """
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.stages: Dict[str, float] = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.histogram.observe(seconds, stage=name)
+
+    def finish(self) -> Dict[str, float]:
+        """Record the total and return every stage in seconds"""
+        self.add("total", time.perf_counter() - self.started)
+        return {name: round(seconds, 6) for name, seconds in self.stages.items()}
+
+
+# One profiler at a time: cProfile cannot nest, and concurrent async requests share a thread
+_profiling = threading.Lock()
+
+
+@contextmanager
+def profiled(name: str) -> Iterator[None]:
+    """Profile a sampled fraction of calls (PROFILE_SAMPLE_RATE) into PROFILE_DIR
+
+    Uses pyinstrument when PROFILER=pyinstrument and it is installed, writing
+    an HTML report; otherwise cProfile, writing a .prof file for pstats or
+    snakeviz. Only the calling thread is profiled.
+    """
+    rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    if rate <= 0 or random.random() >= rate or not _profiling.acquire(blocking=False):
+        yield
+        return
+    try:
+        with _profile(name):
+            yield
+    finally:
+        _profiling.release()
+
+
+@contextmanager
+def _profile(name: str) -> Iterator[None]:
+    directory = Path(os.getenv("PROFILE_DIR", "./profiles"))
+    directory.mkdir(parents=True, exist_ok=True)
+    stem = directory / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{random.randrange(1 << 16):04x}"
+    if os.getenv("PROFILER", "cprofile") == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed, falling back to cProfile")
+        else:
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                stem.with_suffix(".html").write_text(profiler.output_html())
+                logger.info(f"Wrote profile {stem.with_suffix('.html')}")
+            return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(str(stem.with_suffix(".prof")))
+        logger.info(f"Wrote profile {stem.with_suffix('.prof')}")
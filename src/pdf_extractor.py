@@ -0,0 +1,245 @@
+# pdf_extractor.py
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+from .manifest import file_sha256
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fastest first; "auto" picks the first one installed
+PDF_BACKENDS = ("pymupdf", "pypdfium2", "pypdf")
+
+DEFAULT_PAGE_CACHE_PATH = "./vectorstore/page_text_cache.sqlite"
+
+# Pages written to the cache per transaction while a file is extracted
+_WRITE_BATCH = 32
+
+
+# Backends yield (document info, page count, page text, page label) per page
+_Page = Tuple[Dict[str, Any], int, str, str]
+
+_INFO_KEYS = {"page_count": "total_pages", "file_path": "source"}
+
+
+def _info_metadata(info: Dict[str, Any]) -> Dict[str, Any]:
+    """PDF document info as PyPDFLoader puts it on every page
+
+    Keys lose their leading slash and are lower-cased, other values become
+    strings, and creation and modification dates become ISO timestamps.
+    """
+    metadata: Dict[str, Any] = {}
+    for key, value in info.items():
+        if type(value) not in (str, int):
+            value = str(value)
+        key = key[1:] if key.startswith("/") else key
+        key = key.lower()
+        if key in ("creationdate", "moddate"):
+            try:
+                metadata[key] = datetime.strptime(value.replace("'", ""), "D:%Y%m%d%H%M%S%z").isoformat("T")
+            except ValueError:
+                metadata[key] = value
+        elif key in _INFO_KEYS:
+            metadata[_INFO_KEYS[key]] = value
+            metadata[key] = value
+        else:
+            metadata[key] = value.strip() if isinstance(value, str) else value
+    return metadata
+
+
+def _pymupdf_pages(path: Path) -> Iterator[_Page]:
+    import fitz
+    with fitz.open(str(path)) as pdf:
+        info = _info_metadata({key: value for key, value in (pdf.metadata or {}).items() if value})
+        for page in pdf:
+            yield info, pdf.page_count, page.get_text("text"), page.get_label() or str(page.number + 1)
+
+
+def _pypdfium2_pages(path: Path) -> Iterator[_Page]:
+    import pypdfium2
+    pdf = pypdfium2.PdfDocument(str(path))
+    try:
+        info = _info_metadata(pdf.get_metadata_dict(skip_empty=True))
+        total = len(pdf)
+        for i in range(total):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+            yield info, total, text.replace("\r\n", "\n"), str(i + 1)
+    finally:
+        pdf.close()
+
+
+def _pypdf_pages(path: Path) -> Iterator[_Page]:
+    import pypdf
+    reader = pypdf.PdfReader(str(path))
+    # The defaults and info PyPDFLoader puts on each page
+    info = _info_metadata({"producer": "PyPDF", "creator": "PyPDF", "creationdate": "", **(reader.metadata or {})})
+    total = len(reader.pages)
+    for i, page in enumerate(reader.pages):
+        # The extraction PyPDFLoader uses
+        yield info, total, page.extract_text(extraction_mode="plain"), reader.page_labels[i]
+
+
+_BACKENDS: Dict[str, Tuple[str, Callable[[Path], Iterator[_Page]]]] = {
+    "pymupdf": ("fitz", _pymupdf_pages),
+    "pypdfium2": ("pypdfium2", _pypdfium2_pages),
+    "pypdf": ("pypdf", _pypdf_pages),
+}
+
+
+@lru_cache(maxsize=None)
+def resolve_backend(backend: Optional[str] = None) -> str:
+    """The PDF_BACKEND to use, resolving `auto` to the fastest installed one"""
+    backend = backend or os.getenv("PDF_BACKEND", "auto")
+    if backend != "auto" and backend not in _BACKENDS:
+        raise ValueError(f"Unsupported PDF_BACKEND: {backend} (expected auto or one of {', '.join(PDF_BACKENDS)})")
+    for name in PDF_BACKENDS if backend == "auto" else (backend,):
+        try:
+            __import__(_BACKENDS[name][0])
+        except ImportError:
+            continue
+        return name
+    raise ImportError(f"PDF_BACKEND={backend} needs one of `pip install {' / '.join(PDF_BACKENDS)}`")
+
+
+class PageTextCache:
+    """Extracted PDF page text keyed by (file sha256, backend, page number)
+
+    A file counts as cached only once all its pages and its document info
+    are stored, so an interrupted extraction is redone. Different backends
+    extract slightly different text, so each keeps its own entries.
+    """
+
+    def __init__(self, path: str = DEFAULT_PAGE_CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "file_hash TEXT NOT NULL, backend TEXT NOT NULL, page INTEGER NOT NULL, text TEXT NOT NULL, "
+            "label TEXT, PRIMARY KEY (file_hash, backend, page)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "file_hash TEXT NOT NULL, backend TEXT NOT NULL, pages INTEGER NOT NULL, info TEXT, "
+            "PRIMARY KEY (file_hash, backend)) WITHOUT ROWID"
+        )
+        # Caches written before page labels and document info were kept; their files are extracted again
+        for table, column in (("pages", "label"), ("files", "info")):
+            if column not in {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+        self._conn.commit()
+
+    def file_info(self, file_hash: str, backend: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """(page count, document info) of a completely cached file, None if it is not cached"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT pages, info FROM files WHERE file_hash = ? AND backend = ? AND info IS NOT NULL",
+                (file_hash, backend),
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row is not None else None
+
+    def page_count(self, file_hash: str, backend: str) -> Optional[int]:
+        """Number of pages of a completely cached file, None if it is not cached"""
+        cached = self.file_info(file_hash, backend)
+        return cached[0] if cached is not None else None
+
+    def iter_pages(self, file_hash: str, backend: str, batch: int = 64) -> Iterator[Tuple[int, str, str]]:
+        """(page, text, label) of a cached file in page order, read a batch at a time"""
+        start = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT page, text, label FROM pages WHERE file_hash = ? AND backend = ? AND page >= ? "
+                    "ORDER BY page LIMIT ?",
+                    (file_hash, backend, start, batch),
+                ).fetchall()
+            yield from rows
+            if len(rows) < batch:
+                return
+            start = rows[-1][0] + 1
+
+    def put_pages(self, file_hash: str, backend: str, pages: List[Tuple[int, str, str]]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages (file_hash, backend, page, text, label) VALUES (?, ?, ?, ?, ?)",
+                [(file_hash, backend, page, text, label) for page, text, label in pages],
+            )
+            self._conn.commit()
+
+    def mark_complete(self, file_hash: str, backend: str, pages: int, info: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (file_hash, backend, pages, info) VALUES (?, ?, ?, ?)",
+                (file_hash, backend, pages, json.dumps(info)),
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+
+_caches: Dict[Tuple[int, str], PageTextCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_page_text_cache(path: Optional[str] = None) -> PageTextCache:
+    """Return this process's cache for a path; ingestion workers each open their own connection"""
+    path = path or os.getenv("PAGE_TEXT_CACHE_PATH", DEFAULT_PAGE_CACHE_PATH)
+    key = (os.getpid(), str(Path(path).resolve()))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = PageTextCache(path)
+        return _caches[key]
+
+
+def iter_pdf_pages(file_path: Path, file_hash: Optional[str] = None, backend: Optional[str] = None,
+                   cache: Optional[PageTextCache] = None) -> Iterator[Document]:
+    """Yield one Document per page, extracting only when the file is not cached
+
+    Page metadata is the PDF's document info plus source, total_pages, page
+    and page_label, as PyPDFLoader sets it. Pages are produced lazily, so a
+    caller that processes each page as it arrives never holds the whole
+    document's text.
+    """
+    backend = resolve_backend(backend)
+    cache = cache or get_page_text_cache()
+    file_hash = file_hash or file_sha256(file_path)
+
+    cached = cache.file_info(file_hash, backend)
+    if cached is not None:
+        total, info = cached
+        metadata = {**info, "source": str(file_path), "total_pages": total}
+        for page, text, label in cache.iter_pages(file_hash, backend):
+            yield Document(page_content=text, metadata={**metadata, "page": page, "page_label": label})
+        return
+
+    pending: List[Tuple[int, str, str]] = []
+    info: Dict[str, Any] = {}
+    page = -1
+    for page, (info, total, text, label) in enumerate(_BACKENDS[backend][1](file_path)):
+        text = text.strip()
+        pending.append((page, text, label))
+        if len(pending) >= _WRITE_BATCH:
+            cache.put_pages(file_hash, backend, pending)
+            pending = []
+        yield Document(page_content=text, metadata={**info, "source": str(file_path), "total_pages": total,
+                                                    "page": page, "page_label": label})
+    cache.put_pages(file_hash, backend, pending)
+    cache.mark_complete(file_hash, backend, page + 1, info)
+    logger.debug(f"Extracted {page + 1} pages of {file_path.name} with {backend}")
@@ -0,0 +1,120 @@
+# query_batcher.py
+import asyncio
+import os
+from typing import Awaitable, Callable, Generic, List, Set, Tuple, TypeVar
+from langchain_core.documents import Document
+import logging
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """Collect items submitted within `max_wait_ms` of each other and process them in one call
+
+    `process` receives the items in submission order and must return one
+    result per item. A batch is flushed early once it reaches `max_batch_size`.
+    """
+
+    def __init__(self, process: Callable[[List[T]], Awaitable[List[R]]],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.process = process
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[T, asyncio.Future]] = []
+        self._timer = None
+        # Running batches; the event loop only keeps weak references to tasks
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item: T) -> R:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Query batch failed: {task.exception()!r}")
+
+    async def _run(self, batch: List[Tuple[T, asyncio.Future]]):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.process([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if len(results) != len(batch):
+            error = RuntimeError(f"Batch of {len(batch)} items produced {len(results)} results")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            raise error
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
+
+
+class QueryBatcher:
+    """Micro-batches query embedding and FAISS search across concurrent requests
+
+    Queries arriving within a few milliseconds share one embedding request
+    and one `index.search` over a matrix of query vectors.
+    """
+
+    def __init__(self, pipeline, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.pipeline = pipeline
+        self._embed = MicroBatcher(self._embed_batch, max_batch_size, max_wait_ms)
+        self._search = MicroBatcher(self._search_batch, max_batch_size, max_wait_ms)
+
+    @classmethod
+    def from_env(cls, pipeline) -> "QueryBatcher":
+        return cls(
+            pipeline,
+            max_batch_size=int(os.getenv("QUERY_BATCH_SIZE", "32")),
+            max_wait_ms=float(os.getenv("QUERY_BATCH_WAIT_MS", "5")),
+        )
+
+    async def embed(self, question: str) -> List[float]:
+        return await self._embed.submit(question)
+
+    async def search(self, query: str, embedding: List[float], k: int) -> List[Document]:
+        return await self._search.submit((query, embedding, k))
+
+    async def _embed_batch(self, questions: List[str]) -> List[List[float]]:
+        return await self.pipeline.embeddings.aembed_queries(questions)
+
+    async def _search_batch(self, requests: List[Tuple[str, List[float], int]]) -> List[List[Document]]:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.pipeline._search_executor, self.pipeline._search_many, requests
+        )
+
+    def stats(self) -> dict:
+        return {"embed": self._embed.stats(), "search": self._search.stats()}
@@ -1,13 +1,27 @@
+import asyncio
 import os
-from pathlib import Path
-from typing import List, Optional
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List, Optional, Sequence, Tuple
+from langchain_openai import ChatOpenAI
 from langchain_community.vectorstores import FAISS
 from langchain.schema import Document
 from langchain.prompts import ChatPromptTemplate
-from langchain.schema.runnable import RunnablePassthrough
 from langchain.schema.output_parser import StrOutputParser
 from dotenv import load_dotenv
+import numpy as np
+from .answer_cache import AnswerCache
+from .bm25_index import reciprocal_rank_fusion
+from .context_builder import ContextBuilder
+from .conversation import CONDENSE_PROMPT, ConversationMemory, format_history
+from .embedding_backends import get_embeddings
+from .embedding_cache import CachedEmbeddings, get_embedding_cache
+from .index_registry import get_index_registry
+from .metrics import TOKEN_BUCKETS, Timings, get_metrics, profiled
+from .reranker import CrossEncoderReranker
+from .shards import is_sharded
+from .vectorstore_io import has_vectorstore
 import logging
 
 
@@ -17,60 +31,338 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Filtered hybrid queries fetch this many times more BM25 hits before filtering
+_FILTERED_BM25_DEPTH = 5
+
+_search_executor: Optional[ThreadPoolExecutor] = None
+_search_executor_lock = threading.Lock()
+
+
+def _get_search_executor() -> ThreadPoolExecutor:
+    global _search_executor
+    with _search_executor_lock:
+        if _search_executor is None:
+            _search_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("SEARCH_THREADS", str(os.cpu_count() or 4))),
+                thread_name_prefix="faiss-search",
+            )
+        return _search_executor
+
+
 class RAGPipeline:
     def __init__(self, vectorstore_path: str = "./vectorstore/faiss_index/"):
         self.vectorstore_path = vectorstore_path
-        self.embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+        # Local backends embed a query in milliseconds instead of a network round trip
+        self.embeddings = CachedEmbeddings(get_embeddings(), get_embedding_cache())
         self.llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-        self.vectorstore = None
+        # ANN search knobs; ignored by index types they do not apply to
+        self.nprobe = int(os.getenv("FAISS_NPROBE", "0")) or None
+        self.ef_search = int(os.getenv("FAISS_EF_SEARCH", "0")) or None
+        # "dense" searches FAISS only; "hybrid" fuses it with BM25 keyword hits
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "dense")
+        if self.retrieval_mode not in ("dense", "hybrid"):
+            raise ValueError(f"Unsupported RETRIEVAL_MODE: {self.retrieval_mode} (expected dense or hybrid)")
+        self.hybrid_candidates = int(os.getenv("HYBRID_CANDIDATES", "20"))
+        self.rrf_k = int(os.getenv("RRF_K", "60"))
+        # Over-fetch this many candidates for cross-encoder reranking; 0 disables it
+        self.rerank_candidates = int(os.getenv("RERANK_CANDIDATES", "0"))
+        # Filtered searches over at most this many chunks are scored exactly, in time proportional to them
+        self.filter_exact_max = int(os.getenv("FILTER_EXACT_MAX", "50000"))
+        # With a compressed index (INDEX_ENCODING, ivf_pq), re-sort this many hits by exact
+        # float32 distance using the embedding cache; 0 disables it
+        self.rescore_candidates = int(os.getenv("RESCORE_CANDIDATES", "0"))
+        self.reranker = CrossEncoderReranker.from_env() if self.rerank_candidates > 0 else None
+        self.registry = get_index_registry()
+        self._index = None
+        self._rag_chain = None
+        # Runs CPU-bound FAISS searches for the async API; one pool for every pipeline in the process
+        self._search_executor = _get_search_executor()
+        # Set by the API server to coalesce concurrent async queries (see query_batcher.py)
+        self.query_batcher = None
+        metrics = get_metrics()
+        self._stage_seconds = metrics.histogram("rag_query_stage_seconds", "Duration of each RAG query stage")
+        self._query_tokens = metrics.histogram("rag_query_tokens", "Context, saved and answer tokens per query",
+                                               TOKEN_BUCKETS)
+        self._queries = metrics.counter("rag_queries_total", "Queries by outcome")
+        # Merges, deduplicates and packs retrieved chunks into CONTEXT_TOKEN_BUDGET tokens
+        self.context_builder = ContextBuilder.from_env()
+        self.answer_cache = AnswerCache(
+            max_size=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+            similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+        )
+        # Follow-up questions are rewritten with this many earlier messages; 0 disables it
+        self.condense_history_messages = int(os.getenv("CONDENSE_HISTORY_MESSAGES", "6"))
+        self.conversation = ConversationMemory.from_env()
+        self._condense_chain = None
+    
+    @property
+    def vectorstore(self) -> Optional[FAISS]:
+        """The loaded FAISS store; None when nothing is loaded or the index is sharded"""
+        return self._index.vectorstore if self._index else None
+    
+    @property
+    def index_version(self) -> Optional[int]:
+        return self._index.version if self._index else None
+    
+    def _reload_if_changed(self):
+        """Switch to the registry's current index if ingestion published a new one"""
+        self._set_index(self.registry.get(self.vectorstore_path, self.embeddings))
+    
+    def _set_index(self, loaded):
+        if loaded is not None and loaded is not self._index:
+            self._index = loaded
+            # Cached answers are only valid for the index they were computed against
+            self.answer_cache.set_version(loaded.version)
         
     def load_vectorstore(self) -> bool:
-        """Load the existing vectorstore"""
+        """Load the existing vectorstore (shared with every other pipeline in the process)"""
         try:
-            index_file = Path(self.vectorstore_path) / "index.faiss"
-            if not index_file.exists():
+            if not has_vectorstore(self.vectorstore_path) and not is_sharded(self.vectorstore_path):
                 logger.warning("Vectorstore index file not found")
                 return False
             
-            self.vectorstore = FAISS.load_local(
-                str(self.vectorstore_path), 
-                self.embeddings,
-                allow_dangerous_deserialization=True
-            )
+            self._set_index(self.registry.get(self.vectorstore_path, self.embeddings))
             logger.info("Vectorstore loaded successfully")
-            return True
+            return self._index is not None
             
         except Exception as e:
             logger.error(f"Error loading vectorstore: {str(e)}")
             return False
     
-    def retrieve_context(self, query: str, k: int = 4) -> List[Document]:
-        """Retrieve relevant context from vectorstore"""
-        if not self.vectorstore:
+    def list_documents(self) -> List[dict]:
+        """Indexed documents that queries can be filtered to"""
+        if self._index is None and not self.load_vectorstore():
+            return []
+        self._reload_if_changed()
+        return self._index.describe_documents()
+    
+    def retrieve_context(self, query: str, k: int = 4, embedding: Optional[List[float]] = None,
+                         filters: Optional[dict] = None) -> List[Document]:
+        """Retrieve relevant context from vectorstore
+
+        `filters` restricts the search to some documents: any of
+        source_files, pages, tags, uploaded_after and uploaded_before
+        (see MetadataIndex).
+        """
+        return self.rerank(query, self.retrieve_candidates(query, k, embedding, filters), k)[0]
+    
+    async def aretrieve_context(self, query: str, k: int = 4, embedding: Optional[List[float]] = None,
+                                filters: Optional[dict] = None) -> List[Document]:
+        """Retrieve relevant context without blocking the event loop"""
+        candidates = await self.aretrieve_candidates(query, k, embedding, filters)
+        return (await self.arerank(query, candidates, k))[0]
+    
+    def _retrieval_k(self, k: int) -> int:
+        return max(k, self.rerank_candidates) if self.reranker is not None else k
+    
+    def retrieve_candidates(self, query: str, k: int = 4, embedding: Optional[List[float]] = None,
+                            filters: Optional[dict] = None) -> List[Document]:
+        """Search hits for a top-k query: k of them, or more when they will be reranked"""
+        if self._index is None:
             if not self.load_vectorstore():
                 raise ValueError("Vectorstore not available")
         
         try:
-            # Perform similarity search
-            results = self.vectorstore.similarity_search(query, k=k)
-            return results
+            # Perform similarity search, reusing the query embedding when the caller has it
+            if embedding is None:
+                embedding = self.embeddings.embed_query(query)
+            if filters:
+                return self._search_filtered(query, embedding, self._retrieval_k(k), filters)
+            return self._search(query, embedding, self._retrieval_k(k))
         except Exception as e:
             logger.error(f"Error during retrieval: {str(e)}")
             raise
     
-    def format_context(self, documents: List[Document]) -> str:
-        """Format retrieved documents into context string"""
-        context_parts = []
-        for i, doc in enumerate(documents):
-            source = doc.metadata.get('source_file', 'Unknown')
-            page = doc.metadata.get('page', 'N/A')
-            context_parts.append(f"[Document {i+1} - {source} (Page {page})]:\n{doc.page_content}")
-        
-        return "\n\n".join(context_parts)
+    def rerank(self, query: str, candidates: List[Document], k: int) -> Tuple[List[Document], dict]:
+        """Top-k candidates and reranking stats (empty when reranking is off)
+
+        `rerank_tokens_saved` counts the prompt tokens of the candidates the
+        reranker kept out of the context, to weigh against `rerank_ms`.
+        """
+        if self.reranker is None or len(candidates) <= 1:
+            return candidates[:k], {}
+        documents, stats = self.reranker.rerank(query, candidates, k)
+        kept = {id(doc) for doc in documents}
+        stats["rerank_tokens_saved"] = sum(self.context_builder.count_tokens(doc.page_content)
+                                           for doc in candidates if id(doc) not in kept)
+        self._query_tokens.observe(stats["rerank_tokens_saved"], kind="rerank_saved")
+        return documents, stats
     
-    def generate_answer(self, query: str, context: str) -> str:
-        """Generate answer using LLM with retrieved context"""
+    async def arerank(self, query: str, candidates: List[Document], k: int) -> Tuple[List[Document], dict]:
+        if self.reranker is None:
+            return candidates[:k], {}
+        # The cross-encoder is CPU-bound; keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(
+            self._search_executor, self.rerank, query, candidates, k
+        )
+    
+    async def aretrieve_candidates(self, query: str, k: int = 4, embedding: Optional[List[float]] = None,
+                                   filters: Optional[dict] = None) -> List[Document]:
+        """Async counterpart of retrieve_candidates"""
+        loop = asyncio.get_running_loop()
+        if self._index is None:
+            if not await loop.run_in_executor(self._search_executor, self.load_vectorstore):
+                raise ValueError("Vectorstore not available")
+        
         try:
+            if embedding is None:
+                embedding = await self._aembed_query(query)
+            k = self._retrieval_k(k)
+            if filters:
+                # Each filter selects its own subset, so these are not batched
+                return await loop.run_in_executor(self._search_executor, self._search_filtered,
+                                                  query, embedding, k, filters)
+            if self.query_batcher is not None:
+                return await self.query_batcher.search(query, embedding, k)
+            # FAISS releases the GIL, so searches from many queries run in parallel threads
+            return await loop.run_in_executor(self._search_executor, self._search, query, embedding, k)
+        except Exception as e:
+            logger.error(f"Error during retrieval: {str(e)}")
+            raise
+    
+    async def _aembed_query(self, query: str) -> List[float]:
+        if self.query_batcher is not None:
+            return await self.query_batcher.embed(query)
+        return await self.embeddings.aembed_query(query)
+    
+    def _search(self, query: str, embedding: List[float], k: int) -> List[Document]:
+        return self._search_many([(query, embedding, k)])[0]
+    
+    def _candidate_k(self, k: int) -> int:
+        """How many hits each retriever contributes before fusion"""
+        return max(k, self.hybrid_candidates) if self.retrieval_mode == "hybrid" else k
+    
+    def _search_many(self, requests: Sequence[Tuple[str, List[float], int]]) -> List[List[Document]]:
+        """Search several (query, embedding, k) requests with one FAISS call"""
+        loaded = self._index
+        # One search at the largest k; each query keeps its own top hits
+        fetch_k = max(max(self._candidate_k(k) for _, _, k in requests), self.rescore_candidates)
+        results = loaded.search([embedding for _, embedding, _ in requests], fetch_k,
+                                nprobe=self.nprobe, ef_search=self.ef_search)
+        return [
+            self._fuse(query, self._rescore(embedding, hits, self._candidate_k(k), loaded), k, loaded)
+            for (query, embedding, k), hits in zip(requests, results)
+        ]
+    
+    def _search_filtered(self, query: str, embedding: List[float], k: int, filters: dict) -> List[Document]:
+        """Search only the chunks the metadata filters select"""
+        loaded = self._index
+        hits = loaded.search_filtered(embedding, max(self._candidate_k(k), self.rescore_candidates), filters,
+                                      nprobe=self.nprobe, ef_search=self.ef_search,
+                                      exact_max=self.filter_exact_max)
+        return self._fuse(query, self._rescore(embedding, hits, self._candidate_k(k), loaded), k, loaded, filters)
+
+    def _rescore(self, embedding: List[float], hits: List[Tuple[Document, float]], k: int,
+                 loaded) -> List[Document]:
+        """The top k hits after re-sorting by exact distance to the full-precision vectors
+
+        Vectors come from the embedding cache written during ingestion; a hit
+        whose vector is not cached keeps the distance the index returned.
+        """
+        if self.rescore_candidates <= 0 or len(hits) <= 1:
+            return [doc for doc, _ in hits[:k]]
+        exact = self._exact_distances(embedding, [doc for doc, _ in hits], loaded)
+        rescored = [(doc, distance if exact_distance is None else exact_distance)
+                    for (doc, distance), exact_distance in zip(hits, exact)]
+        rescored.sort(key=lambda hit: hit[1], reverse=loaded.higher_is_better)
+        return [doc for doc, _ in rescored[:k]]
+
+    def _exact_distances(self, embedding: List[float], documents: List[Document],
+                         loaded) -> List[Optional[float]]:
+        """Exact query distances of documents whose vectors are in the embedding cache, else None"""
+        query = np.asarray(embedding, dtype=np.float32)
+        higher_is_better = loaded.higher_is_better
+        distances = []
+        for vector in self.embeddings.document_vectors([doc.page_content for doc in documents]):
+            if vector is None or len(vector) != len(query):
+                distances.append(None)
+            else:
+                distances.append(float(vector @ query) if higher_is_better else float(np.sum((vector - query) ** 2)))
+        return distances
+
+    def _from_pool(self, embedding: List[float], pool: List[Document], k: int) -> List[Document]:
+        """The k chunks of an earlier turn's candidates closest to this query
+
+        Chunks without a cached vector keep their order, after the others.
+        """
+        loaded = self._index
+        sign = -1.0 if loaded.higher_is_better else 1.0
+        distances = self._exact_distances(embedding, pool, loaded)
+        order = sorted(range(len(pool)), key=lambda i: (distances[i] is None,
+                                                        sign * distances[i] if distances[i] is not None else i))
+        return [pool[i] for i in order[:k]]
+
+    def _reuses_retrieval(self, session_id: Optional[str]) -> bool:
+        """Whether this query may take its candidates from the session's previous search
+
+        Only dense pools qualify: re-sorting one by exact distance is the same
+        search, but a hybrid pool cannot reproduce BM25 ranks and RRF fusion.
+        """
+        return session_id is not None and self.retrieval_mode == "dense" and self.conversation.reuse_enabled
+
+    def _session_candidates(self, session_id: Optional[str], question: str, k: int, embedding: List[float],
+                            filters: Optional[dict], version) -> Tuple[List[Document], bool]:
+        """retrieve_candidates, served from the session's previous search when the query is close to it
+
+        Returns the candidates and whether the search was skipped.
+        """
+        if not self._reuses_retrieval(session_id):
+            return self.retrieve_candidates(question, k, embedding, filters), False
+        needed = self._retrieval_k(k)
+        pool = self.conversation.reusable_pool(session_id, embedding, needed, filters, version)
+        if pool is not None:
+            return self._from_pool(embedding, pool, needed), True
+        pool_k = self.conversation.pool_size(needed)
+        pool = self.retrieve_candidates(question, pool_k, embedding, filters)
+        self.conversation.put_pool(session_id, embedding, pool_k, filters, version, pool)
+        return pool[:needed], False
+
+    async def _asession_candidates(self, session_id: Optional[str], question: str, k: int,
+                                   embedding: List[float], filters: Optional[dict],
+                                   version) -> Tuple[List[Document], bool]:
+        """Async counterpart of _session_candidates"""
+        if not self._reuses_retrieval(session_id):
+            return await self.aretrieve_candidates(question, k, embedding, filters), False
+        needed = self._retrieval_k(k)
+        pool = self.conversation.reusable_pool(session_id, embedding, needed, filters, version)
+        if pool is not None:
+            return self._from_pool(embedding, pool, needed), True
+        pool_k = self.conversation.pool_size(needed)
+        pool = await self.aretrieve_candidates(question, pool_k, embedding, filters)
+        self.conversation.put_pool(session_id, embedding, pool_k, filters, version, pool)
+        return pool[:needed], False
+    
+    def _fuse(self, query: str, dense_docs: List[Document], k: int, loaded,
+              filters: Optional[dict] = None) -> List[Document]:
+        """Reciprocal rank fusion of dense hits with BM25 keyword hits"""
+        if self.retrieval_mode != "hybrid" or not loaded.has_keyword_index:
+            return dense_docs[:k]
+        by_id = {doc.id or doc.metadata.get("chunk_id"): doc for doc in dense_docs}
+        depth = self._candidate_k(k)
+        if filters:
+            # BM25 cannot restrict its search, so dig deeper and drop non-matching hits
+            sparse_ids = []
+            for chunk_id, _ in loaded.keyword_search(query, depth * _FILTERED_BM25_DEPTH):
+                doc = by_id.get(chunk_id) or loaded.document(chunk_id)
+                if doc is not None and loaded.matches(doc.metadata, filters):
+                    by_id.setdefault(chunk_id, doc)
+                    sparse_ids.append(chunk_id)
+                    if len(sparse_ids) == depth:
+                        break
+        else:
+            sparse_ids = [chunk_id for chunk_id, _ in loaded.keyword_search(query, depth)]
+        documents = []
+        dense_ids = [doc.id or doc.metadata.get("chunk_id") for doc in dense_docs]
+        for chunk_id, _ in reciprocal_rank_fusion([dense_ids, sparse_ids], k=self.rrf_k)[:k]:
+            doc = by_id.get(chunk_id) or loaded.document(chunk_id)
+            if doc is not None:
+                documents.append(doc)
+        return documents
+    
+    def _get_rag_chain(self):
+        """Build the prompt | llm | parser chain once and reuse it for every query"""
+        if self._rag_chain is None:
             # Define the prompt template
             prompt_template = ChatPromptTemplate.from_template(
                 """You are a helpful assistant that answers questions based on the provided context.
@@ -89,70 +381,361 @@ class RAGPipeline:
                 Answer:"""
             )
             
-            # Create the RAG chain
-            rag_chain = (
-                {"context": RunnablePassthrough(), "question": RunnablePassthrough()}
-                | prompt_template
-                | self.llm
-                | StrOutputParser()
-            )
-            
+            # Create the RAG chain; the input is already {"context", "question"}
+            self._rag_chain = prompt_template | self.llm | StrOutputParser()
+        return self._rag_chain
+    
+    def _get_condense_chain(self):
+        if self._condense_chain is None:
+            prompt = ChatPromptTemplate.from_template(CONDENSE_PROMPT)
+            self._condense_chain = prompt | self.llm | StrOutputParser()
+        return self._condense_chain
+
+    def _condense_input(self, question: str, history: Optional[List[dict]]) -> Optional[dict]:
+        if not history or self.condense_history_messages <= 0:
+            return None
+        return {"history": format_history(history[-self.condense_history_messages:]), "question": question}
+
+    def condense_question(self, question: str, history: Optional[List[dict]],
+                          session_id: Optional[str] = None) -> str:
+        """Rewrite a follow-up as a standalone question, using earlier messages (oldest first)
+
+        Rewrites are cached per session and conversation state.
+        """
+        inputs = self._condense_input(question, history)
+        if inputs is None:
+            return question
+        history_key = self.conversation.history_key(inputs["history"])
+        if session_id is not None:
+            cached = self.conversation.get_condensed(session_id, history_key, question)
+            if cached is not None:
+                return cached
+        standalone = self._get_condense_chain().invoke(inputs).strip() or question
+        if session_id is not None:
+            self.conversation.put_condensed(session_id, history_key, question, standalone)
+        return standalone
+
+    async def acondense_question(self, question: str, history: Optional[List[dict]],
+                                 session_id: Optional[str] = None) -> str:
+        """Async counterpart of condense_question"""
+        inputs = self._condense_input(question, history)
+        if inputs is None:
+            return question
+        history_key = self.conversation.history_key(inputs["history"])
+        if session_id is not None:
+            cached = self.conversation.get_condensed(session_id, history_key, question)
+            if cached is not None:
+                return cached
+        standalone = (await self._get_condense_chain().ainvoke(inputs)).strip() or question
+        if session_id is not None:
+            self.conversation.put_condensed(session_id, history_key, question, standalone)
+        return standalone
+
+    def generate_answer(self, query: str, context: str) -> str:
+        """Generate answer using LLM with retrieved context"""
+        try:
             # Generate answer
-            answer = rag_chain.invoke({"context": context, "question": query})
+            answer = self._get_rag_chain().invoke({"context": context, "question": query})
             return answer
             
         except Exception as e:
             logger.error(f"Error generating answer: {str(e)}")
             raise
     
-    def query(self, question: str, k: int = 4) -> dict:
-        """Complete RAG pipeline: retrieve context and generate answer"""
+    def generate_answer_stream(self, query: str, context: str) -> Iterator[str]:
+        """Yield answer tokens from the LLM as they arrive"""
         try:
-            # Check if vectorstore is available
-            if not self.vectorstore and not self.load_vectorstore():
-                return {
-                    "answer": "No vectorstore available. Please add documents first.",
-                    "sources": [],
-                    "error": "Vectorstore not found"
-                }
-            
-            # Retrieve relevant context
-            retrieved_docs = self.retrieve_context(question, k=k)
+            for token in self._get_rag_chain().stream({"context": context, "question": query}):
+                yield token
+        except Exception as e:
+            logger.error(f"Error generating answer: {str(e)}")
+            raise
+    
+    async def agenerate_answer(self, query: str, context: str) -> str:
+        """Generate answer with the async LLM client"""
+        try:
+            return await self._get_rag_chain().ainvoke({"context": context, "question": query})
+        except Exception as e:
+            logger.error(f"Error generating answer: {str(e)}")
+            raise
+    
+    async def agenerate_answer_stream(self, query: str, context: str) -> AsyncIterator[str]:
+        """Yield answer tokens from the async LLM client as they arrive"""
+        try:
+            async for token in self._get_rag_chain().astream({"context": context, "question": query}):
+                yield token
+        except Exception as e:
+            logger.error(f"Error generating answer: {str(e)}")
+            raise
+    
+    def _sources(self, documents: List[Document]) -> List[dict]:
+        """Extract source information"""
+        return [
+            {
+                "chunk_id": doc.id or doc.metadata.get("chunk_id"),
+                "source_file": doc.metadata.get('source_file', 'Unknown'),
+                "page": doc.metadata.get('page', 'N/A'),
+                "content_preview": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
+            }
+            for doc in documents
+        ]
+    
+    def _start_query(self, question: str, k: int, filters: Optional[dict]) -> dict:
+        """Vectorstore check and exact-match cache lookup
+
+        Filtered queries bypass the answer cache: its entries are keyed by
+        question alone.
+        """
+        # Check if vectorstore is available
+        if self._index is None and not self.load_vectorstore():
+            return {"result": {
+                "answer": "No vectorstore available. Please add documents first.",
+                "sources": [],
+                "error": "Vectorstore not found"
+            }}
+        self._reload_if_changed()
+        
+        state = {"started": time.perf_counter(), "version": self.index_version, "filters": filters,
+                 "question": question}
+        cached = None if filters else self.answer_cache.get_exact(question, k, state["version"])
+        return {"result": cached} if cached else state
+    
+    def _with_context(self, state: dict, query_embedding: List[float], retrieved_docs: List[Document],
+                      timings: Timings, rerank_stats: dict) -> dict:
+        if not retrieved_docs:
+            return {"result": {
+                "answer": "I couldn't find any relevant information in the documents to answer your question.",
+                "sources": [],
+                "context": ""
+            }}
+        
+        if rerank_stats:
+            timings.add("rerank", rerank_stats["rerank_ms"] / 1000)
+        with timings.stage("format"):
+            context, context_stats = self.context_builder.build(retrieved_docs)
+        return {
+            **state,
+            "embedding": query_embedding,
+            "documents": retrieved_docs,
+            "context": context,
+            "context_stats": {**context_stats, **rerank_stats},
+        }
+    
+    def _prepare_query(self, question: str, k: int, timings: Timings, filters: Optional[dict] = None,
+                       session_id: Optional[str] = None, history: Optional[List[dict]] = None) -> dict:
+        """Everything before generation: rewriting, cache lookups, retrieval and context formatting
+
+        Returns {"result": ...} when the query is already answered, otherwise
+        the state needed to generate and cache the answer. A follow-up is
+        answered as its standalone rewrite, state["question"].
+        """
+        asked = question
+        if self._condense_input(question, history) is not None:
+            with timings.stage("condense"):
+                question = self.condense_question(question, history, session_id)
+        with timings.stage("cache"):
+            state = self._start_query(question, k, filters)
+        if "result" in state:
+            return self._mark_rewritten(state, asked, question)
+        
+        with timings.stage("embed"):
+            query_embedding = self.embeddings.embed_query(question)
+        if not filters:
+            with timings.stage("cache"):
+                cached = self.answer_cache.get_semantic(query_embedding, k, state["version"])
+            if cached:
+                return self._mark_rewritten({"result": cached}, asked, question)
+        
+        # Retrieve relevant context, or take it from this session's previous search
+        with timings.stage("search"):
+            candidates, state["retrieval_reused"] = self._session_candidates(
+                session_id, question, k, query_embedding, filters, state["version"])
+        retrieved_docs, rerank_stats = self.rerank(question, candidates, k)
+        return self._mark_rewritten(
+            self._with_context(state, query_embedding, retrieved_docs, timings, rerank_stats), asked, question)
+    
+    async def _aprepare_query(self, question: str, k: int, timings: Timings, filters: Optional[dict] = None,
+                              session_id: Optional[str] = None, history: Optional[List[dict]] = None) -> dict:
+        """Async counterpart of _prepare_query"""
+        asked = question
+        if self._condense_input(question, history) is not None:
+            with timings.stage("condense"):
+                question = await self.acondense_question(question, history, session_id)
+        with timings.stage("cache"):
+            if self._index is None:
+                await asyncio.get_running_loop().run_in_executor(self._search_executor, self.load_vectorstore)
+            state = self._start_query(question, k, filters)
+        if "result" in state:
+            return self._mark_rewritten(state, asked, question)
+        
+        with timings.stage("embed"):
+            query_embedding = await self._aembed_query(question)
+        if not filters:
+            with timings.stage("cache"):
+                cached = self.answer_cache.get_semantic(query_embedding, k, state["version"])
+            if cached:
+                return self._mark_rewritten({"result": cached}, asked, question)
+        
+        with timings.stage("search"):
+            candidates, state["retrieval_reused"] = await self._asession_candidates(
+                session_id, question, k, query_embedding, filters, state["version"])
+        retrieved_docs, rerank_stats = await self.arerank(question, candidates, k)
+        return self._mark_rewritten(
+            self._with_context(state, query_embedding, retrieved_docs, timings, rerank_stats), asked, question)
+
+    @staticmethod
+    def _mark_rewritten(prepared: dict, asked: str, question: str) -> dict:
+        """Report the standalone rewrite of a follow-up in the result"""
+        if question != asked:
+            target = prepared["result"] if "result" in prepared else prepared
+            target["standalone_question"] = question
+        return prepared
+    
+    def _new_timings(self) -> Timings:
+        return Timings(self._stage_seconds)
+    
+    def _complete(self, result: dict, timings: Timings) -> dict:
+        """Attach this request's timings and count it by outcome"""
+        if "cache_hit" in result:
+            outcome = f"cache_{result['cache_hit']}"
+        elif "error" in result:
+            outcome = "error"
+        else:
+            outcome = "answered" if result.get("context") else "no_context"
+        self._queries.inc(outcome=outcome)
+        result["timings"] = timings.finish()
+        return result
+    
+    def _finish_query(self, k: int, prepared: dict, answer: str) -> dict:
+        question = prepared["question"]
+        result = {
+            "answer": answer,
+            "sources": self._sources(prepared["documents"]),
+            "context": prepared["context"],
+            "retrieved_docs_count": len(prepared["documents"]),
+            **prepared["context_stats"],
+            "answer_tokens": self.context_builder.count_tokens(answer)
+        }
+        self._query_tokens.observe(result["context_tokens"], kind="context")
+        self._query_tokens.observe(result["tokens_saved"], kind="saved")
+        self._query_tokens.observe(result["answer_tokens"], kind="answer")
+        if not prepared["filters"]:
+            self.answer_cache.put(question, k, prepared["version"], result, prepared["embedding"],
+                                  latency=time.perf_counter() - prepared["started"])
+        # Per-turn details, kept out of the cached answer
+        if "standalone_question" in prepared:
+            result["standalone_question"] = prepared["standalone_question"]
+        if prepared.get("retrieval_reused"):
+            result["retrieval_reused"] = True
+        return result
+    
+    def _error_result(self, e: Exception) -> dict:
+        logger.error(f"Error in RAG pipeline: {str(e)}")
+        return {
+            "answer": f"Sorry, I encountered an error while processing your question: {str(e)}",
+            "sources": [],
+            "error": str(e)
+        }
+    
+    def query(self, question: str, k: int = 4, filters: Optional[dict] = None,
+              session_id: Optional[str] = None, history: Optional[List[dict]] = None) -> dict:
+        """Complete RAG pipeline: retrieve context and generate answer
+
+        With `history` (the session's earlier messages, oldest first) the
+        question is first rewritten as a standalone one; with `session_id`
+        rewrites are cached and a follow-up close to the previous question
+        reuses its retrieved chunks.
+        """
+        timings = self._new_timings()
+        try:
+            with profiled("query"):
+                prepared = self._prepare_query(question, k, timings, filters, session_id, history)
+                if "result" in prepared:
+                    return self._complete(prepared["result"], timings)
+                
+                # Generate answer
+                with timings.stage("generate"):
+                    answer = self.generate_answer(prepared["question"], prepared["context"])
+                return self._complete(self._finish_query(k, prepared, answer), timings)
             
-            if not retrieved_docs:
-                return {
-                    "answer": "I couldn't find any relevant information in the documents to answer your question.",
-                    "sources": [],
-                    "context": ""
-                }
+        except Exception as e:
+            return self._complete(self._error_result(e), timings)
+    
+    def query_stream(self, question: str, k: int = 4, filters: Optional[dict] = None,
+                     session_id: Optional[str] = None, history: Optional[List[dict]] = None) -> Iterator[dict]:
+        """Streaming RAG pipeline
+
+        Yields {"type": "sources"} right after retrieval, then {"type": "token"}
+        events as the answer is generated, and finally {"type": "done"} with the
+        same fields query() returns (or {"type": "error"}).
+        """
+        timings = self._new_timings()
+        try:
+            prepared = self._prepare_query(question, k, timings, filters, session_id, history)
+            if "result" in prepared:
+                result = self._complete(prepared["result"], timings)
+                yield {"type": "sources", "sources": result.get("sources", [])}
+                yield {"type": "token", "content": result["answer"]}
+                yield {"type": "done", **result}
+                return
             
-            # Format context
-            context_str = self.format_context(retrieved_docs)
+            yield {"type": "sources", "sources": self._sources(prepared["documents"])}
+            tokens = []
+            started = time.perf_counter()
+            for token in self.generate_answer_stream(prepared["question"], prepared["context"]):
+                if not tokens:
+                    timings.add("first_token", time.perf_counter() - started)
+                tokens.append(token)
+                yield {"type": "token", "content": token}
+            timings.add("generate", time.perf_counter() - started)
+            result = self._finish_query(k, prepared, "".join(tokens))
+            yield {"type": "done", **self._complete(result, timings)}
             
-            # Generate answer
-            answer = self.generate_answer(question, context_str)
+        except Exception as e:
+            yield {"type": "error", **self._complete(self._error_result(e), timings)}
+    
+    async def aquery(self, question: str, k: int = 4, filters: Optional[dict] = None,
+                     session_id: Optional[str] = None, history: Optional[List[dict]] = None) -> dict:
+        """Async RAG pipeline; many queries can be in flight on one event loop"""
+        timings = self._new_timings()
+        try:
+            with profiled("aquery"):
+                prepared = await self._aprepare_query(question, k, timings, filters, session_id, history)
+                if "result" in prepared:
+                    return self._complete(prepared["result"], timings)
+                
+                with timings.stage("generate"):
+                    answer = await self.agenerate_answer(prepared["question"], prepared["context"])
+                return self._complete(self._finish_query(k, prepared, answer), timings)
             
-            # Extract source information
-            sources = [
-                {
-                    "source_file": doc.metadata.get('source_file', 'Unknown'),
-                    "page": doc.metadata.get('page', 'N/A'),
-                    "content_preview": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content
-                }
-                for doc in retrieved_docs
-            ]
+        except Exception as e:
+            return self._complete(self._error_result(e), timings)
+    
+    async def aquery_stream(self, question: str, k: int = 4, filters: Optional[dict] = None,
+                            session_id: Optional[str] = None,
+                            history: Optional[List[dict]] = None) -> AsyncIterator[dict]:
+        """Async counterpart of query_stream, yielding the same events"""
+        timings = self._new_timings()
+        try:
+            prepared = await self._aprepare_query(question, k, timings, filters, session_id, history)
+            if "result" in prepared:
+                result = self._complete(prepared["result"], timings)
+                yield {"type": "sources", "sources": result.get("sources", [])}
+                yield {"type": "token", "content": result["answer"]}
+                yield {"type": "done", **result}
+                return
             
-            return {
-                "answer": answer,
-                "sources": sources,
-                "context": context_str,
-                "retrieved_docs_count": len(retrieved_docs)
-            }
+            yield {"type": "sources", "sources": self._sources(prepared["documents"])}
+            tokens = []
+            started = time.perf_counter()
+            async for token in self.agenerate_answer_stream(prepared["question"], prepared["context"]):
+                if not tokens:
+                    timings.add("first_token", time.perf_counter() - started)
+                tokens.append(token)
+                yield {"type": "token", "content": token}
+            timings.add("generate", time.perf_counter() - started)
+            result = self._finish_query(k, prepared, "".join(tokens))
+            yield {"type": "done", **self._complete(result, timings)}
             
         except Exception as e:
-            logger.error(f"Error in RAG pipeline: {str(e)}")
-            return {
-                "answer": f"Sorry, I encountered an error while processing your question: {str(e)}",
-                "sources": [],
-                "error": str(e)
-            }
\ No newline at end of file
+            yield {"type": "error", **self._complete(self._error_result(e), timings)}
@@ -0,0 +1,134 @@
+# reranker.py
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+from langchain_core.documents import Document
+from .answer_cache import normalize_question
+import logging
+
+logger = logging.getLogger(__name__)
+
+ScoreKey = Tuple[str, str]
+
+
+def _chunk_key(doc: Document) -> str:
+    return doc.id or doc.metadata.get("chunk_id") or hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+class CrossEncoderReranker:
+    """Reorders retrieved candidates by a cross-encoder's (query, chunk) relevance score
+
+    Candidates are scored in batches in retrieval order. Scores are cached by
+    (query hash, chunk id), so a repeated or paged query costs nothing. Once
+    `latency_budget_ms` is spent, the remaining candidates keep their
+    retrieval order behind the scored ones.
+    """
+
+    def __init__(self, model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size: int = 16,
+                 latency_budget_ms: float = 150.0, cache_size: int = 50000):
+        self.model_name = model
+        self.batch_size = batch_size
+        self.latency_budget_ms = latency_budget_ms
+        self.cache_size = cache_size
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._scores: "OrderedDict[ScoreKey, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {"queries": 0, "scored": 0, "cache_hits": 0,
+                                           "budget_exceeded": 0, "seconds": 0.0}
+
+    @classmethod
+    def from_env(cls) -> "CrossEncoderReranker":
+        return cls(
+            model=os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+            batch_size=int(os.getenv("RERANK_BATCH_SIZE", "16")),
+            latency_budget_ms=float(os.getenv("RERANK_BUDGET_MS", "150")),
+            cache_size=int(os.getenv("RERANK_CACHE_SIZE", "50000")),
+        )
+
+    @property
+    def model(self):
+        # Loaded on first use; the model download is skipped while reranking is off
+        with self._model_lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                except ImportError as e:
+                    raise ImportError("Reranking needs `pip install sentence-transformers`") from e
+                self._model = CrossEncoder(self.model_name, device="cpu")
+                logger.info(f"Loaded reranking model {self.model_name}")
+            return self._model
+
+    def predict(self, pairs: Sequence[Tuple[str, str]]) -> List[float]:
+        return [float(score) for score in self.model.predict(list(pairs), batch_size=self.batch_size,
+                                                              show_progress_bar=False)]
+
+    def _cached(self, keys: List[ScoreKey]) -> List[Optional[float]]:
+        with self._lock:
+            scores = []
+            for key in keys:
+                score = self._scores.get(key)
+                if score is not None:
+                    self._scores.move_to_end(key)
+                scores.append(score)
+            return scores
+
+    def _store(self, keys: List[ScoreKey], scores: List[float]):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._scores[key] = score
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+
+    def rerank(self, query: str, candidates: List[Document], k: int) -> Tuple[List[Document], Dict]:
+        """Top-k candidates by cross-encoder score, plus what the reranking cost"""
+        started = time.perf_counter()
+        query_hash = hashlib.sha1(normalize_question(query).encode("utf-8")).hexdigest()
+        keys = [(query_hash, _chunk_key(doc)) for doc in candidates]
+        scores = self._cached(keys)
+        cache_hits = sum(score is not None for score in scores)
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        scored, budget_exceeded = 0, False
+        deadline = started + self.latency_budget_ms / 1000 if self.latency_budget_ms > 0 else None
+        for start in range(0, len(missing), self.batch_size):
+            if deadline is not None and time.perf_counter() >= deadline:
+                budget_exceeded = True
+                break
+            batch = missing[start:start + self.batch_size]
+            batch_scores = self.predict([(query, candidates[i].page_content) for i in batch])
+            self._store([keys[i] for i in batch], batch_scores)
+            for i, score in zip(batch, batch_scores):
+                scores[i] = score
+            scored += len(batch)
+
+        ranked = sorted((i for i, score in enumerate(scores) if score is not None), key=lambda i: -scores[i])
+        unscored = [i for i, score in enumerate(scores) if score is None]
+        documents = [candidates[i] for i in (ranked + unscored)[:k]]
+
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self.counters["queries"] += 1
+            self.counters["scored"] += scored
+            self.counters["cache_hits"] += cache_hits
+            self.counters["budget_exceeded"] += budget_exceeded
+            self.counters["seconds"] += seconds
+        return documents, {
+            "rerank_candidates": len(candidates),
+            "rerank_scored": scored,
+            "rerank_cache_hits": cache_hits,
+            "rerank_budget_exceeded": budget_exceeded,
+            "rerank_ms": round(seconds * 1000, 3),
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            queries = self.counters["queries"]
+            return {
+                **self.counters,
+                "cache_size": len(self._scores),
+                "mean_ms": round(self.counters["seconds"] * 1000 / queries, 3) if queries else 0.0,
+            }
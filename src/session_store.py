@@ -0,0 +1,198 @@
+# session_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_STORE_PATH = "./vectorstore/chat_sessions.sqlite"
+
+MESSAGE_TYPES = ("user", "bot")
+
+# Source fields kept per message; chunk text stays in the index
+SOURCE_FIELDS = ("chunk_id", "source_file", "page")
+
+
+def compact_sources(sources: Optional[List[dict]]) -> List[dict]:
+    """Chunk references of a result's sources, without their text"""
+    compact, seen = [], set()
+    for source in sources or []:
+        record = {field: source[field] for field in SOURCE_FIELDS if source.get(field) is not None}
+        key = record.get("chunk_id") or (record.get("source_file"), record.get("page"))
+        if key not in seen:
+            seen.add(key)
+            compact.append(record)
+    return compact
+
+
+class SessionStore:
+    """Persistent chat sessions with paginated history, shared by every process
+
+    Messages are appended to SQLite and read a page at a time, so a server
+    holds no history in memory. Sessions idle for longer than `ttl_seconds`
+    are deleted along with their messages.
+    """
+
+    def __init__(self, path: str = DEFAULT_SESSION_STORE_PATH, ttl_seconds: float = 7 * 24 * 3600,
+                 evict_interval: float = 600):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.evict_interval = evict_interval
+        self._last_eviction = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, created REAL NOT NULL, last_activity REAL NOT NULL, "
+            "message_count INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "session_id TEXT NOT NULL REFERENCES sessions (id) ON DELETE CASCADE, "
+            "type TEXT NOT NULL, content TEXT NOT NULL, created REAL NOT NULL, sources TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_activity ON sessions (last_activity)")
+
+    @classmethod
+    def from_env(cls, path: Optional[str] = None) -> "SessionStore":
+        return cls(
+            path=path or os.getenv("SESSION_STORE_PATH", DEFAULT_SESSION_STORE_PATH),
+            ttl_seconds=float(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600))),
+        )
+
+    def create_session(self, session_id: Optional[str] = None) -> str:
+        session_id = session_id or str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO sessions (id, created, last_activity) VALUES (?, ?, ?)",
+                (session_id, now, now),
+            )
+        self._maybe_evict()
+        return session_id
+
+    def get_session(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            return dict(row) if row is not None else None
+
+    def list_sessions(self, limit: int = 20) -> List[dict]:
+        """Most recently active sessions first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM sessions ORDER BY last_activity DESC LIMIT ?", (limit,)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def add_message(self, session_id: str, message_type: str, content: str,
+                    sources: Optional[List[dict]] = None) -> int:
+        """Append a message; sources are stored as chunk references"""
+        if message_type not in MESSAGE_TYPES:
+            raise ValueError(f"Unknown message type: {message_type}")
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO sessions (id, created, last_activity) VALUES (?, ?, ?) "
+                    "ON CONFLICT (id) DO NOTHING",
+                    (session_id, now, now),
+                )
+                message_id = self._conn.execute(
+                    "INSERT INTO messages (session_id, type, content, created, sources) VALUES (?, ?, ?, ?, ?)",
+                    (session_id, message_type, content, now, json.dumps(compact_sources(sources))),
+                ).lastrowid
+                self._conn.execute(
+                    "UPDATE sessions SET last_activity = ?, message_count = message_count + 1 WHERE id = ?",
+                    (now, session_id),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._maybe_evict()
+        return message_id
+
+    def get_messages(self, session_id: str, limit: int = 20, before_id: Optional[int] = None,
+                     after_id: Optional[int] = None) -> List[dict]:
+        """The latest `limit` messages older than `before_id` and newer than `after_id`, oldest first"""
+        query = "SELECT * FROM messages WHERE session_id = ?"
+        params: list = [session_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        if after_id is not None:
+            query += " AND id > ?"
+            params.append(after_id)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        messages = []
+        for row in reversed(rows):
+            message = dict(row)
+            message["sources"] = json.loads(message["sources"]) if message["sources"] else []
+            messages.append(message)
+        return messages
+
+    def last_message_id(self, session_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(id) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            return row[0] or 0
+
+    def delete_session(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Delete sessions idle for longer than the TTL, returning how many"""
+        if self.ttl_seconds <= 0:
+            return 0
+        cutoff = (now or time.time()) - self.ttl_seconds
+        with self._lock:
+            evicted = self._conn.execute("DELETE FROM sessions WHERE last_activity < ?", (cutoff,)).rowcount
+        if evicted:
+            logger.info(f"Evicted {evicted} idle chat sessions")
+        return evicted
+
+    def _maybe_evict(self):
+        now = time.time()
+        if now - self._last_eviction >= self.evict_interval:
+            self._last_eviction = now
+            self.evict_idle(now)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            sessions, messages = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(message_count), 0) FROM sessions"
+            ).fetchone()
+        return {"sessions": sessions, "messages": messages, "ttl_seconds": self.ttl_seconds}
+
+
+_stores: Dict[str, SessionStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_session_store(path: Optional[str] = None) -> SessionStore:
+    """Return the process-wide store for a path"""
+    path = path or os.getenv("SESSION_STORE_PATH", DEFAULT_SESSION_STORE_PATH)
+    key = str(Path(path).resolve())
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = SessionStore.from_env(path)
+        return _stores[key]
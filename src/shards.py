@@ -0,0 +1,114 @@
+# shards.py
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+SHARD_STRATEGIES = ("hash", "collection")
+
+# Collection of files without tags
+DEFAULT_COLLECTION = "default"
+
+
+class ShardConfig:
+    """How files are assigned to shards
+
+    `hash` spreads files over `count` shards by a hash of their name;
+    `collection` gives each collection (a file's first tag) its own shard.
+    One hash shard means the plain, unsharded layout.
+    """
+
+    def __init__(self, count: int = 1, by: str = "hash"):
+        if by not in SHARD_STRATEGIES:
+            raise ValueError(f"Unsupported SHARD_BY: {by} (expected {' or '.join(SHARD_STRATEGIES)})")
+        if count < 1:
+            raise ValueError(f"INDEX_SHARDS must be at least 1, got {count}")
+        self.count = count
+        self.by = by
+
+    @classmethod
+    def from_env(cls) -> "ShardConfig":
+        return cls(count=int(os.getenv("INDEX_SHARDS", "1")), by=os.getenv("SHARD_BY", "hash"))
+
+    @property
+    def enabled(self) -> bool:
+        return self.by == "collection" or self.count > 1
+
+    def shard_for(self, file_name: str, tags: Optional[List[str]] = None) -> str:
+        if self.by == "collection":
+            collection = re.sub(r"[^a-z0-9_-]+", "-", (tags[0] if tags else DEFAULT_COLLECTION).lower()).strip("-")
+            return f"collection-{collection or DEFAULT_COLLECTION}"
+        digest = hashlib.sha1(file_name.encode("utf-8")).digest()
+        return f"shard-{int.from_bytes(digest[:8], 'big') % self.count:02d}"
+
+    def assign(self, file_names: Iterable[str], tags: Optional[Mapping[str, List[str]]] = None) -> Dict[str, List[str]]:
+        """Group file names by the shard they belong to"""
+        tags = tags or {}
+        shards: Dict[str, List[str]] = {}
+        for name in sorted(file_names):
+            shards.setdefault(self.shard_for(name, tags.get(name)), []).append(name)
+        return shards
+
+
+class ShardManifest:
+    """Lists the shards of a sharded index with their files, chunk counts and versions
+
+    Stored as shards.json in the index directory, whose shards are complete
+    indexes in subdirectories. `version` is bumped whenever any shard is
+    republished, so readers can tell when the index has changed.
+    """
+
+    FILENAME = "shards.json"
+
+    def __init__(self, shards: Optional[Dict[str, dict]] = None, version: int = 0):
+        self.shards: Dict[str, dict] = shards or {}
+        self.version = version
+
+    @classmethod
+    def path_for(cls, index_dir: Path) -> Path:
+        return Path(index_dir) / cls.FILENAME
+
+    @classmethod
+    def exists(cls, index_dir: Path) -> bool:
+        return cls.path_for(index_dir).exists()
+
+    @classmethod
+    def load(cls, index_dir: Path) -> "ShardManifest":
+        path = cls.path_for(index_dir)
+        if not path.exists():
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(shards=data.get("shards", {}), version=data.get("version", 0))
+
+    def save(self, index_dir: Path):
+        self.version += 1
+        path = self.path_for(index_dir)
+        tmp_path = path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "shards": self.shards}, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def record(self, name: str, manifest) -> bool:
+        """Update a shard's entry from its IndexManifest, returning whether it changed"""
+        entry = {"version": manifest.version, "files": sorted(manifest.files),
+                 "chunks": len(manifest.all_chunk_ids())}
+        changed = self.shards.get(name) != entry
+        self.shards[name] = entry
+        return changed
+
+    def shard_of(self, file_name: str) -> Optional[str]:
+        return next((name for name, entry in self.shards.items() if file_name in entry["files"]), None)
+
+    def describe(self) -> Dict[str, dict]:
+        return {name: {"version": entry["version"], "files": len(entry["files"]), "chunks": entry["chunks"]}
+                for name, entry in sorted(self.shards.items())}
+
+
+def is_sharded(index_dir: Path) -> bool:
+    return ShardManifest.exists(index_dir)
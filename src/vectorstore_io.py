@@ -0,0 +1,474 @@
+# vectorstore_io.py
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import uuid
+from collections.abc import Mapping
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from .index_factory import supports_removal
+import faiss
+import heapq
+import numpy as np
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: index writes are only serialized within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.faiss"
+CHUNKS_FILE = "chunks.sqlite"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+
+_SQL_BATCH = 500
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Chunk text and metadata in SQLite, read one row at a time on demand
+
+    Read-only stores open the published file as immutable, which is safe
+    because a new index version replaces the file instead of modifying it.
+    """
+
+    def __init__(self, path: Path, read_only: bool = False):
+        self.path = Path(path)
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            return sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro&immutable=1",
+                                   uri=True, check_same_thread=False)
+        conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, text TEXT NOT NULL, metadata TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS positions (position INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL)")
+        return conn
+
+    def search(self, search: str) -> Union[str, Document]:
+        with self._lock:
+            row = self._conn.execute("SELECT text, metadata FROM chunks WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        rows = [(id_, doc.page_content, json.dumps(doc.metadata)) for id_, doc in texts.items()]
+        with self._lock:
+            try:
+                self._conn.executemany("INSERT INTO chunks (id, text, metadata) VALUES (?, ?, ?)", rows)
+            except sqlite3.IntegrityError as e:
+                raise ValueError(f"Tried to add ids that already exist: {e}") from e
+
+    def delete(self, ids: List) -> None:
+        with self._lock:
+            for start in range(0, len(ids), _SQL_BATCH):
+                batch = ids[start:start + _SQL_BATCH]
+                self._conn.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def all_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM chunks")]
+
+    def get_documents(self, ids: Sequence[str]) -> List[Document]:
+        """Fetch many chunks at once, in no particular order"""
+        documents = []
+        with self._lock:
+            for start in range(0, len(ids), _SQL_BATCH):
+                batch = list(ids[start:start + _SQL_BATCH])
+                rows = self._conn.execute(
+                    f"SELECT id, text, metadata FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                documents.extend(Document(id=id_, page_content=text, metadata=json.loads(metadata))
+                                 for id_, text, metadata in rows)
+        return documents
+
+    def iter_documents(self) -> Iterator[Document]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, text, metadata FROM chunks").fetchall()
+        for id_, text, metadata in rows:
+            yield Document(id=id_, page_content=text, metadata=json.loads(metadata))
+
+    def position_map(self) -> Dict[int, str]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT position, chunk_id FROM positions"))
+
+    def write_positions(self, index_to_docstore_id: Mapping):
+        with self._lock:
+            self._conn.execute("DELETE FROM positions")
+            self._conn.executemany(
+                "INSERT INTO positions (position, chunk_id) VALUES (?, ?)",
+                ((int(position), chunk_id) for position, chunk_id in index_to_docstore_id.items()),
+            )
+            self._conn.commit()
+
+    def move_to(self, path: Path):
+        """Commit and atomically move the store file into place
+
+        The store is reopened read-only there: once published it must not change.
+        """
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+            os.replace(self.path, path)
+            self.path = Path(path)
+            self.read_only = True
+            self._conn = self._connect()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SQLiteIndexMap(Mapping):
+    """Read-only FAISS position -> chunk id mapping, looked up lazily per hit"""
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self._docstore = docstore
+
+    def __getitem__(self, position) -> str:
+        with self._docstore._lock:
+            row = self._docstore._conn.execute(
+                "SELECT chunk_id FROM positions WHERE position = ?", (int(position),)
+            ).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __len__(self) -> int:
+        with self._docstore._lock:
+            return self._docstore._conn.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
+
+    def __iter__(self) -> Iterator[int]:
+        with self._docstore._lock:
+            positions = [row[0] for row in self._docstore._conn.execute("SELECT position FROM positions ORDER BY position")]
+        return iter(positions)
+
+
+def _documents_at(vectorstore: FAISS, distances, positions) -> List[Tuple[Document, float]]:
+    hits = []
+    for distance, position in zip(distances, positions):
+        if position == -1:
+            # Fewer than k vectors matched
+            continue
+        chunk_id = vectorstore.index_to_docstore_id.get(int(position))
+        # None for a tombstone, when the search could not exclude it
+        doc = vectorstore.docstore.search(chunk_id) if chunk_id is not None else None
+        if isinstance(doc, Document):
+            hits.append((doc, float(distance)))
+    return hits
+
+
+def search_documents(vectorstore: FAISS, vectors: Sequence[Sequence[float]], k: int,
+                     params=None) -> List[List[Tuple[Document, float]]]:
+    """Search a matrix of query vectors in one call, returning (document, distance) hits per query"""
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    distances, positions = vectorstore.index.search(matrix, k, params=params)
+    return [_documents_at(vectorstore, row_distances, row_positions)
+            for row_distances, row_positions in zip(distances, positions)]
+
+
+def search_subset(vectorstore: FAISS, vector: Sequence[float], k: int, positions: np.ndarray,
+                  params_for=None, exact_max: int = 50000) -> List[Tuple[Document, float]]:
+    """Search only the vectors at `positions` (FAISS ids)
+
+    Up to `exact_max` of them are reconstructed and scored exactly, which
+    costs time proportional to the subset. Larger subsets, and indexes that
+    cannot reconstruct vectors (IVF without a direct map), are searched
+    through the index with an IDSelectorBatch; `params_for(selector)` builds
+    the search parameters around it.
+    """
+    index = vectorstore.index
+    query = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+    k = min(k, len(positions))
+    if k == 0:
+        return []
+    if len(positions) <= exact_max:
+        try:
+            vectors = index.reconstruct_batch(positions)
+        except RuntimeError:
+            vectors = None
+        if vectors is not None:
+            subset = faiss.IndexFlat(index.d, index.metric_type)
+            subset.add(vectors)
+            distances, local = subset.search(query, k)
+            return _documents_at(vectorstore, distances[0], np.where(local[0] >= 0, positions[local[0]], -1))
+
+    selector = faiss.IDSelectorBatch(np.ascontiguousarray(positions, dtype=np.int64))
+    params = params_for(selector) if params_for else faiss.SearchParameters(sel=selector)
+    distances, found = index.search(query, k, params=params)
+    return _documents_at(vectorstore, distances[0], found[0])
+
+
+def append_embeddings(vectorstore: FAISS, text_embeddings: Iterable[Tuple[str, Sequence[float]]],
+                      metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None) -> List[str]:
+    """FAISS.add_embeddings, numbering new vectors after every vector the index holds
+
+    LangChain numbers them from the size of the position map, which falls
+    behind the index once removed chunks are left in it as tombstones.
+    """
+    texts, vectors = zip(*text_embeddings)
+    ids = ids or [str(uuid.uuid4()) for _ in texts]
+    metadatas = metadatas or [{} for _ in texts]
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if vectorstore._normalize_L2:
+        faiss.normalize_L2(matrix)
+    vectorstore.docstore.add({id_: Document(id=id_, page_content=text, metadata=metadata)
+                              for id_, text, metadata in zip(ids, texts, metadatas)})
+    start = vectorstore.index.ntotal
+    vectorstore.index.add(matrix)
+    vectorstore.index_to_docstore_id.update({start + i: id_ for i, id_ in enumerate(ids)})
+    return ids
+
+
+def delete_chunks(vectorstore: FAISS, chunk_ids: List[str]):
+    """Remove chunks from a writable vectorstore
+
+    Flat indexes drop the vectors. IVF and HNSW indexes keep them as
+    tombstones: the chunk leaves the docstore and the position map, and
+    searches skip its position until the index is next rebuilt.
+    """
+    if supports_removal(vectorstore.index):
+        vectorstore.delete(chunk_ids)
+        return
+    removed = set(chunk_ids)
+    for position in [position for position, chunk_id in vectorstore.index_to_docstore_id.items()
+                     if chunk_id in removed]:
+        del vectorstore.index_to_docstore_id[position]
+    vectorstore.docstore.delete(list(chunk_ids))
+
+
+def tombstoned_positions(vectorstore: FAISS) -> np.ndarray:
+    """Positions of vectors still in the index whose chunks were deleted"""
+    mapping = vectorstore.index_to_docstore_id
+    if len(mapping) >= vectorstore.index.ntotal:
+        return np.empty(0, dtype=np.int64)
+    live = np.fromiter(mapping, dtype=np.int64, count=len(mapping))
+    return np.setdiff1d(np.arange(vectorstore.index.ntotal, dtype=np.int64), live, assume_unique=True)
+
+
+def merge_hits(hit_lists: Sequence[List[Tuple[Document, float]]], k: int,
+               higher_is_better: bool = False) -> List[Tuple[Document, float]]:
+    """Top k of several indexes' (document, distance) hits, e.g. one list per shard"""
+    hits = (hit for hits in hit_lists for hit in hits)
+    select = heapq.nlargest if higher_is_better else heapq.nsmallest
+    return select(k, hits, key=lambda hit: hit[1])
+
+
+class IndexWriteLock:
+    """Serializes writers of one index directory across threads and processes
+
+    Reentrant within a thread, so a sync that falls back to a full rebuild
+    keeps the lock it already holds.
+    """
+
+    def __init__(self, index_dir: Path):
+        index_dir = Path(index_dir)
+        self.lock_file = index_dir.parent / f".{index_dir.name}.lock"
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            self.lock_file.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+
+
+_write_locks: Dict[str, IndexWriteLock] = {}
+_write_locks_lock = threading.Lock()
+
+
+def index_write_lock(index_dir: Path) -> IndexWriteLock:
+    """Return the process-wide write lock for an index directory"""
+    key = str(Path(index_dir).absolute())
+    with _write_locks_lock:
+        if key not in _write_locks:
+            _write_locks[key] = IndexWriteLock(Path(index_dir))
+        return _write_locks[key]
+
+
+@contextmanager
+def staged_index_dir(index_dir: Path) -> Iterator[Path]:
+    """Yield an empty directory to write a new index version into, then publish it
+
+    `index_dir` is a symlink to the current version directory, so swapping it
+    is a single atomic rename: readers see either the old files or the new
+    ones, never a mix. The previous version is kept for readers still opening
+    it; older ones are removed.
+    """
+    index_dir = Path(index_dir)
+    index_dir.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(dir=index_dir.parent, prefix=f".{index_dir.name}-v"))
+    try:
+        yield staging
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    _publish(staging, index_dir)
+
+
+def _publish(staging: Path, index_dir: Path):
+    previous = None
+    if index_dir.is_symlink():
+        previous = index_dir.resolve()
+    elif index_dir.exists():
+        # First publish over a plain directory from an older version of the app
+        previous = index_dir.parent / f".{index_dir.name}-v{uuid.uuid4().hex[:8]}"
+        os.rename(index_dir, previous)
+
+    link = index_dir.parent / f".{index_dir.name}.link-{uuid.uuid4().hex[:8]}"
+    try:
+        os.symlink(staging.name, link, target_is_directory=True)
+    except OSError:
+        # No symlink support: fall back to a rename, briefly leaving no index
+        if index_dir.is_symlink():
+            index_dir.unlink()
+        os.rename(staging, index_dir)
+    else:
+        os.replace(link, index_dir)
+
+    keep = {staging.name, previous.name if previous else None}
+    for old in index_dir.parent.glob(f".{index_dir.name}-v*"):
+        if old.is_dir() and old.name not in keep:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def unpublish(index_dir: Path):
+    """Remove a published index and its kept versions"""
+    index_dir = Path(index_dir)
+    if index_dir.is_symlink():
+        index_dir.unlink()
+    elif index_dir.exists():
+        shutil.rmtree(index_dir, ignore_errors=True)
+    for old in index_dir.parent.glob(f".{index_dir.name}-v*"):
+        if old.is_dir():
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def has_vectorstore(index_dir: Path) -> bool:
+    return (Path(index_dir) / INDEX_FILE).exists()
+
+
+def new_working_docstore(index_dir: Path) -> SQLiteDocstore:
+    """Create a private docstore file next to the index for a writer to fill"""
+    index_dir = Path(index_dir)
+    index_dir.parent.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=index_dir.parent, prefix=f".{index_dir.name}-", suffix=".sqlite")
+    os.close(fd)
+    return SQLiteDocstore(Path(path))
+
+
+def discard_working_copy(vectorstore: FAISS):
+    """Delete the private docstore of a writable load that will not be saved"""
+    docstore = vectorstore.docstore
+    if isinstance(docstore, SQLiteDocstore) and not docstore.read_only:
+        docstore.close()
+        docstore.path.unlink(missing_ok=True)
+
+
+def _read_index(index_file: Path, mmap: bool):
+    if mmap:
+        # Flat codes and IVF lists are mapped from disk instead of copied into RAM
+        for flags in (faiss.IO_FLAG_MMAP_IFC, faiss.IO_FLAG_MMAP):
+            try:
+                return faiss.read_index(str(index_file), flags | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                continue
+        logger.warning(f"Could not memory-map {index_file}, reading it into memory")
+    return faiss.read_index(str(index_file))
+
+
+def load_vectorstore(index_dir: Path, embeddings: Embeddings, read_only: bool = True) -> FAISS:
+    """Load a vectorstore written by save_vectorstore
+
+    Read-only loads memory-map the index and look chunks up lazily in SQLite.
+    Writable loads read the index into memory and work on a private copy of
+    the docstore, so readers of the published files are never disturbed.
+    Indexes in the legacy pickle format are still loaded and are converted on
+    the next save.
+    """
+    published_dir = Path(index_dir)
+    # Pin one published version, even if a new one is swapped in while loading
+    index_dir = published_dir.resolve()
+    chunks_file = index_dir / CHUNKS_FILE
+    if not chunks_file.exists():
+        # Warning: Only use allow_dangerous_deserialization if you trust the source
+        return FAISS.load_local(str(index_dir), embeddings, allow_dangerous_deserialization=True)
+
+    index = _read_index(index_dir / INDEX_FILE, mmap=read_only)
+    if read_only:
+        docstore = SQLiteDocstore(chunks_file, read_only=True)
+        return FAISS(embeddings, index, docstore, SQLiteIndexMap(docstore))
+
+    docstore = new_working_docstore(published_dir)
+    docstore.close()
+    shutil.copyfile(chunks_file, docstore.path)
+    docstore = SQLiteDocstore(docstore.path)
+    return FAISS(embeddings, index, docstore, docstore.position_map())
+
+
+def save_vectorstore(vectorstore: FAISS, index_dir: Path):
+    """Write index.faiss and chunks.sqlite, replacing each file atomically"""
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    chunks_file = index_dir / CHUNKS_FILE
+
+    docstore = vectorstore.docstore
+    if not isinstance(docstore, SQLiteDocstore) or docstore.read_only:
+        # Convert an in-memory (or legacy pickled) docstore
+        converted = new_working_docstore(index_dir)
+        if isinstance(docstore, InMemoryDocstore):
+            documents = docstore._dict.items()
+        else:
+            documents = ((doc.id, doc) for doc in docstore.iter_documents())
+        batch = {}
+        for chunk_id, doc in documents:
+            batch[chunk_id] = doc
+            if len(batch) >= _SQL_BATCH:
+                converted.add(batch)
+                batch = {}
+        converted.add(batch)
+        docstore = converted
+    docstore.write_positions(vectorstore.index_to_docstore_id)
+    if docstore.path != chunks_file:
+        docstore.move_to(chunks_file)
+    vectorstore.docstore = docstore
+
+    tmp_index = index_dir / f"{INDEX_FILE}.tmp"
+    faiss.write_index(vectorstore.index, str(tmp_index))
+    os.replace(tmp_index, index_dir / INDEX_FILE)
+
+    legacy = index_dir / LEGACY_DOCSTORE_FILE
+    if legacy.exists():
+        legacy.unlink()
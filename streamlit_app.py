@@ -1,6 +1,5 @@
 # streamlit_app_standalone.py
 import streamlit as st
-import uuid
 from datetime import datetime
 from pathlib import Path
 import os
@@ -10,7 +9,10 @@ import tempfile
 
 # Import the local modules directly
 from src.document_processor import DocumentProcessor
+from src.ingest_queue import get_ingest_queue, start_ingest_worker
+from src.metadata_index import save_file_tags
 from src.rag_pipeline import RAGPipeline
+from src.session_store import get_session_store
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,30 +21,53 @@ logger = logging.getLogger(__name__)
 st.set_page_config(page_title="RAG Chatbot", layout="wide")
 st.title("📚 RAG Chatbot")
 
+# One processor and one pipeline per server process: every session shares the
+# same loaded index instead of holding its own copy
+@st.cache_resource
+def get_processor() -> DocumentProcessor:
+    return DocumentProcessor()
+
+@st.cache_resource
+def get_rag_pipeline() -> RAGPipeline:
+    return RAGPipeline()
+
+# Uploads and syncs are queued and run by one background worker, so indexing
+# never blocks a session and concurrent uploads never race on the index
+@st.cache_resource
+def get_ingest_worker():
+    return start_ingest_worker(DocumentProcessor())
+
+get_ingest_worker()
+
+# Chat history lives in the session store, not in session_state: the app keeps
+# only cursors and reads one page of messages per rerun
+HISTORY_PAGE_SIZE = 20
+CONVERSATION_MESSAGES = 6
+
 # Initialize session state
 if "session_id" not in st.session_state:
     st.session_state.session_id = None
-if "current_session" not in st.session_state:
-    st.session_state.current_session = []
+if "conversation_start" not in st.session_state:
+    st.session_state.conversation_start = 0
+if "history_limit" not in st.session_state:
+    st.session_state.history_limit = HISTORY_PAGE_SIZE
 if "show_chat_history" not in st.session_state:
     st.session_state.show_chat_history = False
 if "user_input" not in st.session_state:
     st.session_state.user_input = ""
 if "vectorstore_loaded" not in st.session_state:
     st.session_state.vectorstore_loaded = False
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = {}
 if "processor" not in st.session_state:
-    st.session_state.processor = DocumentProcessor()
+    st.session_state.processor = get_processor()
 if "rag_pipeline" not in st.session_state:
-    st.session_state.rag_pipeline = RAGPipeline()
+    st.session_state.rag_pipeline = get_rag_pipeline()
 
 # Initialize components
 def init_components():
     if "processor" not in st.session_state:
-        st.session_state.processor = DocumentProcessor()
+        st.session_state.processor = get_processor()
     if "rag_pipeline" not in st.session_state:
-        st.session_state.rag_pipeline = RAGPipeline()
+        st.session_state.rag_pipeline = get_rag_pipeline()
     if "vectorstore_loaded" not in st.session_state:
         st.session_state.vectorstore_loaded = False
 
@@ -61,6 +86,7 @@ uploaded_files = st.sidebar.file_uploader(
     type=["pdf", "txt"], 
     accept_multiple_files=True
 )
+upload_tags = st.sidebar.text_input("Tags for uploaded files (comma-separated)", value="")
 
 def save_uploaded_files(uploaded_files):
     """Save uploaded files to data directory"""
@@ -71,48 +97,45 @@ def save_uploaded_files(uploaded_files):
             with open(file_path, "wb") as f:
                 f.write(uploaded_file.getbuffer())
             saved_files.append(file_path)
+            if upload_tags.strip():
+                save_file_tags(data_dir, uploaded_file.name, upload_tags.split(","))
             st.sidebar.success(f"Saved: {uploaded_file.name}")
         except Exception as e:
             st.sidebar.error(f"Failed to save {uploaded_file.name}: {str(e)}")
     return saved_files
 
-def process_uploaded_files(file_paths):
-    """Process uploaded files and update vectorstore"""
-    try:
-        processor = st.session_state.processor
-        
-        # Check if vectorstore exists
-        existing_store = processor.load_existing_vectorstore()
-        if existing_store:
-            # Add to existing store
-            chunks_added = processor.add_documents_to_existing_store(file_paths)
-            st.session_state.vectorstore_loaded = True
-            return {"message": "Documents added to existing vectorstore", "chunks_added": chunks_added}
-        else:
-            # Create new vectorstore
-            vectorstore, chunk_count = processor.process_documents()
-            st.session_state.vectorstore_loaded = True
-            return {"message": "New vectorstore created", "chunks_processed": chunk_count}
-            
-    except Exception as e:
-        logger.error(f"Error processing documents: {str(e)}")
-        raise
-
 if st.sidebar.button("📤 Upload & Process Documents") and uploaded_files:
     with st.sidebar:
-        with st.spinner("Saving and processing documents..."):
-            try:
-                # Save uploaded files
-                saved_files = save_uploaded_files(uploaded_files)
-                if saved_files:
-                    # Process the files
-                    result = process_uploaded_files(saved_files)
-                    st.sidebar.success("✅ Documents processed successfully!")
-                    st.sidebar.json(result)
-                else:
-                    st.sidebar.error("❌ No files were saved successfully")
-            except Exception as e:
-                st.sidebar.error(f"❌ Failed to process documents: {str(e)}")
+        saved_files = save_uploaded_files(uploaded_files)
+        if saved_files:
+            job_id = get_ingest_queue().enqueue("upload", [file_path.name for file_path in saved_files])
+            st.sidebar.info(f"⏳ Queued indexing job #{job_id}; see Ingestion Jobs below")
+        else:
+            st.sidebar.error("❌ No files were saved successfully")
+
+if st.sidebar.button("🔄 Sync Data Folder"):
+    job_id = get_ingest_queue().enqueue("sync")
+    st.sidebar.info(f"⏳ Queued sync job #{job_id}; see Ingestion Jobs below")
+
+JOB_ICONS = {"queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌"}
+
+with st.sidebar.expander("🗂️ Ingestion Jobs"):
+    st.button("🔄 Refresh", key="refresh_jobs")
+    jobs = get_ingest_queue().list_jobs(limit=5)
+    if not jobs:
+        st.write("No ingestion jobs yet")
+    for job in jobs:
+        st.write(f"{JOB_ICONS.get(job['status'], '')} #{job['id']} {job['kind']} - {job['status']}")
+        if job["files"]:
+            done = sum(f["status"] in ("chunked", "indexed") for f in job["files"])
+            st.progress(done / len(job["files"]))
+            for f in job["files"]:
+                chunks = f" ({f['chunks']} chunks)" if f["chunks"] is not None else ""
+                st.caption(f"{f['name']}: {f['status']}{chunks}")
+        if job["error"]:
+            st.error(job["error"])
+        elif job["result"]:
+            st.json(job["result"], expanded=False)
 
 def list_documents():
     """List all documents in data directory"""
@@ -139,9 +162,8 @@ def load_vectorstore():
         processor = st.session_state.processor
         rag_pipeline = st.session_state.rag_pipeline
         
-        # Try to load vectorstore
-        if processor.load_existing_vectorstore():
-            # Also load it in the RAG pipeline
+        # The pipeline loads the index once per process through the shared registry
+        if processor.vectorstore_exists():
             if rag_pipeline.load_vectorstore():
                 st.session_state.vectorstore_loaded = True
                 return {"message": "Vectorstore loaded successfully", "exists": True}
@@ -166,57 +188,64 @@ if st.sidebar.button("🔍 Load Vectorstore"):
 # Chat session management
 st.sidebar.subheader("💬 Chat Sessions")
 
-# Create new session
-if st.sidebar.button("🆕 New Chat Session"):
-    st.session_state.session_id = str(uuid.uuid4())
-    st.session_state.current_session = []
+def start_session(session_id=None):
+    """Create a session, or resume a stored one, with an empty current conversation"""
+    store = get_session_store()
+    session_id = store.create_session(session_id)
+    st.session_state.session_id = session_id
+    st.session_state.conversation_start = store.last_message_id(session_id)
+    st.session_state.history_limit = HISTORY_PAGE_SIZE
     st.session_state.user_input = ""
-    st.sidebar.success(f"New session started: {st.session_state.session_id[:8]}...")
-
-# Initialize chat history for current session
-def init_session_history(session_id):
-    """Initialize chat history for a session"""
-    if session_id not in st.session_state.chat_history:
-        st.session_state.chat_history[session_id] = {
-            "session_id": session_id,
-            "created_at": datetime.now(),
-            "last_activity": datetime.now(),
-            "messages": []
-        }
-
-def update_session_activity(session_id):
-    """Update last activity timestamp for session"""
-    if session_id in st.session_state.chat_history:
-        st.session_state.chat_history[session_id]["last_activity"] = datetime.now()
+    # Keeps the session across page reloads and server restarts
+    st.query_params["session"] = session_id
+    return session_id
 
 def add_message_to_session(session_id, message_type, content, sources=None):
-    """Add a message to session history"""
-    init_session_history(session_id)
-    
-    message = {
-        "type": message_type,
-        "content": content,
-        "timestamp": datetime.now(),
-        "sources": sources or []
-    }
-    
-    st.session_state.chat_history[session_id]["messages"].append(message)
-    update_session_activity(session_id)
+    """Add a message to session history; sources are stored as chunk references"""
+    get_session_store().add_message(session_id, message_type, content, sources)
 
-def get_session_history(session_id):
-    """Get chat history for a session"""
-    init_session_history(session_id)
-    return st.session_state.chat_history[session_id]
+def get_session_history(session_id, limit=HISTORY_PAGE_SIZE):
+    """Latest messages of a session, oldest first"""
+    return get_session_store().get_messages(session_id, limit=limit)
 
 def delete_session(session_id):
     """Delete a chat session"""
-    if session_id in st.session_state.chat_history:
-        del st.session_state.chat_history[session_id]
+    get_session_store().delete_session(session_id)
     if st.session_state.session_id == session_id:
         st.session_state.session_id = None
-        st.session_state.current_session = []
+        st.session_state.conversation_start = 0
         st.session_state.user_input = ""
         st.session_state.show_chat_history = False
+        st.query_params.pop("session", None)
+
+def format_timestamp(created):
+    return datetime.fromtimestamp(created).strftime('%Y-%m-%d %H:%M:%S')
+
+def show_sources(sources):
+    with st.expander("📚 Sources"):
+        for source in sources:
+            st.write(f"• {source.get('source_file', 'Unknown')} (Page {source.get('page', 'N/A')})")
+
+# Resume the session named in the URL after a reload or restart
+requested_session = st.query_params.get("session")
+if st.session_state.session_id is None and requested_session and get_session_store().get_session(requested_session):
+    start_session(requested_session)
+
+# Create new session
+if st.sidebar.button("🆕 New Chat Session"):
+    start_session()
+    st.sidebar.success(f"New session started: {st.session_state.session_id[:8]}...")
+
+recent_sessions = {session["id"]: session for session in get_session_store().list_sessions(limit=10)}
+if recent_sessions:
+    resume_id = st.sidebar.selectbox(
+        "Recent sessions",
+        list(recent_sessions),
+        format_func=lambda session_id: f"{session_id[:8]}... ({recent_sessions[session_id]['message_count']} messages)",
+    )
+    if st.sidebar.button("↩️ Resume Session") and resume_id != st.session_state.session_id:
+        start_session(resume_id)
+        st.rerun()
 
 # Health check
 if st.sidebar.button("🌐 Check System Status"):
@@ -241,6 +270,12 @@ if st.sidebar.button("🌐 Check System Status"):
         if st.session_state.session_id:
             status_msg.append(f"✅ Active session: {st.session_state.session_id[:8]}...")
         
+        cache_stats = st.session_state.rag_pipeline.answer_cache.stats()
+        status_msg.append(
+            f"⚡ Answer cache: {cache_stats['size']} entries, hit rate {cache_stats['hit_rate']:.0%}, "
+            f"{cache_stats['latency_saved_seconds']}s saved"
+        )
+        
         st.sidebar.info("\n".join(status_msg))
 
 # Main chat interface
@@ -259,22 +294,25 @@ if st.session_state.session_id and st.button("📜 Show Chat History"):
     st.session_state.show_chat_history = not st.session_state.show_chat_history
 
 if st.session_state.show_chat_history and st.session_state.session_id:
-    history = get_session_history(st.session_state.session_id)
+    messages = get_session_history(st.session_state.session_id, limit=st.session_state.history_limit)
+    session = get_session_store().get_session(st.session_state.session_id)
     st.subheader("📜 Session Chat History")
     
-    messages = history.get("messages", [])
+    if session and session["message_count"] > len(messages):
+        if st.button(f"⬆️ Load older messages ({session['message_count'] - len(messages)} more)"):
+            st.session_state.history_limit += HISTORY_PAGE_SIZE
+            st.rerun()
+    
     if messages:
         for message in messages:
             if message["type"] == "user":
                 st.markdown(f"**🧑 You:** {message['content']}")
-                st.caption(f"*{message['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}*")
+                st.caption(f"*{format_timestamp(message['created'])}*")
             else:
                 st.markdown(f"**🤖 Bot:** {message['content']}")
                 if message.get("sources"):
-                    with st.expander("📚 Sources"):
-                        for source in message["sources"]:
-                            st.write(f"• {source.get('source_file', 'Unknown')} (Page {source.get('page', 'N/A')})")
-                st.caption(f"*{message['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}*")
+                    show_sources(message["sources"])
+                st.caption(f"*{format_timestamp(message['created'])}*")
             st.divider()
     else:
         st.info("No messages in this session yet.")
@@ -283,12 +321,18 @@ if st.session_state.show_chat_history and st.session_state.session_id:
 user_input = st.text_input("Ask a question:", value=st.session_state.user_input, key="user_input_widget")
 k_slider = st.slider("Number of relevant chunks (k):", min_value=1, max_value=10, value=4)
 
+# Restrict retrieval to some documents; an empty picker searches everything
+indexed_documents = st.session_state.rag_pipeline.list_documents() if st.session_state.vectorstore_loaded else []
+picked_files = st.multiselect("Search only these documents:",
+                              [doc["source_file"] for doc in indexed_documents])
+picked_tags = st.multiselect("Search only documents tagged:",
+                             sorted({tag for doc in indexed_documents for tag in doc["tags"]}))
+query_filters = {key: value for key, value in (("source_files", picked_files), ("tags", picked_tags)) if value} or None
+
 if st.button("🚀 Send") and user_input.strip():
     if not st.session_state.session_id:
         # Create new session if none exists
-        st.session_state.session_id = str(uuid.uuid4())
-        st.session_state.current_session = []
-        init_session_history(st.session_state.session_id)
+        start_session()
     
     if not st.session_state.vectorstore_loaded:
         # Try to load vectorstore if not loaded
@@ -297,56 +341,71 @@ if st.button("🚀 Send") and user_input.strip():
             st.error("❌ No vectorstore available. Please upload and process documents first.")
             st.stop()
     
-    with st.spinner("Thinking..."):
-        try:
-            # Execute query using RAG pipeline
-            rag_pipeline = st.session_state.rag_pipeline
-            result = rag_pipeline.query(user_input, k=k_slider)
-            
-            # Add to session history
-            add_message_to_session(
-                st.session_state.session_id, 
-                "user", 
-                user_input
-            )
-            
-            add_message_to_session(
-                st.session_state.session_id,
-                "bot",
-                result["answer"],
-                result.get("sources", [])
-            )
-            
-            # Add to current session display
-            st.session_state.current_session.append(("You", user_input))
-            st.session_state.current_session.append(("Bot", result["answer"]))
-            
-            # Clear the input for next question
-            st.session_state.user_input = ""
-            
-        except Exception as e:
-            st.error(f"❌ Error: {str(e)}")
-            logger.error(f"Query error: {str(e)}", exc_info=True)
-
-# Display current conversation if any
-if st.session_state.current_session:
+    # Answer tokens are rendered as they arrive; the box is cleared once the
+    # exchange moves into the conversation view below
+    stream_box = st.empty()
+    try:
+        # Execute query using RAG pipeline
+        rag_pipeline = st.session_state.rag_pipeline
+        result = {}
+        # Earlier turns of this conversation, for rewriting follow-up questions
+        history = get_session_store().get_messages(
+            st.session_state.session_id, limit=CONVERSATION_MESSAGES, after_id=st.session_state.conversation_start
+        )
+        
+        def answer_tokens():
+            for event in rag_pipeline.query_stream(user_input, k=k_slider, filters=query_filters,
+                                                   session_id=st.session_state.session_id, history=history):
+                if event["type"] == "token":
+                    yield event["content"]
+                elif event["type"] == "sources" and event["sources"]:
+                    files = sorted({source.get('source_file', 'Unknown') for source in event["sources"]})
+                    st.caption("📚 Sources: " + ", ".join(files))
+                else:
+                    result.update(event)
+        
+        with stream_box.container():
+            st.markdown(f"**🧑 You:** {user_input}")
+            with st.spinner("Thinking..."):
+                st.write_stream(answer_tokens())
+        stream_box.empty()
+        
+        # Add to session history
+        add_message_to_session(
+            st.session_state.session_id, 
+            "user", 
+            user_input
+        )
+        
+        add_message_to_session(
+            st.session_state.session_id,
+            "bot",
+            result["answer"],
+            result.get("sources", [])
+        )
+        
+        # Clear the input for next question
+        st.session_state.user_input = ""
+        
+    except Exception as e:
+        st.error(f"❌ Error: {str(e)}")
+        logger.error(f"Query error: {str(e)}", exc_info=True)
+
+# Display current conversation if any: the latest exchanges since it was cleared
+conversation = get_session_store().get_messages(
+    st.session_state.session_id, limit=CONVERSATION_MESSAGES, after_id=st.session_state.conversation_start
+) if st.session_state.session_id else []
+if conversation:
     st.subheader("💭 Current Conversation")
-    for i, (sender, msg) in enumerate(st.session_state.current_session):
-        if sender == "You":
-            st.markdown(f"**🧑 {sender}:** {msg}")
+    for message in conversation:
+        if message["type"] == "user":
+            st.markdown(f"**🧑 You:** {message['content']}")
         else:
-            st.markdown(f"**🤖 {sender}:** {msg}")
+            st.markdown(f"**🤖 Bot:** {message['content']}")
             
             # Show sources for bot messages
-            if st.session_state.session_id:
-                history = get_session_history(st.session_state.session_id)
-                messages = history.get("messages", [])
-                if messages and len(messages) > i//2:
-                    bot_message = messages[i//2]
-                    if bot_message.get("type") == "bot" and bot_message.get("sources"):
-                        with st.expander("📚 Sources"):
-                            for source in bot_message["sources"]:
-                                st.write(f"• {source.get('source_file', 'Unknown')} (Page {source.get('page', 'N/A')})")
+            if message.get("sources"):
+                show_sources(message["sources"])
 
 # Session management buttons
 if st.session_state.session_id:
@@ -354,7 +413,7 @@ if st.session_state.session_id:
 
     with col1:
         if st.button("🔄 Clear Current Chat"):
-            st.session_state.current_session = []
+            st.session_state.conversation_start = get_session_store().last_message_id(st.session_state.session_id)
             st.session_state.user_input = ""
             st.rerun()
 
@@ -0,0 +1,61 @@
+# conftest.py
+import hashlib
+import re
+from pathlib import Path
+from typing import List
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic unit vectors seeded by the text, so a chunk's own text is its nearest neighbour"""
+
+    model = "hash-embeddings"
+
+    def __init__(self, dim: int = 16):
+        self.dim = dim
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vector(text)
+
+
+class WordEncoding:
+    """Stands in for a tiktoken encoding offline: words and whitespace runs are the tokens"""
+
+    def encode_ordinary(self, text: str) -> List[str]:
+        return re.findall(r"\S+|\s+", text)
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+def write_corpus(data_dir: Path, files: int = 6, paragraphs: int = 12):
+    """Text files whose paragraphs each name their file and position, e.g. `token3x4`"""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(files):
+        (data_dir / f"f{i}.txt").write_text("\n\n".join(
+            f"paragraph {j} of file {i} token{i}x{j} " + "filler words here " * 10 for j in range(paragraphs)
+        ), encoding="utf-8")
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """Isolated data, index and cache paths, with offline embeddings and no API key needed"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "embedding_cache.sqlite"))
+    monkeypatch.setenv("PAGE_TEXT_CACHE_PATH", str(tmp_path / "page_text_cache.sqlite"))
+    monkeypatch.setenv("INGEST_WORKERS", "1")
+    embeddings = HashEmbeddings()
+    monkeypatch.setattr("src.document_processor.get_embeddings", lambda: embeddings)
+    monkeypatch.setattr("src.rag_pipeline.get_embeddings", lambda: embeddings)
+    write_corpus(tmp_path / "data")
+    return tmp_path
@@ -0,0 +1,77 @@
+# test_answer_cache.py
+import numpy as np
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from src.answer_cache import AnswerCache
+from src.document_processor import DocumentProcessor
+from src.rag_pipeline import RAGPipeline
+
+from conftest import WordEncoding
+
+
+def _near(vector: np.ndarray, angle: float) -> np.ndarray:
+    """A unit vector at `angle` radians from `vector`"""
+    other = np.zeros_like(vector)
+    other[1] = 1.0
+    return np.cos(angle) * vector + np.sin(angle) * other
+
+
+def test_exact_tier_matches_normalized_questions():
+    cache = AnswerCache()
+    cache.set_version(1)
+    cache.put("What is FAISS?", 4, 1, {"answer": "a vector index"})
+    hit = cache.get_exact("  what is   faiss ", 4, 1)
+    assert hit == {"answer": "a vector index", "cache_hit": "exact"}
+    assert cache.get_exact("what is faiss", 8, 1) is None
+    # Hits are copies, so callers cannot change the cached result
+    hit["answer"] = "changed"
+    assert cache.get_exact("what is faiss", 4, 1)["answer"] == "a vector index"
+
+
+def test_semantic_tier_matches_close_embeddings_only():
+    cache = AnswerCache(similarity_threshold=0.95)
+    cache.set_version(1)
+    embedding = np.eye(8, dtype=np.float32)[0]
+    cache.put("what is faiss", 4, 1, {"answer": "a vector index"}, embedding=embedding)
+    # cos(0.1) is about 0.995, cos(0.5) about 0.88
+    assert cache.get_semantic(_near(embedding, 0.1), 4, 1)["cache_hit"] == "semantic"
+    assert cache.get_semantic(_near(embedding, 0.5), 4, 1) is None
+    assert cache.get_semantic(embedding, 8, 1) is None
+    stats = cache.stats()
+    assert (stats["hits_semantic"], stats["misses"]) == (1, 2)
+
+
+def test_version_change_drops_every_entry():
+    cache = AnswerCache()
+    cache.set_version(1)
+    embedding = np.eye(8, dtype=np.float32)[0]
+    cache.put("what is faiss", 4, 1, {"answer": "old"}, embedding=embedding)
+    cache.set_version(2)
+    assert cache.get_exact("what is faiss", 4, 2) is None
+    assert cache.get_semantic(embedding, 4, 2) is None
+    assert cache.stats()["invalidations"] == 1
+    # An answer computed against the replaced index is not stored
+    cache.put("what is faiss", 4, 1, {"answer": "old"}, embedding=embedding)
+    assert cache.stats()["size"] == 0
+
+
+def test_pipeline_answers_from_cache_until_the_index_changes(workspace):
+    data_dir = workspace / "data"
+    vectorstore_path = str(workspace / "vectorstore" / "faiss_index")
+    processor = DocumentProcessor(str(data_dir), vectorstore_path)
+    processor.process_documents()
+    pipeline = RAGPipeline(vectorstore_path)
+    pipeline.context_builder._encoding = WordEncoding()
+    pipeline.llm = FakeListChatModel(responses=["first", "second"])
+    assert pipeline.load_vectorstore()
+
+    assert pipeline.query("token2x3 filler", k=4)["answer"] == "first"
+    cached = pipeline.query("Token2x3 filler?", k=4)
+    assert (cached["answer"], cached["cache_hit"]) == ("first", "exact")
+
+    (data_dir / "f2.txt").write_text("replaced paragraph token2x3 " + "other words " * 20, encoding="utf-8")
+    processor.sync_documents()
+    fresh = pipeline.query("token2x3 filler", k=4)
+    assert fresh["answer"] == "second"
+    assert "cache_hit" not in fresh
+    assert pipeline.answer_cache.stats()["invalidations"] == 1
@@ -0,0 +1,43 @@
+# test_bm25_index.py
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from src.bm25_index import BM25Index, tokenize
+from src.document_processor import DocumentProcessor
+
+
+def _postings(bm25: BM25Index) -> dict:
+    """chunk id -> term frequencies, read back out of the CSR arrays"""
+    postings = {chunk_id.decode("utf-8"): Counter() for chunk_id in bm25.chunk_ids}
+    indptr = np.asarray(bm25.indptr)
+    for term_index, term in enumerate(bm25.terms):
+        for posting in range(indptr[term_index], indptr[term_index + 1]):
+            chunk_id = bm25.chunk_ids[bm25.docs[posting]].decode("utf-8")
+            postings[chunk_id][term.decode("utf-8")] = int(bm25.tfs[posting])
+    return postings
+
+
+def _assert_postings_match_text(processor: DocumentProcessor):
+    vectorstore = processor.load_existing_vectorstore()
+    documents = {doc.id: doc.page_content for doc in vectorstore.docstore.iter_documents()}
+    postings = _postings(BM25Index.load(processor.vectorstore_path))
+    assert set(postings) == set(documents)
+    for chunk_id, text in documents.items():
+        assert postings[chunk_id] == Counter(tokenize(text))
+
+
+@pytest.mark.parametrize("operation", ["process_documents", "sync_documents"])
+def test_rechunking_the_same_files_replaces_their_postings(workspace, operation):
+    processor = DocumentProcessor(str(workspace / "data"), str(workspace / "vectorstore" / "faiss_index"))
+    processor.process_documents()
+    _assert_postings_match_text(processor)
+
+    processor.chunk_size, processor.chunk_overlap = 300, 50
+    stats = getattr(processor, operation)()
+    if operation == "sync_documents":
+        assert len(stats["changed"]) == 6
+    _assert_postings_match_text(processor)
+    # Now identical settings: nothing to re-chunk
+    assert processor.sync_documents()["changed"] == []
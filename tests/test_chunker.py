@@ -0,0 +1,60 @@
+# test_chunker.py
+from pathlib import Path
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.chunking import load_texts, synthetic_texts
+from src.chunker import Chunker, chunk_texts
+
+from conftest import WordEncoding
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+
+def word_length(text: str) -> int:
+    """Token count offline, where tiktoken cannot download its encoding"""
+    return len(WordEncoding().encode_ordinary(text))
+
+
+@pytest.fixture(scope="module")
+def texts(tmp_path_factory) -> dict:
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # Keep extracted page text out of the repository's vectorstore directory
+        monkeypatch.setenv("PAGE_TEXT_CACHE_PATH", str(tmp_path_factory.mktemp("cache") / "pages.sqlite"))
+        real = load_texts(str(DATA_DIR))
+    assert any(path.suffix == ".pdf" for path in DATA_DIR.iterdir()) and len(real) > 1
+    return {"synthetic": synthetic_texts(0.2, seed=0), "real": real}
+
+
+@pytest.mark.parametrize("source", ["synthetic", "real"])
+@pytest.mark.parametrize("unit,chunk_size,chunk_overlap", [
+    ("chars", 1000, 200),
+    ("chars", 300, 0),
+    ("tokens", 200, 40),
+    ("tokens", 64, 16),
+])
+def test_chunks_match_the_langchain_splitter(texts, source, unit, chunk_size, chunk_overlap):
+    length = word_length if unit == "tokens" else len
+    reference = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                               length_function=length)
+    chunker = Chunker(chunk_size, chunk_overlap, token_length=word_length if unit == "tokens" else None)
+    for text in texts[source]:
+        assert chunker.split_text(text) == reference.split_text(text)
+
+
+def test_tiktoken_chunks_match_when_the_encoding_loads(texts):
+    try:
+        chunker = Chunker.from_tiktoken_encoder(chunk_size=200, chunk_overlap=40)
+    except Exception as e:
+        pytest.skip(f"tiktoken encoding unavailable: {e}")
+    reference = RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_size=200, chunk_overlap=40)
+    for text in texts["synthetic"] + texts["real"]:
+        assert chunker.split_text(text) == reference.split_text(text)
+
+
+def test_worker_processes_return_the_same_spans(texts):
+    chunker = Chunker(1000, 200)
+    sample = texts["real"] + texts["synthetic"][:20]
+    spans = chunk_texts(sample, 1000, 200, workers=2, batch_size=8)
+    assert [s.texts(text) for s, text in zip(spans, sample)] == [chunker.split_text(text) for text in sample]
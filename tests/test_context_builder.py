@@ -0,0 +1,23 @@
+# test_context_builder.py
+import tiktoken
+from langchain_core.documents import Document
+
+from src.context_builder import ContextBuilder
+from src.embedding_executor import EstimatedEncoding
+
+
+def test_builds_within_budget_when_tiktoken_cannot_load(monkeypatch):
+    def offline(name):
+        raise ConnectionError("no network")
+    monkeypatch.setattr(tiktoken, "get_encoding", offline)
+    monkeypatch.setattr("src.embedding_executor._encodings", {})
+
+    builder = ContextBuilder(token_budget=100)
+    documents = [Document(page_content=f"chunk {i} " + "word " * 60, metadata={"source_file": f"f{i}.txt"})
+                 for i in range(3)]
+    context, stats = builder.build(documents)
+    assert isinstance(builder.encoding, EstimatedEncoding)
+    # About 4 characters per token
+    assert stats["context_tokens"] <= 100
+    assert len(context) <= 400
+    assert context.startswith("[Document 1 - f0.txt (Page N/A)]:\nchunk 0 word")
@@ -0,0 +1,51 @@
+# test_conversation.py
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from src.document_processor import DocumentProcessor
+from src.rag_pipeline import RAGPipeline
+
+from conftest import WordEncoding
+
+
+@pytest.fixture
+def make_pipeline(workspace, monkeypatch):
+    # Every query reaches retrieval, so reuse is what decides whether the index is searched
+    monkeypatch.setenv("ANSWER_CACHE_SIZE", "0")
+    vectorstore_path = str(workspace / "vectorstore" / "faiss_index")
+    DocumentProcessor(str(workspace / "data"), vectorstore_path).process_documents()
+
+    def make(retrieval_mode: str, responses=("answer",) * 20) -> RAGPipeline:
+        monkeypatch.setenv("RETRIEVAL_MODE", retrieval_mode)
+        pipeline = RAGPipeline(vectorstore_path)
+        pipeline.context_builder._encoding = WordEncoding()
+        pipeline.llm = FakeListChatModel(responses=list(responses))
+        assert pipeline.load_vectorstore()
+        return pipeline
+    return make
+
+
+def _chunk_ids(result: dict) -> list:
+    return [source["chunk_id"] for source in result["sources"]]
+
+
+@pytest.mark.parametrize("retrieval_mode", ["dense", "hybrid"])
+def test_session_follow_up_matches_a_fresh_search(make_pipeline, retrieval_mode):
+    fresh = make_pipeline(retrieval_mode).query("token3x4 filler", k=4)
+    pipeline = make_pipeline(retrieval_mode)
+    first = pipeline.query("token3x4 filler", k=4, session_id="s")
+    follow_up = pipeline.query("token3x4 filler", k=4, session_id="s")
+    assert _chunk_ids(first) == _chunk_ids(fresh)
+    assert _chunk_ids(follow_up) == _chunk_ids(fresh)
+    # A dense pool re-sorted by exact distance is the same search; a fused one is not
+    assert follow_up.get("retrieval_reused", False) == (retrieval_mode == "dense")
+
+
+def test_follow_up_is_answered_as_its_standalone_rewrite(make_pipeline):
+    pipeline = make_pipeline("dense", responses=["what is token3x4", "answer", "answer"])
+    history = [{"type": "user", "content": "tell me about token3x4"}, {"type": "bot", "content": "answer"}]
+    result = pipeline.query("what is it", k=4, session_id="s", history=history)
+    assert result["standalone_question"] == "what is token3x4"
+    assert _chunk_ids(result) == _chunk_ids(make_pipeline("dense").query("what is token3x4", k=4))
+    # The rewrite is cached for the same conversation state; no second LLM call
+    assert pipeline.condense_question("what is it", history, "s") == "what is token3x4"
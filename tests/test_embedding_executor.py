@@ -0,0 +1,139 @@
+# test_embedding_executor.py
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from conftest import HashEmbeddings
+from src.embedding_executor import EmbeddingExecutor, EstimatedEncoding, RateLimiter
+
+
+class FakeClock:
+    """Replaces the executor's view of time, so waits are recorded instead of slept"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: List[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+class FakeAsyncio:
+    def __init__(self, clock: FakeClock):
+        self.sleep = clock.sleep
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("src.embedding_executor.time",
+                        SimpleNamespace(monotonic=clock.monotonic, perf_counter=time.perf_counter))
+    monkeypatch.setattr("src.embedding_executor.asyncio", FakeAsyncio(clock))
+    return clock
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class FlakyEmbeddings(Embeddings):
+    """Fails the first `failures` calls with `error`, then embeds"""
+
+    def __init__(self, failures: int, error: Exception):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+        self.inner = HashEmbeddings()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.inner.embed_query(text)
+
+
+def make_executor(embeddings: Embeddings, **kwargs) -> EmbeddingExecutor:
+    executor = EmbeddingExecutor(embeddings, **kwargs)
+    # Token counts come from the character estimate, as they would offline
+    executor._encoding = EstimatedEncoding()
+    return executor
+
+
+def test_rpm_allows_a_burst_then_one_request_per_interval(clock):
+    limiter = RateLimiter(rpm=60)
+
+    async def acquire_all():
+        for _ in range(62):
+            await limiter.acquire(1)
+
+    asyncio.run(acquire_all())
+    assert clock.sleeps == pytest.approx([1.0, 1.0])
+
+
+def test_tpm_waits_for_the_missing_tokens(clock):
+    limiter = RateLimiter(tpm=1000)
+
+    async def acquire_twice():
+        await limiter.acquire(600)
+        await limiter.acquire(600)
+
+    asyncio.run(acquire_twice())
+    # 400 tokens left; the other 200 refill at 1000 per minute
+    assert sum(clock.sleeps) == pytest.approx(12.0)
+
+
+def test_batches_share_the_executor_limits(clock):
+    executor = make_executor(HashEmbeddings(), max_batch_size=2, rpm=2)
+    texts = [f"text {i}" for i in range(8)]
+    vectors = executor.embed_documents(texts)
+    assert vectors == HashEmbeddings().embed_documents(texts)
+    assert executor.last_stats.batches == 4
+    # Two requests fit the burst; each of the other two waits half a minute
+    assert sum(clock.sleeps) == pytest.approx(60.0)
+    # The same limiter keeps counting on the next call
+    executor.embed_documents(["one more"])
+    assert sum(clock.sleeps) == pytest.approx(90.0)
+
+
+def test_retryable_errors_back_off_and_retry(clock):
+    flaky = FlakyEmbeddings(failures=2, error=RateLimitError("slow down"))
+    executor = make_executor(flaky, max_retries=3)
+    texts = ["alpha", "beta", "gamma"]
+    assert executor.embed_documents(texts) == HashEmbeddings().embed_documents(texts)
+    assert flaky.calls == 3
+    assert executor.last_stats.retries == 2
+    # Exponential backoff with jitter: 1s then 2s, each scaled by 0.5-1
+    assert 0.5 <= clock.sleeps[0] <= 1.0
+    assert 1.0 <= clock.sleeps[1] <= 2.0
+
+
+def test_retries_give_up_after_max_retries(clock):
+    flaky = FlakyEmbeddings(failures=10, error=RateLimitError("slow down"))
+    executor = make_executor(flaky, max_retries=2)
+    with pytest.raises(RateLimitError):
+        executor.embed_documents(["alpha"])
+    assert flaky.calls == 3
+
+
+def test_other_errors_are_not_retried(clock):
+    flaky = FlakyEmbeddings(failures=1, error=ValueError("bad input"))
+    executor = make_executor(flaky)
+    with pytest.raises(ValueError):
+        executor.embed_documents(["alpha"])
+    assert flaky.calls == 1
+    assert clock.sleeps == []
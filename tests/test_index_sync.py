@@ -0,0 +1,96 @@
+# test_index_sync.py
+import numpy as np
+import pytest
+
+from src.chunker import get_chunker
+from src.document_processor import DocumentProcessor, TrainingBuffer
+from src.rag_pipeline import RAGPipeline
+
+from conftest import HashEmbeddings
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "ivf_pq", "hnsw"])
+def test_sync_after_delete_keeps_chunks_aligned(workspace, monkeypatch, index_type):
+    monkeypatch.setenv("INDEX_TYPE", index_type)
+    monkeypatch.setenv("INDEX_NLIST", "4")
+    monkeypatch.setenv("INDEX_PQ_M", "4")
+    # Room for the replaced files' tombstones, so IVF and HNSW sync in place
+    monkeypatch.setenv("INDEX_MAX_TOMBSTONES", "0.5")
+    # Exact distances from the embedding cache make even ivf_pq return the chunk itself
+    monkeypatch.setenv("RESCORE_CANDIDATES", "50")
+    data_dir = workspace / "data"
+    vectorstore_path = str(workspace / "vectorstore" / "faiss_index")
+    processor = DocumentProcessor(str(data_dir), vectorstore_path)
+    processor.process_documents()
+
+    (data_dir / "f1.txt").unlink()
+    (data_dir / "f3.txt").write_text("replaced paragraph token3x0 " + "other words " * 20, encoding="utf-8")
+    stats = processor.sync_documents()
+    assert stats["mode"] == "sync"
+
+    pipeline = RAGPipeline(vectorstore_path)
+    assert pipeline.load_vectorstore()
+    chunker = get_chunker(processor.chunk_size, processor.chunk_overlap)
+    # Exhaustive probing, so only a misaligned id map can return another chunk
+    pipeline.nprobe = 4
+    for name in ("f0.txt", "f3.txt", "f5.txt"):
+        for text in chunker.split_text((data_dir / name).read_text(encoding="utf-8")):
+            [doc] = pipeline.retrieve_context(text, k=1)
+            assert doc.metadata["source_file"] == name
+            assert doc.page_content == text
+    assert "f1.txt" not in {doc["source_file"] for doc in pipeline.list_documents()}
+    # Tombstoned vectors are skipped without costing a result slot
+    loaded = pipeline._index
+    live = len(loaded.vectorstore.index_to_docstore_id)
+    assert loaded.vectorstore.index.ntotal > live or index_type == "flat"
+    [hits] = loaded.search([HashEmbeddings().embed_query("token0x0")], k=live, nprobe=4)
+    assert len(hits) == live
+
+
+@pytest.mark.parametrize("index_type", ["ivf_flat", "hnsw"])
+def test_sync_rebuilds_past_the_tombstone_limit(workspace, monkeypatch, index_type):
+    monkeypatch.setenv("INDEX_TYPE", index_type)
+    monkeypatch.setenv("INDEX_NLIST", "4")
+    monkeypatch.setenv("INDEX_MAX_TOMBSTONES", "0.1")
+    data_dir = workspace / "data"
+    processor = DocumentProcessor(str(data_dir), str(workspace / "vectorstore" / "faiss_index"))
+    processor.process_documents()
+
+    # 3 of 18 chunks is more than a tenth of the index
+    (data_dir / "f1.txt").unlink()
+    assert processor.sync_documents()["mode"] == "rebuild"
+    vectorstore = processor.load_existing_vectorstore()
+    assert vectorstore.index.ntotal == len(vectorstore.index_to_docstore_id) == 15
+
+
+def test_training_sample_is_capped_and_batches_replay_in_order():
+    buffer = TrainingBuffer(sample_size=50)
+    batches = [np.full((40, 4), i, dtype=np.float32) for i in range(10)]
+    for i, vectors in enumerate(batches):
+        buffer.add([f"t{i}"] * 40, vectors, [{}] * 40, None)
+    assert buffer.sample.shape == (50, 4)
+    # Drawn from the whole stream, not just the first batches
+    assert buffer.sample[:, 0].max() >= 5
+    assert [vectors[0, 0] for _, vectors, _, _ in buffer.replay()] == list(range(10))
+    buffer.close()
+
+
+def test_worker_processes_index_every_chunk(workspace, monkeypatch):
+    monkeypatch.setenv("INGEST_WORKERS", "2")
+    monkeypatch.setenv("INDEX_TYPE", "ivf_flat")
+    monkeypatch.setenv("INDEX_NLIST", "4")
+    monkeypatch.setenv("INDEX_TRAIN_SIZE", "8")
+    data_dir = workspace / "data"
+    vectorstore_path = str(workspace / "vectorstore" / "faiss_index")
+    processor = DocumentProcessor(str(data_dir), vectorstore_path)
+    vectorstore, chunk_count = processor.process_documents()
+    assert chunk_count > 8
+    assert vectorstore.index.ntotal == chunk_count
+
+    pipeline = RAGPipeline(vectorstore_path)
+    assert pipeline.load_vectorstore()
+    pipeline.nprobe = 4
+    chunker = get_chunker(processor.chunk_size, processor.chunk_overlap)
+    for text in chunker.split_text((data_dir / "f4.txt").read_text(encoding="utf-8")):
+        [doc] = pipeline.retrieve_context(text, k=1)
+        assert doc.page_content == text
@@ -0,0 +1,95 @@
+# test_ingest_queue.py
+import time
+
+import pytest
+
+from src.ingest_queue import IngestQueue
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    def make(lease_seconds: float = 60.0) -> IngestQueue:
+        return IngestQueue(str(tmp_path / "ingest_jobs.sqlite"), lease_seconds=lease_seconds)
+    return make
+
+
+@pytest.fixture
+def as_worker(monkeypatch):
+    """Make the queue act on behalf of the named worker"""
+    def switch(name: str):
+        monkeypatch.setattr("src.ingest_queue._worker_id", lambda: name)
+    switch("worker-a")
+    return switch
+
+
+def test_claim_takes_jobs_oldest_first(make_queue, as_worker):
+    queue = make_queue()
+    first = queue.enqueue("upload", ["a.txt", "b.txt"])
+    second = queue.enqueue("sync")
+    job = queue.claim()
+    assert (job["id"], job["status"], job["worker"]) == (first, "running", "worker-a")
+    assert [f["status"] for f in job["files"]] == ["processing", "processing"]
+    assert queue.claim()["id"] == second
+    assert queue.claim() is None
+    assert queue.pending_count() == 2
+
+
+def test_heartbeat_renews_only_the_holders_lease(make_queue, as_worker):
+    queue = make_queue(lease_seconds=0.3)
+    job_id = queue.enqueue("sync")
+    queue.claim()
+    for _ in range(3):
+        time.sleep(0.15)
+        assert queue.heartbeat(job_id)
+        assert queue.requeue_orphans() == 0
+    as_worker("worker-b")
+    assert not queue.heartbeat(job_id)
+
+
+def test_expired_lease_is_requeued_and_the_old_worker_cannot_close_it(make_queue, as_worker):
+    queue = make_queue(lease_seconds=0.05)
+    job_id = queue.enqueue("upload", ["a.txt"])
+    queue.claim()
+    queue.update_file(job_id, "a.txt", "chunked", chunks=3)
+    time.sleep(0.1)
+    assert queue.requeue_orphans() == 1
+    job = queue.get(job_id)
+    assert (job["status"], job["worker"]) == ("queued", None)
+    assert job["files"][0]["status"] == "queued"
+
+    # The worker that lost its lease finds out on its next heartbeat or when it finishes
+    assert not queue.heartbeat(job_id)
+    assert not queue.finish(job_id, {"chunks_added": 3})
+    assert not queue.fail(job_id, "too late")
+    assert queue.get(job_id)["status"] == "queued"
+
+    as_worker("worker-b")
+    assert queue.claim()["worker"] == "worker-b"
+    as_worker("worker-a")
+    assert not queue.finish(job_id, {"chunks_added": 3})
+    assert queue.get(job_id)["status"] == "running"
+
+
+def test_finish_records_the_result_and_file_states(make_queue, as_worker):
+    queue = make_queue()
+    job_id = queue.enqueue("upload", ["a.txt", "b.doc"])
+    queue.claim()
+    queue.update_file(job_id, "a.txt", "chunked", chunks=3)
+    assert queue.finish(job_id, {"chunks_added": 3})
+    job = queue.get(job_id)
+    assert (job["status"], job["result"]) == ("done", {"chunks_added": 3})
+    assert {f["name"]: (f["status"], f["chunks"]) for f in job["files"]} == {
+        "a.txt": ("indexed", 3), "b.doc": ("skipped", None)
+    }
+    assert queue.pending_count() == 0
+
+
+def test_fail_marks_every_file_failed(make_queue, as_worker):
+    queue = make_queue()
+    job_id = queue.enqueue("upload", ["a.txt", "b.txt"])
+    queue.claim()
+    queue.update_file(job_id, "a.txt", "chunked", chunks=3)
+    assert queue.fail(job_id, "disk full")
+    job = queue.get(job_id)
+    assert (job["status"], job["error"]) == ("failed", "disk full")
+    assert {f["status"] for f in job["files"]} == {"failed"}
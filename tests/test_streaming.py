@@ -0,0 +1,55 @@
+# test_streaming.py
+import asyncio
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from src.document_processor import DocumentProcessor
+from src.rag_pipeline import RAGPipeline
+
+from conftest import WordEncoding
+
+ANSWER = "token1x2 is in paragraph 2 of file 1"
+
+
+@pytest.fixture
+def pipeline(workspace):
+    vectorstore_path = str(workspace / "vectorstore" / "faiss_index")
+    DocumentProcessor(str(workspace / "data"), vectorstore_path).process_documents()
+    pipeline = RAGPipeline(vectorstore_path)
+    pipeline.context_builder._encoding = WordEncoding()
+    # Streams the response one character at a time
+    pipeline.llm = FakeListChatModel(responses=[ANSWER])
+    assert pipeline.load_vectorstore()
+    return pipeline
+
+
+async def _collect(events) -> list:
+    return [event async for event in events]
+
+
+def _check_events(events: list):
+    assert [event["type"] for event in events] == ["sources"] + ["token"] * len(ANSWER) + ["done"]
+    tokens = [event["content"] for event in events if event["type"] == "token"]
+    assert tokens == list(ANSWER)
+    done = events[-1]
+    assert done["answer"] == ANSWER
+    assert done["sources"] == events[0]["sources"]
+    assert done["timings"]["first_token"] <= done["timings"]["generate"]
+
+
+def test_query_stream_yields_tokens_in_order_then_the_answer(pipeline):
+    _check_events(list(pipeline.query_stream("token1x2 filler", k=4)))
+
+
+def test_aquery_stream_yields_tokens_in_order_then_the_answer(pipeline):
+    _check_events(asyncio.run(_collect(pipeline.aquery_stream("token1x2 filler", k=4))))
+
+
+def test_cached_answer_streams_as_one_token(pipeline):
+    first = list(pipeline.query_stream("token1x2 filler", k=4))
+    events = list(pipeline.query_stream("token1x2 filler", k=4))
+    assert [event["type"] for event in events] == ["sources", "token", "done"]
+    assert events[1]["content"] == ANSWER
+    assert events[-1]["cache_hit"] == "exact"
+    assert events[-1]["sources"] == first[-1]["sources"]